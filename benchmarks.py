@@ -0,0 +1,154 @@
+"""Rough benchmarks for the hot paths of everpy.
+
+Run with `python benchmarks.py`. Nothing here talks to Evernote.
+"""
+from __future__ import print_function
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from everpy_enex import EnexNote, EnexResource, EnexWriter, iter_enex
+from everpy_enml import rewrite_text
+
+NOTE_HEADER = "<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'><en-note>"
+NOTE_FOOTER = "</en-note>"
+
+
+def make_note(size):
+    """Build an ENML note of roughly size bytes."""
+    row = "<div style=\"color: red;\">Call 123 fake st about the <b>lease</b> &amp; keys</div><div><br/></div>"
+    return NOTE_HEADER + row * (size // len(row)) + NOTE_FOOTER
+
+
+def soup_rewrite(content, find_string, replace_string):
+    """The BeautifulSoup based find and replace used before everpy_enml."""
+    from bs4 import BeautifulSoup
+    original_content = re.search(r"<en-note>((.|\n)+)<\/en-note>", content).group(1)
+    soup = BeautifulSoup(original_content, "html.parser")
+    original_matches = soup.findAll(text=re.compile(find_string))
+    new_matches = [re.sub(find_string, replace_string, match) for match in original_matches]
+    for i, m in enumerate(soup.findAll(text=re.compile(find_string))):
+        m.replaceWith(new_matches[i])
+    return content.replace(original_content, str(soup))
+
+
+FIND_STRING, REPLACE_STRING = "123 fake st", "545 new st"
+REWRITERS = {
+    "rewrite_text": lambda content: rewrite_text(content, re.compile(FIND_STRING), REPLACE_STRING),
+    "beautifulsoup": lambda content: soup_rewrite(content, FIND_STRING, REPLACE_STRING),
+}
+
+# Peak RSS never goes down within a process, so every rewrite is measured in a process of its own.
+REWRITE_PROBE = """
+import sys, time
+import benchmarks
+content = benchmarks.make_note(int(sys.argv[2]))
+before = benchmarks.peak_rss()
+start = time.time()
+try:
+    benchmarks.REWRITERS[sys.argv[1]](content)
+except (ImportError, RuntimeError) as e:
+    # RuntimeError is the recursion limit the (.|\\n)+ regex hits on large notes.
+    print("skipped %r" % e)
+else:
+    after = benchmarks.peak_rss()
+    print("%.3f %s" % (time.time() - start, "n/a" if after is None else after - before))
+"""
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in KB, where the platform reports it."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_rewrite(sizes=(1 << 20, 4 << 20)):
+    """Compare everpy_enml.rewrite_text against the BeautifulSoup path, by time and growth of peak RSS."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for size in sizes:
+        for name in sorted(REWRITERS, reverse=True):
+            out = subprocess.check_output([sys.executable, "-c", REWRITE_PROBE, name, str(size)], cwd=here)
+            out = out.decode("ascii").strip()
+            if out.startswith("skipped"):
+                print("  {0} path {1}".format(name, out))
+                continue
+            elapsed, grown = out.split()
+            print("{0:>8} bytes {1:>14}: {2}s peak rss +{3} KB".format(len(make_note(size)), name, elapsed, grown))
+
+
+def bench_enex(attachment_mb=(16, 64)):
+    """Write and stream back ENEX files with large attachments, peak RSS should not grow with the file."""
+    folder = tempfile.mkdtemp()
+    try:
+        for size in attachment_mb:
+            attachment = os.path.join(folder, "attachment.bin")
+            with open(attachment, "wb") as f:
+                for _ in range(size):
+                    f.write(os.urandom(1024 * 1024))
+            enex = os.path.join(folder, "export.enex")
+            start = time.time()
+            with open(enex, "wb") as f:
+                with EnexWriter(f) as writer:
+                    for i in range(3):
+                        note = EnexNote("Note {0}".format(i), NOTE_HEADER + "<div>hello</div>" + NOTE_FOOTER)
+                        note.resources.append(EnexResource(data_path=attachment))
+                        writer.write(note)
+            written = time.time() - start
+            start = time.time()
+            for note in iter_enex(enex, data_dir=folder):
+                for res in note.resources:
+                    os.remove(res.data_path)
+            print("{0:>5} MB enex: write {1:.2f}s read {2:.2f}s peak rss {3} KB".format(
+                os.path.getsize(enex) // (1024 * 1024), written, time.time() - start, peak_rss()))
+    finally:
+        shutil.rmtree(folder)
+
+
+# Modules an ENScript only command should never load.
+HEAVY_MODULES = ("evernote", "thrift", "oauth2", "keyring", "bs4")
+
+STARTUP_PROBE = """
+import sys, time
+start = time.time()
+import everpy_cli
+everpy_cli.load_everpy(everpy_cli.get_cmd_line_args(sys.argv[2:]))
+heavy = sorted(set(m.split(".")[0] for m in sys.modules) & set(sys.argv[1].split(",")))
+print("%.3f %s" % (time.time() - start, ",".join(heavy) or "-"))
+"""
+
+
+def bench_startup(runs=5):
+    """Cold start of the cli: -h and ENScript commands should not load the Evernote SDK or touch the network."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = (["search", "-query", "any:"], ["export", "-query", "any:", "-file", "x.enex"], ["managenotes"])
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        with open(os.devnull, "w") as devnull:
+            subprocess.call([sys.executable, os.path.join(here, "everpy_cli.py"), "-h"], stdout=devnull)
+        times.append(time.time() - start)
+    print("{0:>40}: {1:.3f}s best of {2}".format("everpy_cli.py -h", min(times), runs))
+    for command in commands:
+        out = subprocess.check_output(
+            [sys.executable, "-c", STARTUP_PROBE, ",".join(HEAVY_MODULES)] + command, cwd=here
+        ).decode("ascii").split()
+        print("{0:>40}: {1}s to a ready object, heavy modules loaded: {2}".format(" ".join(command), out[0], out[1]))
+
+
+def main():
+    """Run all benchmarks."""
+    bench_startup()
+    bench_rewrite()
+    bench_enex()
+if __name__ == '__main__':
+    main()
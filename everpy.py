@@ -4,7 +4,8 @@ Only tested on Windows.
 """
 from __future__ import print_function
 import sys
-import subprocess
+
+from everpy_runner import EnscriptRunner, ENSCRIPT_CONCURRENCY
 
 DEBUG = False
 
@@ -18,7 +19,8 @@ def debug(msg):
 class EverPy(object):
     """Python helper for evernote."""
 
-    def __init__(self, path_enscript_exe, username=None, password=None):
+    def __init__(self, path_enscript_exe, username=None, password=None, enscript_concurrency=ENSCRIPT_CONCURRENCY,
+                 enscript_timeout=None):
         r"""
         Initialize EverPy object.
 
@@ -29,8 +31,11 @@ class EverPy(object):
                                  usually "C:\Program Files (x86)\Evernote\Evernote\ENScript.exe"
         @param username if not using the default account you'll need to provide a username
         @param password if not using the default account you'll need to provide a password
+        @param enscript_concurrency (optional) how many ENScript commands may run at once (default:2)
+        @param enscript_timeout (optional) seconds after which an ENScript command is killed (default: no timeout)
         """
         super(EverPy, self).__init__()
+        self.enscript_runner = EnscriptRunner(enscript_concurrency, enscript_timeout)
         self.enscript_core_args = [path_enscript_exe]
         if username:
             self.enscript_core_args += ["/u", username]
@@ -69,22 +74,69 @@ class EverPy(object):
             sys.exit("Unsupport notebook type {0}".format(notebook_type))
         return arr
 
-    def call_enscript(self, additional_args):
+    def set_enscript_limits(self, concurrency=ENSCRIPT_CONCURRENCY, timeout=None):
         """
-        Call enscript with set arguments.
+        Change how many ENScript commands may run at once and when they time out.
+
+        @param concurrency how many commands may run at once (default:2)
+        @param timeout (optional) seconds after which a command is killed (default: no timeout)
+        """
+        self.enscript_runner = EnscriptRunner(concurrency, timeout)
+
+    def run_enscript(self, additional_args, timeout=None):
+        """
+        Call enscript with set arguments and report how it exited.
 
         @param additional_args should be a list
-        @retval tuple with stdout and stderr
+        @param timeout (optional) seconds after which the command is killed (default: enscript_timeout)
+        @retval tuple with stdout, stderr and the exit status
         """
         debug(additional_args)
         cmd = self.enscript_core_args + additional_args
         debug(cmd)
         debug("Running script \"{0}\"".format(" ".join(cmd)))
-        out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        out, err, returncode = self.enscript_runner.run(cmd, timeout)
         if out:
             debug(out)
         if err:
             debug(err)
+        return out, err, returncode
+
+    def run_enscript_batch(self, args_list, timeout=None):
+        """
+        Call enscript once for every set of arguments, enscript_concurrency commands at a time.
+
+        @param args_list iterable of argument lists
+        @param timeout (optional) seconds after which each command is killed (default: enscript_timeout)
+        @retval generator of (additional_args, (stdout, stderr, exit status), error) in the order of args_list
+        """
+        args_list = list(args_list)
+        cmds = [self.enscript_core_args + additional_args for additional_args in args_list]
+        for i, (_, result, error) in enumerate(self.enscript_runner.run_many(cmds, timeout)):
+            yield args_list[i], result, error
+
+    def iter_enscript_lines(self, additional_args, timeout=None):
+        """
+        Call enscript and yield its output line by line as it arrives.
+
+        @param additional_args should be a list
+        @param timeout (optional) seconds after which the command is killed (default: enscript_timeout)
+        @retval generator of output lines. Errors are printed once the command finished.
+        """
+        process = self.enscript_runner.start(self.enscript_core_args + additional_args, timeout)
+        for line in process.lines():
+            yield line
+        if process.err:
+            print(process.err)
+
+    def call_enscript(self, additional_args):
+        """
+        Call enscript with set arguments.
+
+        @param additional_args should be a list
+        @retval tuple with stdout and stderr
+        """
+        out, err, _ = self.run_enscript(additional_args)
         return out, err
 
     def search_notes(self, query="any:"):
@@ -103,11 +155,17 @@ class EverPy(object):
 
         @retval list of notebooks
         """
-        en_args = ["listNotebooks"]
-        out, err = self.call_enscript(en_args)
-        if err:
-            print(err)
-        return out.splitlines()
+        return list(self.iter_notebooks())
+
+    def iter_notebooks(self):
+        """
+        Yield the notebook names as ENScript lists them.
+
+        @retval generator of notebook names
+        """
+        for name in self.iter_enscript_lines(["listNotebooks"]):
+            if name:
+                yield name
 
     def create_notebook(self, notebook_name, notebook_type="synced"):
         """
@@ -122,6 +180,19 @@ class EverPy(object):
         en_args = ["createNotebook", "/n", notebook_name, '/t', notebook_type]
         return self.call_enscript(en_args)
 
+    def create_notebooks(self, notebook_names, notebook_type="synced"):
+        """
+        Create many notebooks, enscript_concurrency at a time.
+
+        @param notebook_names names of the notebooks
+        @param notebook_type 1 of the 3 Evernote notebook types (default:synced)
+        @retval generator of (notebook name, (stdout, stderr, exit status), error)
+        """
+        notebook_names = list(notebook_names)
+        args_list = [["createNotebook", "/n", name, '/t', notebook_type] for name in notebook_names]
+        for i, (_, result, error) in enumerate(self.run_enscript_batch(args_list)):
+            yield notebook_names[i], result, error
+
     def create_textnote_from_file(self, file_with_notes, notebook_type="personal", notebook_name=None,
                                   title=None, tags=[], create_date=None, file_attachments=[]):
         """
@@ -172,10 +243,40 @@ class EverPy(object):
         @param notebook_name name of notebook to store note.
                     If does not exist, lazy create. If omitted, use default notebook.
         """
+        return self.call_enscript(self.import_notes_args(enex_file, notebook_type, notebook_name))
+
+    def import_notes_args(self, enex_file, notebook_type="personal", notebook_name=None):
+        """
+        Build the ENScript arguments for import_notes.
+
+        @retval list of arguments
+        """
         en_args = ["importNotes", "/s", enex_file]
         if notebook_name:
             en_args = self.append_notebook_type(en_args, notebook_type, notebook_name)
-        return self.call_enscript(en_args)
+        return en_args
+
+    def import_notes_batch(self, imports, notebook_type="personal"):
+        """
+        Import many export files, enscript_concurrency at a time.
+
+        @param imports iterable of (enex_file, notebook_name) tuples. notebook_name may be None for the default notebook.
+        @param notebook_type optional types are personal (default) or business
+        @retval generator of ((enex_file, notebook_name), (stdout, stderr, exit status), error)
+        """
+        imports = list(imports)
+        args_list = [self.import_notes_args(enex_file, notebook_type, notebook_name) for enex_file, notebook_name in imports]
+        for i, (_, result, error) in enumerate(self.run_enscript_batch(args_list)):
+            yield imports[i], result, error
+
+    @staticmethod
+    def export_notes_args(query, export_file, query_scope="personal"):
+        """
+        Build the ENScript arguments for export_notes.
+
+        @retval list of arguments
+        """
+        return ["exportNotes", "/q", query, "/f", export_file, "/s", query_scope]
 
     def export_notes(self, query, export_file, query_scope="personal"):
         """
@@ -187,8 +288,20 @@ class EverPy(object):
                     personal - what you most likely want to use (default)
                     business - specify business notebook
         """
-        en_args = ["exportNotes", "/q", query, "/f", export_file, "/s", query_scope]
-        return self.call_enscript(en_args)
+        return self.call_enscript(self.export_notes_args(query, export_file, query_scope))
+
+    def export_notes_batch(self, exports, query_scope="personal"):
+        """
+        Export many queries into their own files, enscript_concurrency at a time.
+
+        @param exports iterable of (query, export_file) tuples
+        @param query_scope optional types are personal (default) or business
+        @retval generator of ((query, export_file), (stdout, stderr, exit status), error)
+        """
+        exports = list(exports)
+        args_list = [self.export_notes_args(query, export_file, query_scope) for query, export_file in exports]
+        for i, (_, result, error) in enumerate(self.run_enscript_batch(args_list)):
+            yield exports[i], result, error
 
     def sync_database(self, log_file=None):
         """
@@ -0,0 +1,115 @@
+"""Compressed backup files and their checksums.
+
+Exports compress with the standard library while they are written and every file in a
+backup gets its size and SHA-256 recorded, so a snapshot can be verified without unpacking it.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Bytes read per hashing/compression step.
+CHUNK_SIZE = 1024 * 1024
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz"}
+
+
+def compression_suffix(compression):
+    """
+    Get the file suffix for a compression method.
+
+    @param compression None, `gzip` or `xz`
+    @retval suffix to append to the file name ('' when not compressing)
+    """
+    if not compression:
+        return ""
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unsupported compression {0}".format(compression))
+    if compression == "xz" and lzma is None:
+        raise ValueError("xz compression needs the lzma module")
+    return COMPRESSION_SUFFIXES[compression]
+
+
+def open_archive(path, mode="rb"):
+    """
+    Open a backup file, compressing or decompressing according to its suffix.
+
+    @param path path of the file. Files ending in .gz or .xz are compressed.
+    @param mode `rb` or `wb`
+    @retval binary file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".xz"):
+        if lzma is None:
+            raise ValueError("xz compression needs the lzma module")
+        return lzma.open(path, mode)
+    return open(path, mode)
+
+
+def compress_file(source, dest):
+    """
+    Compress a file in chunks according to the suffix of dest and remove the source.
+
+    @param source uncompressed file
+    @param dest path of the compressed file
+    """
+    with open(source, "rb") as src:
+        with open_archive(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.remove(source)
+
+
+def _sha256_stream(f):
+    """Hash a file object in chunks, returning (hex digest, bytes read)."""
+    sha = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        sha.update(chunk)
+        size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def describe_file(path):
+    """
+    Checksum a backup file.
+
+    @param path path of the file
+    @retval dict with the stored size and sha256 and, for compressed files,
+            the content_size and content_sha256 of the uncompressed data
+    """
+    with open(path, "rb") as f:
+        sha256, size = _sha256_stream(f)
+    info = {"size": size, "sha256": sha256}
+    if path.endswith(tuple(COMPRESSION_SUFFIXES.values())):
+        with open_archive(path, "rb") as f:
+            info["content_sha256"], info["content_size"] = _sha256_stream(f)
+    return info
+
+
+def verify_file(path, expected):
+    """
+    Check a backup file against what its manifest recorded.
+
+    Compressed files are decompressed in memory, chunk by chunk, nothing is written to disk.
+
+    @param path path of the file
+    @param expected dict as returned by describe_file
+    @retval list of problems, empty if the file is intact
+    """
+    if not os.path.isfile(path):
+        return ["missing"]
+    try:
+        actual = describe_file(path)
+    except (IOError, OSError, EOFError, ValueError) as e:
+        return ["unreadable: {0}".format(e)]
+    problems = []
+    for key in ("size", "sha256", "content_size", "content_sha256"):
+        if key in expected and expected[key] != actual.get(key):
+            problems.append("{0} is {1}, expected {2}".format(key, actual.get(key), expected[key]))
+    return problems
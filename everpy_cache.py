@@ -0,0 +1,353 @@
+"""On-disk caches that save round trips to the Evernote service."""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Default upper bound for the note content cache (256MB).
+DEFAULT_CONTENT_CACHE_BYTES = 256 * 1024 * 1024
+
+# How many file hashes FileHashCache remembers.
+DEFAULT_HASH_CACHE_ENTRIES = 4096
+
+
+class NoteContentCache(object):
+    """
+    Cache of note ENML keyed by guid and updateSequenceNum.
+
+    A note's updateSequenceNum changes every time the note does so a cached body is only
+    handed back while the USN still matches. The least recently used notes are evicted once
+    the stored content grows past max_bytes. The size is always read from the database, so
+    several processes can share one cache file.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_CONTENT_CACHE_BYTES):
+        """
+        Initialize NoteContentCache object.
+
+        @param path path of the sqlite database to keep the cache in. Created if it does not exist.
+        @param max_bytes how many bytes of content to keep before evicting (default:256MB)
+        """
+        super(NoteContentCache, self).__init__()
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS content ("
+            "guid TEXT PRIMARY KEY, usn INTEGER, content_hash BLOB, size INTEGER, last_used INTEGER, content BLOB)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS content_last_used ON content (last_used)")
+        self._db.commit()
+        self._clock = self._db.execute("SELECT COALESCE(MAX(last_used), 0) FROM content").fetchone()[0]
+
+    def __len__(self):
+        """Return number of cached notes."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM content").fetchone()[0]
+
+    @property
+    def size(self):
+        """Return total bytes of cached content."""
+        with self._lock:
+            return self._stored_size()
+
+    def _stored_size(self):
+        """Return total bytes of content in the database, including what other processes stored. Caller holds the lock."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM content").fetchone()[0]
+
+    def _tick(self):
+        """Return the next value of the LRU clock, ahead of what other processes stored."""
+        latest = self._db.execute("SELECT COALESCE(MAX(last_used), 0) FROM content").fetchone()[0]
+        self._clock = max(self._clock, latest) + 1
+        return self._clock
+
+    def get(self, guid, usn=None):
+        """
+        Get the cached content of a note.
+
+        @param guid guid of the note
+        @param usn (optional) updateSequenceNum the note currently has. A cached copy with a different USN is a miss.
+        @retval content string or None if not cached or stale
+        """
+        with self._lock:
+            row = self._db.execute("SELECT usn, content FROM content WHERE guid = ?", (guid,)).fetchone()
+            if row is None or (usn is not None and row[0] != usn):
+                return None
+            self._db.execute("UPDATE content SET last_used = ? WHERE guid = ?", (self._tick(), guid))
+            self._db.commit()
+            return row[1]
+
+    def put(self, guid, usn, content, content_hash=None):
+        """
+        Store the content of a note.
+
+        @param guid guid of the note
+        @param usn updateSequenceNum of this version of the note
+        @param content the ENML content
+        @param content_hash (optional) contentHash the service reported for the content
+        """
+        size = len(content)
+        if size > self.max_bytes:
+            self.discard(guid)
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO content (guid, usn, content_hash, size, last_used, content) VALUES (?, ?, ?, ?, ?, ?)",
+                (guid, usn, content_hash, size, self._tick(), content)
+            )
+            self._evict()
+            self._db.commit()
+
+    def discard(self, guid):
+        """
+        Drop a note from the cache.
+
+        @param guid guid of the note
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM content WHERE guid = ?", (guid,))
+            self._db.commit()
+
+    def _evict(self):
+        """Remove least recently used notes until the cache fits in max_bytes. Caller holds the lock."""
+        size = self._stored_size()
+        while size > self.max_bytes:
+            rows = self._db.execute("SELECT guid, size FROM content ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                return
+            for guid, row_size in rows:
+                self._db.execute("DELETE FROM content WHERE guid = ?", (guid,))
+                size -= row_size
+                if size <= self.max_bytes:
+                    return
+
+    def clear(self):
+        """Empty the cache."""
+        with self._lock:
+            self._db.execute("DELETE FROM content")
+            self._db.commit()
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
+
+
+# Field names of every MetadataRecord class, base class fields first.
+_record_fields = {}
+
+
+def _native(value):
+    """Turn strings read back from json into the utf-8 str the Python 2 thrift client hands out."""
+    if str is bytes and isinstance(value, type(u"")):
+        return value.encode("utf-8")
+    return value
+
+
+class MetadataRecord(object):
+    """
+    Compact copy of a notebook, tag or saved search.
+
+    Fields carry the Evernote attribute names and can also be read with record["guid"],
+    the way the dictionaries learn_notebooks used to build were.
+    """
+
+    __slots__ = ("guid", "name", "updateSequenceNum")
+
+    def __init__(self, *values):
+        """
+        Initialize MetadataRecord object.
+
+        @param values field values in the order of the record's fields
+        """
+        for field, value in zip(self.fields(), values):
+            setattr(self, field, value)
+
+    @classmethod
+    def fields(cls):
+        """Return the names of the fields, in order."""
+        names = _record_fields.get(cls)
+        if names is None:
+            names = _record_fields[cls] = tuple(
+                field for klass in reversed(cls.__mro__) for field in getattr(klass, "__slots__", ()))
+        return names
+
+    @classmethod
+    def from_thrift(cls, item):
+        """Copy the fields of a Notebook, Tag or SavedSearch."""
+        return cls(*[getattr(item, field, None) for field in cls.fields()])
+
+    def to_list(self):
+        """Return the field values in order."""
+        return [getattr(self, field) for field in self.fields()]
+
+    def __getitem__(self, key):
+        """Read a field by name."""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __repr__(self):
+        """Return a readable representation."""
+        return "{0}({1})".format(type(self).__name__, ", ".join(repr(value) for value in self.to_list()))
+
+
+class NotebookRecord(MetadataRecord):
+    """Cached notebook."""
+
+    __slots__ = ("stack", "defaultNotebook")
+
+
+class TagRecord(MetadataRecord):
+    """Cached tag."""
+
+    __slots__ = ("parentGuid",)
+
+
+class SearchRecord(MetadataRecord):
+    """Cached saved search."""
+
+    __slots__ = ("query",)
+
+
+class MetadataIndex(dict):
+    """Records keyed by name, with a second index by guid."""
+
+    def __init__(self, records=()):
+        """
+        Initialize MetadataIndex object.
+
+        @param records MetadataRecord objects
+        """
+        super(MetadataIndex, self).__init__((record.name, record) for record in records)
+        self.by_guid = dict((record.guid, record) for record in self.values())
+
+
+class MetadataCache(object):
+    """
+    Notebooks, tags and saved searches kept on disk between runs.
+
+    Every list is stored with the account update count it was fetched at. getSyncState reports
+    a new update count whenever anything in the account changes, so a list is only handed back
+    while the count still matches.
+    """
+
+    RECORDS = {"notebooks": NotebookRecord, "tags": TagRecord, "searches": SearchRecord}
+
+    def __init__(self, path):
+        """
+        Initialize MetadataCache object.
+
+        @param path path of the json file to keep the cache in. Created on first put.
+        """
+        super(MetadataCache, self).__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._lists = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    self._lists = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._lists = {}
+
+    def get(self, kind, update_count):
+        """
+        Get a cached list.
+
+        @param kind `notebooks`, `tags` or `searches`
+        @param update_count current update count of the account
+        @retval MetadataIndex or None when the list is missing or out of date
+        """
+        with self._lock:
+            cached = self._lists.get(kind)
+            if not cached or cached["update_count"] != update_count:
+                return None
+            record_class = self.RECORDS[kind]
+            return MetadataIndex(record_class(*[_native(value) for value in values]) for values in cached["records"])
+
+    def put(self, kind, update_count, items):
+        """
+        Store a list fetched from the service.
+
+        @param kind `notebooks`, `tags` or `searches`
+        @param update_count update count of the account read before items were fetched
+        @param items Notebook, Tag or SavedSearch objects
+        @retval MetadataIndex of the stored records
+        """
+        record_class = self.RECORDS[kind]
+        index = MetadataIndex(record_class.from_thrift(item) for item in items)
+        with self._lock:
+            self._lists[kind] = {
+                "update_count": update_count,
+                "records": [record.to_list() for record in index.values()],
+            }
+            self._save()
+        return index
+
+    def invalidate(self, kind=None):
+        """Forget one list or, without kind, all of them."""
+        with self._lock:
+            if kind is None:
+                self._lists = {}
+            else:
+                self._lists.pop(kind, None)
+            self._save()
+
+    def _save(self):
+        """Write the cache atomically. Caller holds the lock."""
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self._lists, f)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.path + ".tmp", self.path)
+
+
+class FileHashCache(object):
+    """
+    md5 of attachment files, keyed by path, size and modification time.
+
+    A file attached to many notes is only hashed once, see EverPyPro.get_resource.
+    """
+
+    def __init__(self, max_entries=DEFAULT_HASH_CACHE_ENTRIES):
+        """
+        Initialize FileHashCache object.
+
+        @param max_entries how many hashes to remember, least recently used ones are dropped first (default:4096)
+        """
+        super(FileHashCache, self).__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hashes = OrderedDict()
+
+    @staticmethod
+    def key(path):
+        """Return the cache key of a file: (absolute path, size, mtime)."""
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+    def get(self, key):
+        """Return the hex md5 remembered for a key or None."""
+        with self._lock:
+            md5 = self._hashes.pop(key, None)
+            if md5 is not None:
+                self._hashes[key] = md5
+            return md5
+
+    def put(self, key, md5):
+        """Remember the hex md5 of a key."""
+        with self._lock:
+            self._hashes.pop(key, None)
+            self._hashes[key] = md5
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
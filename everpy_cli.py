@@ -9,25 +9,36 @@ Tests
 ----------
 Everpy
 python everpy_cli.py search -query "any:"
+python everpy_cli.py search -local -update -query "lease"
+python everpy_cli.py search -local -query "lease AND title:apartment"
 python everpy_cli.py export -query "intitle:\"En Scratch Paper\"" -file test.enex -scope personal
 
 Everpy extras
 python everpy_cli.py managenotes
 python everpy_cli.py backup -dest "C:\Users\Paul\Desktop"
+python everpy_cli.py backup -dedup -dest "C:\Users\Paul\Desktop\notes_store"
+python everpy_cli.py restore -dest "C:\Users\Paul\Desktop\notes_store" -out "C:\Users\Paul\Desktop\restored"
 
 Everpy pro
 python everpy_cli.py findandreplace -find "(?i)(evernote)" -replace "Evernote" -query "intitle:test"
+python everpy_cli.py retag -query "notebook:Inbox created:month" -add "2024" -remove "todo" -notebook "Archive"
+python everpy_cli.py stats -sparse 3
 python everpy_cli.py deletenotebook -name "deletemebook"
+python everpy_cli.py sync
+python everpy_cli.py -metrics metrics.json -profile sync.prof sync
 
 @todo Figure out how to deal with tags and file attachments from comamnd line
 """
 import argparse
-
-from everpy_pro import EverPyPro
-import everpy_utilities
+import json
+import os
+import sys
 
 PATH_TO_ENSCRIPT = r"C:\Program Files (x86)\Evernote\Evernote\ENScript.exe"
 
+# Commands that always need the Evernote API (and so a token). Everything else runs on ENScript alone.
+API_COMMANDS = ("deletenotebook", "findandreplace", "retag", "stats", "sync", "template", "schedule")
+
 
 def add_enscript_cmds(sp):
     """Add the Everpy commands."""
@@ -41,7 +52,27 @@ def add_enscript_cmds(sp):
         "-query",
         dest="query",
         required=True,
-        help="Evernote search query"
+        help="Evernote search query (full text query with -local)"
+    )
+    search_parser.add_argument(
+        "-local",
+        "--local",
+        dest="local",
+        action="store_true",
+        help="Search the local index instead and print ranked results as JSON lines"
+    )
+    search_parser.add_argument(
+        "-limit",
+        dest="limit",
+        type=int,
+        default=50,
+        help="Maximum number of results with -local (default:50)"
+    )
+    search_parser.add_argument(
+        "-update",
+        dest="update",
+        action="store_true",
+        help="Sync the local index with Evernote before searching it, this needs a token (default: search it as it is)"
     )
     ####################################################
 
@@ -89,8 +120,129 @@ def add_everpy_extra_cmds(sp):
     bkp_parser.add_argument(
         "-keep",
         dest='keep',
-        default="5,",
-        help="How many copies to keep (default:5)"
+        type=int,
+        help="How many copies to keep, older ones are deleted (default: keep every copy)"
+    )
+    bkp_parser.add_argument(
+        "-daily",
+        dest="daily",
+        type=int,
+        default=0,
+        help="Also keep the newest copy of each of the last DAILY days (default:0)"
+    )
+    bkp_parser.add_argument(
+        "-weekly",
+        dest="weekly",
+        type=int,
+        default=0,
+        help="Also keep the newest copy of each of the last WEEKLY weeks (default:0)"
+    )
+    bkp_parser.add_argument(
+        "-monthly",
+        dest="monthly",
+        type=int,
+        default=0,
+        help="Also keep the newest copy of each of the last MONTHLY months (default:0)"
+    )
+    bkp_parser.add_argument(
+        "-dedup",
+        dest="dedup",
+        action="store_true",
+        help="Store the backup in a deduplicated object store in dest instead of a folder of .enex files"
+    )
+    bkp_parser.add_argument(
+        "-incremental",
+        dest="incremental",
+        action="store_true",
+        help="Only re-export notebooks that changed since the last backup"
+    )
+    bkp_parser.add_argument(
+        "-workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="How many notebooks to export at once (default:1)"
+    )
+    bkp_parser.add_argument(
+        "-engine",
+        dest="engine",
+        choices=["enscript", "api"],
+        default=None,
+        help="Export with ENScript or the Evernote API (default: ENScript when it is installed)"
+    )
+    bkp_parser.add_argument(
+        "-compress",
+        dest="compress",
+        choices=["gzip", "xz"],
+        default=None,
+        help="Store compressed .enex.gz or .enex.xz files"
+    )
+    ####################################################
+
+    ####################################################
+    # create the parser for the "restore" command
+    rst_parser = sp.add_parser(
+        'restore',
+        help='Rebuild the .enex files of a deduplicated backup'
+    )
+    rst_parser.add_argument(
+        "-dest",
+        dest="dest",
+        required=True,
+        help="Path the deduplicated backup was saved to"
+    )
+    rst_parser.add_argument(
+        "-out",
+        dest="out",
+        required=True,
+        help="Folder to write the .enex files to"
+    )
+    rst_parser.add_argument(
+        "-snapshot",
+        dest="snapshot",
+        default=None,
+        help="Snapshot to restore (default: the newest)"
+    )
+    ####################################################
+
+    ####################################################
+    # create the parser for the "verify" command
+    vfy_parser = sp.add_parser(
+        'verify',
+        help='Check a backup folder against the checksums in its manifest'
+    )
+    vfy_parser.add_argument(
+        "-folder",
+        dest="folder",
+        required=True,
+        help="Backup folder to check"
+    )
+    vfy_parser.add_argument(
+        "-workers",
+        dest="workers",
+        type=int,
+        default=4,
+        help="How many files to check at once (default:4)"
+    )
+    ####################################################
+
+    ####################################################
+    # create the parser for the "schedule" command
+    sch_parser = sp.add_parser(
+        'schedule',
+        help='Keep running the backup jobs of a json config at their intervals'
+    )
+    sch_parser.add_argument(
+        "-config",
+        dest="config",
+        required=True,
+        help="Json file with the backup jobs"
+    )
+    sch_parser.add_argument(
+        "-once",
+        dest="once",
+        action="store_true",
+        help="Run every job once and exit"
     )
     ####################################################
 
@@ -129,6 +281,102 @@ def add_everpypro_cmd(sp):
         default="any:",
         help="Evernote search query (default:`any:`)"
     )
+    fnr_parser.add_argument(
+        "-pagesize",
+        dest="page_size",
+        type=int,
+        default=250,
+        help="How many notes to request from the server at a time (default:250)"
+    )
+    fnr_parser.add_argument(
+        "-workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="How many notes to process concurrently (default:1)"
+    )
+    ####################################################
+
+    ####################################################
+    # create the parser for the "retag" command
+    tag_parser = sp.add_parser(
+        'retag',
+        help='Add or remove tags, move notebook or set attributes of notes without downloading them'
+    )
+    tag_parser.add_argument(
+        "-query",
+        dest="query",
+        default="any:",
+        help="Evernote search query (default:`any:`)"
+    )
+    tag_parser.add_argument(
+        "-add",
+        nargs='+',
+        dest="add_tags",
+        default=[],
+        help="Tags to add, created if needed"
+    )
+    tag_parser.add_argument(
+        "-remove",
+        nargs='+',
+        dest="remove_tags",
+        default=[],
+        help="Tags to remove"
+    )
+    tag_parser.add_argument(
+        "-notebook",
+        dest="notebook",
+        default=None,
+        help="Notebook to move the notes to, created if needed"
+    )
+    tag_parser.add_argument(
+        "-set",
+        nargs='+',
+        dest="attributes",
+        default=[],
+        help="Note attributes to set as name=value, e.g. author=Me. An empty value clears the attribute"
+    )
+    tag_parser.add_argument(
+        "-pagesize",
+        dest="page_size",
+        type=int,
+        default=250,
+        help="How many notes to request from the server at a time (default:250)"
+    )
+    tag_parser.add_argument(
+        "-workers",
+        dest="workers",
+        type=int,
+        default=4,
+        help="How many notes to update concurrently (default:4)"
+    )
+    ####################################################
+
+    ####################################################
+    # create the parser for the "stats" command
+    stats_parser = sp.add_parser(
+        'stats',
+        help='Count notes per notebook and tag and list sparse tags, empty notebooks and untagged notes'
+    )
+    stats_parser.add_argument(
+        "-query",
+        dest="query",
+        default="any:",
+        help="Only count notes matching this Evernote search query (default:`any:`)"
+    )
+    stats_parser.add_argument(
+        "-sparse",
+        dest="sparse_threshold",
+        type=int,
+        default=3,
+        help="Tags on fewer notes than this are reported as sparse (default:3)"
+    )
+    stats_parser.add_argument(
+        "-nountagged",
+        dest="untagged",
+        action="store_false",
+        help="Skip counting the untagged notes, saving a round trip"
+    )
     ####################################################
 
     ####################################################
@@ -145,6 +393,19 @@ def add_everpypro_cmd(sp):
     )
     ####################################################
 
+    ####################################################
+    # create the parser for the "sync" command
+    sync_parser = sp.add_parser(
+        'sync',
+        help='Incrementally sync the local mirror of your account.'
+    )
+    sync_parser.add_argument(
+        "-log",
+        dest="log_file",
+        default=None,
+        help="File to append the sync summary to"
+    )
+    ####################################################
 
     ####################################################
     # create the parser for the "template" command
@@ -183,15 +444,48 @@ def add_everpypro_cmd(sp):
         default=None,
         help="attachments"
     )
+    tem_parser.add_argument(
+        "-data",
+        dest="data_file",
+        default=None,
+        help="CSV or JSON lines file with the token values, one row per entry. Nothing is asked."
+    )
+    tem_parser.add_argument(
+        "-pernote",
+        dest="per_note",
+        action="store_true",
+        help="With -data, create a note per row instead of one note with all rows"
+    )
+    tem_parser.add_argument(
+        "-workers",
+        dest="workers",
+        type=int,
+        default=4,
+        help="With -pernote, how many notes to send at once"
+    )
     ####################################################
 
 
-def get_cmd_line_args():
+def get_cmd_line_args(args=None):
     """Parse cmd line args into tuple."""
     parser = argparse.ArgumentParser(
         prog='everpy.py',
         description="A series of Evernote helper tools from command line"
     )
+    parser.add_argument(
+        "-metrics",
+        dest="metrics",
+        default=None,
+        help="Write call counts, latencies, bytes and errors of ENScript and Evernote calls as JSON to this file (- for stdout)"
+    )
+    parser.add_argument(
+        "-profile",
+        dest="profile",
+        nargs="?",
+        const="",
+        default=None,
+        help="Profile the command with cProfile, print the top functions and save the stats to the file given"
+    )
     # Create the a subparser
     main_subparser = parser.add_subparsers(
         help="Choose between one of the following:",
@@ -200,25 +494,82 @@ def get_cmd_line_args():
     add_enscript_cmds(main_subparser)
     add_everpy_extra_cmds(main_subparser)
     add_everpypro_cmd(main_subparser)
-    return (parser.parse_args())
+    return (parser.parse_args(args))
 
 
-def main():
-    """Start of script."""
-    # Get a dev token
-    dev_token = everpy_utilities.get_token()
-    # Parse args
-    cmd_line_args = get_cmd_line_args()
+def needs_api(cmd_line_args):
+    """
+    Check whether a command needs the Evernote API.
 
-    try:
-        my_evernote = EverPyPro(dev_token, PATH_TO_ENSCRIPT)
-    except:
-        dev_token = everpy_utilities.refresh_token()
-        my_evernote = EverPyPro(dev_token, PATH_TO_ENSCRIPT)
+    @param cmd_line_args parsed command line
+    @retval True if the command needs EverPyPro and a token
+    """
+    if cmd_line_args.option in API_COMMANDS:
+        return True
+    if cmd_line_args.option == "search":
+        # A local search only goes online to update the index first.
+        return cmd_line_args.local and cmd_line_args.update
+    if cmd_line_args.option == "backup":
+        engine = cmd_line_args.engine or ("enscript" if os.path.isfile(PATH_TO_ENSCRIPT) else "api")
+        # Incremental backups tell unchanged notebooks apart through the API.
+        return engine == "api" or cmd_line_args.incremental
+    return False
+
+
+def load_everpy(cmd_line_args):
+    """
+    Create the object a command runs on, importing the Evernote SDK and reading the token only when needed.
+
+    @param cmd_line_args parsed command line
+    @retval EverPyPro for commands that need the API, EverPyExtras otherwise
+    """
+    if not needs_api(cmd_line_args):
+        from everpy_extras import EverPyExtras
+        return EverPyExtras(PATH_TO_ENSCRIPT)
+
+    from everpy_pro import EverPyPro
+    return EverPyPro.connect(PATH_TO_ENSCRIPT)
+
+
+def open_local_mirror():
+    """
+    Open the local mirror for `search -local`, without a token or the network.
+
+    With mirrors of several accounts in the cache folder the saved token picks the account.
+
+    @retval LocalMirror
+    """
+    import everpy_utilities
+    from everpy_sync import LocalMirror, find_mirror
+    cache_dir = everpy_utilities.get_everpy_dir()
+    path = find_mirror(cache_dir)
+    if path is None:
+        token = everpy_utilities.get_saved_token()
+        path = token and find_mirror(cache_dir, everpy_utilities.get_account_key(token))
+    if not path:
+        sys.exit("No local index in {0} yet, run `search -local -update` first".format(cache_dir))
+    return LocalMirror(path)
+
+
+def run_command(cmd_line_args):
+    """Run the command of a parsed command line."""
+    my_evernote = load_everpy(cmd_line_args)
 
     ########################################################
     #              Deal with Everpy Commands               #
-    if cmd_line_args.option == "search":
+    if cmd_line_args.option == "search" and cmd_line_args.local:
+        if cmd_line_args.update:
+            results = my_evernote.search_local(cmd_line_args.query, limit=cmd_line_args.limit, update=True)
+        else:
+            results = open_local_mirror().search(cmd_line_args.query, limit=cmd_line_args.limit)
+        try:
+            for guid, title, score in results:
+                sys.stdout.write(json.dumps({"guid": guid, "title": title, "score": score}) + "\n")
+                sys.stdout.flush()
+        except ValueError as e:
+            sys.stderr.write("everpy.py search: error: {0}\n".format(e))
+            sys.exit(2)
+    elif cmd_line_args.option == "search":
         out, err = my_evernote.search_notes(
             query=cmd_line_args.query
         )
@@ -239,10 +590,58 @@ def main():
     ########################################################
     #            Deal with Everpy Extra Commands           #
     elif cmd_line_args.option == "backup":
-        my_evernote.proper_backup(
+        if cmd_line_args.engine:
+            my_evernote.backup_engine = cmd_line_args.engine
+        retention = None
+        if cmd_line_args.keep is not None or cmd_line_args.daily or cmd_line_args.weekly or cmd_line_args.monthly:
+            from everpy_retention import RetentionPolicy
+            retention = RetentionPolicy(
+                keep=cmd_line_args.keep or 0,
+                daily=cmd_line_args.daily,
+                weekly=cmd_line_args.weekly,
+                monthly=cmd_line_args.monthly
+            )
+        if cmd_line_args.dedup:
+            print(my_evernote.store_backup(
+                cmd_line_args.dest,
+                iterations=retention,
+                incremental=cmd_line_args.incremental,
+                workers=cmd_line_args.workers
+            ))
+        else:
+            my_evernote.proper_backup(
+                cmd_line_args.dest,
+                iterations=retention,
+                incremental=cmd_line_args.incremental,
+                workers=cmd_line_args.workers,
+                compress=cmd_line_args.compress
+            )
+    elif cmd_line_args.option == "restore":
+        for path in my_evernote.restore_backup(
             cmd_line_args.dest,
-            iterations=cmd_line_args.keep
-        )
+            cmd_line_args.out,
+            snapshot=cmd_line_args.snapshot
+        ):
+            print(path)
+    elif cmd_line_args.option == "verify":
+        problems = my_evernote.verify_backup(cmd_line_args.folder, workers=cmd_line_args.workers)
+        for notebook, notebook_problems in sorted(problems.items()):
+            for problem in notebook_problems:
+                print("{0}: {1}".format(notebook, problem))
+        if problems:
+            sys.exit(1)
+        print("OK")
+    elif cmd_line_args.option == "schedule":
+        from everpy_scheduler import BackupScheduler
+        scheduler = BackupScheduler.from_config(my_evernote, cmd_line_args.config)
+        if cmd_line_args.once:
+            scheduler.run_once()
+        else:
+            try:
+                scheduler.run_forever()
+            except KeyboardInterrupt:
+                pass
+        print(json.dumps(scheduler.stats(), indent=1, sort_keys=True))
     elif cmd_line_args.option == "managenotes":
         out, err = my_evernote.get_notes_to_manage()
         if out.strip():
@@ -257,17 +656,53 @@ def main():
         ):
             print("Success")
     elif cmd_line_args.option == "findandreplace":
-        my_evernote.find_and_replace(
+        summary = my_evernote.find_and_replace(
             cmd_line_args.find,
             cmd_line_args.repl,
-            cmd_line_args.query
+            cmd_line_args.query,
+            page_size=cmd_line_args.page_size,
+            workers=cmd_line_args.workers
         )
-    elif cmd_line_args.option == "findandreplace":
-        my_evernote.find_and_replace(
-            cmd_line_args.find,
-            cmd_line_args.repl,
-            cmd_line_args.query
+        print(summary)
+    elif cmd_line_args.option == "retag":
+        summary = my_evernote.update_metadata(
+            cmd_line_args.query,
+            add_tags=cmd_line_args.add_tags,
+            remove_tags=cmd_line_args.remove_tags,
+            notebook=cmd_line_args.notebook,
+            attributes=my_evernote.parse_note_attributes(cmd_line_args.attributes),
+            page_size=cmd_line_args.page_size,
+            workers=cmd_line_args.workers
+        )
+        print(summary)
+    elif cmd_line_args.option == "stats":
+        stats = my_evernote.get_account_stats(
+            cmd_line_args.query,
+            sparse_threshold=cmd_line_args.sparse_threshold,
+            untagged=cmd_line_args.untagged
         )
+        print(json.dumps(stats, indent=2))
+    elif cmd_line_args.option == "sync":
+        print(my_evernote.sync_database(log_file=cmd_line_args.log_file))
+    elif cmd_line_args.option == "template" and cmd_line_args.data_file:
+        created = my_evernote.create_notes_from_template(
+            cmd_line_args.template_file,
+            cmd_line_args.data_file,
+            per_note=cmd_line_args.per_note,
+            notebook=cmd_line_args.notebook,
+            title=cmd_line_args.title,
+            tags=cmd_line_args.tags,
+            file_attachments=cmd_line_args.attachments,
+            workers=cmd_line_args.workers
+        )
+        if cmd_line_args.per_note:
+            failed = 0
+            for item, note, error in created:
+                if error is not None:
+                    failed += 1
+                    print("Could not create note {0}: {1}".format(item["title"], error))
+            if failed:
+                sys.exit(1)
     elif cmd_line_args.option == "template":
         my_evernote.create_template(
             cmd_line_args.template_file,
@@ -278,5 +713,33 @@ def main():
         )
     else:
         pass
+
+
+def main():
+    """Start of script."""
+    # Parse args
+    cmd_line_args = get_cmd_line_args()
+    profiler = None
+    if cmd_line_args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if cmd_line_args.metrics:
+            from everpy_metrics import metrics_scope
+            with metrics_scope() as metrics:
+                try:
+                    run_command(cmd_line_args)
+                finally:
+                    metrics.dump(cmd_line_args.metrics)
+        else:
+            run_command(cmd_line_args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            from everpy_metrics import print_profile
+            print_profile(profiler, cmd_line_args.profile)
+
+
 if __name__ == '__main__':
     main()
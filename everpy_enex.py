@@ -0,0 +1,375 @@
+"""Read and write Evernote export (.enex) files one note at a time.
+
+Both directions stream: the reader feeds the file to expat in chunks and decodes attachment
+data as it arrives, the writer base64 encodes attachments in chunks straight from their source.
+Memory use depends on the size of a single note's text, not on the file or its attachments.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from xml.parsers import expat
+
+ENEX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<!DOCTYPE en-export SYSTEM "http://xml.evernote.com/pub/evernote-export3.dtd">\n')
+ENEX_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+
+# Bytes read from the .enex file per parser feed.
+READ_CHUNK_SIZE = 64 * 1024
+# Attachment bytes encoded per write. A multiple of 57 keeps base64 lines 76 characters long.
+ENCODE_CHUNK_SIZE = 57 * 1024
+
+_encode_lines = getattr(base64, "encodebytes", None) or base64.encodestring
+
+
+def _text(value):
+    """Return value as text suitable for an xml text node."""
+    if value is None:
+        return u""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return u"{0}".format(value)
+
+
+def _xml_escape(value):
+    """Escape text for use in an xml text node."""
+    return _text(value).replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u">", u"&gt;")
+
+
+def _cdata(value):
+    """Wrap text in a CDATA section, splitting any ]]> it contains."""
+    return u"<![CDATA[" + _text(value).replace(u"]]>", u"]]]]><![CDATA[>") + u"]]>"
+
+
+class EnexResource(object):
+    """
+    An attachment of a note in an ENEX file.
+
+    The bytes live either in memory (data) or in a file (data_path).
+    """
+
+    def __init__(self, data=None, mime="application/octet-stream", attributes=None, data_path=None):
+        """
+        Initialize EnexResource object.
+
+        @param data the raw bytes of the attachment
+        @param mime mime type of the attachment
+        @param attributes (optional) dict of resource-attributes, for example {"file-name": "a.png"}
+        @param data_path (optional) file holding the raw bytes instead of data
+        """
+        super(EnexResource, self).__init__()
+        self.data = data
+        self.data_path = data_path
+        self.mime = mime
+        self.width = None
+        self.height = None
+        self.recognition = None
+        self.attributes = OrderedDict(attributes or {})
+        self._md5 = None
+        self._size = None
+
+    @property
+    def size(self):
+        """Return the size of the attachment in bytes."""
+        if self._size is None:
+            self._size = os.path.getsize(self.data_path) if self.data_path else len(self.data or b"")
+        return self._size
+
+    @property
+    def hash(self):
+        """Return the hex md5 of the attachment, the hash en-media tags refer to."""
+        if self._md5 is None:
+            md5 = hashlib.md5()
+            with self.open() as f:
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                    md5.update(chunk)
+            self._md5 = str(binascii.hexlify(md5.digest()).decode("ascii"))
+        return self._md5
+
+    def open(self):
+        """Return a binary file object with the attachment bytes."""
+        if self.data_path:
+            return open(self.data_path, "rb")
+        return io.BytesIO(self.data or b"")
+
+
+class EnexNote(object):
+    """A note in an ENEX file."""
+
+    def __init__(self, title=None, content=None, created=None, updated=None, tags=None):
+        """
+        Initialize EnexNote object.
+
+        @param title note title
+        @param content full ENML content
+        @param created (optional) creation time as an ENEX timestamp (YYYYMMDDTHHMMSSZ) or datetime
+        @param updated (optional) update time as an ENEX timestamp or datetime
+        @param tags (optional) list of tag names
+        """
+        super(EnexNote, self).__init__()
+        self.title = title
+        self.content = content
+        self.created = created
+        self.updated = updated
+        self.tags = list(tags or [])
+        self.attributes = OrderedDict()
+        self.resources = []
+
+
+def format_enex_date(value):
+    """
+    Format a timestamp the way ENEX files store them.
+
+    @param value datetime, milliseconds since the epoch (as the API returns) or an already formatted string
+    @retval string like 20170101T120000Z or None
+    """
+    if value is None or isinstance(value, (str, type(u""))):
+        return value
+    if not isinstance(value, datetime):
+        value = datetime.utcfromtimestamp(value / 1000.0)
+    return value.strftime(ENEX_DATE_FORMAT)
+
+
+class _Base64Sink(object):
+    """Decode base64 text as it arrives and pass the bytes on, hashing them on the way."""
+
+    def __init__(self, out):
+        """
+        Initialize _Base64Sink object.
+
+        @param out object with a write method for the decoded bytes, or None to keep them in memory
+        """
+        self.out = out
+        self.buffer = io.BytesIO() if out is None else None
+        self.pending = b""
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def feed(self, text):
+        """Decode as much of the base64 seen so far as possible."""
+        encoded = self.pending + b"".join(text.encode("ascii").split())
+        usable = len(encoded) - len(encoded) % 4
+        self.pending = encoded[usable:]
+        if usable:
+            self._emit(base64.b64decode(encoded[:usable]))
+
+    def _emit(self, data):
+        """Hand decoded bytes to the output."""
+        self.md5.update(data)
+        self.size += len(data)
+        (self.buffer if self.buffer is not None else self.out).write(data)
+
+    def finish(self, resource):
+        """Flush what is left and record size and hash on the resource."""
+        if self.pending:
+            self._emit(base64.b64decode(self.pending + b"=" * (-len(self.pending) % 4)))
+        resource._md5 = binascii.hexlify(self.md5.digest()).decode("ascii")
+        resource._size = self.size
+        if self.buffer is not None:
+            resource.data = self.buffer.getvalue()
+        elif hasattr(self.out, "close"):
+            self.out.close()
+
+
+class _EnexHandler(object):
+    """Expat callbacks that build EnexNote objects."""
+
+    # Child elements of <note> and <resource> that map straight onto attributes.
+    NOTE_FIELDS = ("title", "content", "created", "updated")
+    RESOURCE_FIELDS = ("mime", "width", "height", "recognition")
+
+    def __init__(self, data_dir, resource_sink):
+        """Initialize _EnexHandler object."""
+        self.data_dir = data_dir
+        self.resource_sink = resource_sink
+        self.stack = []
+        self.text = []
+        self.note = None
+        self.resource = None
+        self.sink = None
+        self.ready = []
+
+    def start(self, name, attrs):
+        """Handle an opening tag."""
+        self.stack.append(name)
+        self.text = []
+        if name == "note":
+            self.note = EnexNote()
+        elif name == "resource" and self.note is not None:
+            self.resource = EnexResource(mime=None)
+        elif name == "data" and self.resource is not None:
+            self.sink = _Base64Sink(self._resource_output())
+
+    def _resource_output(self):
+        """Pick where the bytes of the current resource go."""
+        if self.resource_sink is not None:
+            return self.resource_sink(self.resource)
+        if self.data_dir is not None:
+            fd, self.resource.data_path = tempfile.mkstemp(suffix=".res", dir=self.data_dir)
+            return os.fdopen(fd, "wb")
+        return None
+
+    def characters(self, data):
+        """Handle text, decoding attachment data straight away."""
+        if self.sink is not None:
+            self.sink.feed(data)
+        else:
+            self.text.append(data)
+
+    def end(self, name):
+        """Handle a closing tag."""
+        self.stack.pop()
+        parent = self.stack[-1] if self.stack else None
+        text = u"".join(self.text)
+        self.text = []
+        if name == "data" and self.sink is not None:
+            self.sink.finish(self.resource)
+            self.sink = None
+        elif name == "note" and self.note is not None:
+            self.ready.append(self.note)
+            self.note = None
+        elif name == "resource" and self.resource is not None:
+            self.note.resources.append(self.resource)
+            self.resource = None
+        elif parent == "note" and name in self.NOTE_FIELDS:
+            setattr(self.note, name, text)
+        elif parent == "note" and name == "tag":
+            self.note.tags.append(text)
+        elif parent == "note-attributes" and self.note is not None:
+            self.note.attributes[name] = text
+        elif parent == "resource" and name in self.RESOURCE_FIELDS and self.resource is not None:
+            setattr(self.resource, name, text)
+        elif parent == "resource-attributes" and self.resource is not None:
+            self.resource.attributes[name] = text
+
+
+def iter_enex(source, data_dir=None, resource_sink=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    Read the notes of an ENEX file one at a time.
+
+    Attachment data is base64 decoded while the file is read. By default it is kept in memory
+    (EnexResource.data), with data_dir it is written to a temporary file per attachment
+    (EnexResource.data_path, the caller removes it) and with resource_sink it is handed to a callback.
+    Either way the md5 and size of every attachment are known without reading it again.
+
+    @param source path or binary file object of the .enex file
+    @param data_dir (optional) folder to decode attachments into
+    @param resource_sink (optional) function(resource) returning an object with write(bytes) for the decoded data.
+                         Called when <data> starts so only attributes that come before it are set.
+    @param chunk_size how many bytes to read per parser feed (default:64KB)
+    @retval generator of EnexNote objects
+    """
+    handler = _EnexHandler(data_dir, resource_sink)
+    parser = expat.ParserCreate()
+    # Hand text over in large pieces rather than line by line.
+    parser.buffer_text = True
+    parser.buffer_size = chunk_size
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.characters
+    f = open(source, "rb") if isinstance(source, (str, type(u""))) else source
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            parser.Parse(chunk, False)
+            while handler.ready:
+                yield handler.ready.pop(0)
+        parser.Parse(b"", True)
+        while handler.ready:
+            yield handler.ready.pop(0)
+    finally:
+        if f is not source:
+            f.close()
+
+
+class EnexWriter(object):
+    """Write notes to an ENEX file as they are produced."""
+
+    def __init__(self, fileobj, application="Everpy", export_date=None):
+        """
+        Initialize EnexWriter object and write the ENEX header.
+
+        @param fileobj binary file object to write to
+        @param application name recorded in the en-export element
+        @param export_date (optional) datetime of the export (default: now)
+        """
+        super(EnexWriter, self).__init__()
+        self.fileobj = fileobj
+        self.notes = 0
+        self.bytes_written = 0
+        self.closed = False
+        self._write(ENEX_HEADER)
+        self._write(u'<en-export export-date="{0}" application="{1}">\n'.format(
+            format_enex_date(export_date or datetime.utcnow()), _xml_escape(application)))
+
+    def __enter__(self):
+        """Use as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the export when leaving the with block."""
+        self.close()
+
+    def _write(self, text):
+        """Write text to the file as utf-8."""
+        data = text.encode("utf-8") if isinstance(text, type(u"")) else text
+        self.fileobj.write(data)
+        self.bytes_written += len(data)
+
+    def write(self, note):
+        """
+        Append a note to the export.
+
+        @param note EnexNote to write
+        """
+        parts = [u"<note><title>", _xml_escape(note.title), u"</title><content>", _cdata(note.content), u"</content>"]
+        for tag in ("created", "updated"):
+            value = format_enex_date(getattr(note, tag))
+            if value:
+                parts.append(u"<{0}>{1}</{0}>".format(tag, _xml_escape(value)))
+        for tag in note.tags:
+            parts.append(u"<tag>{0}</tag>".format(_xml_escape(tag)))
+        if note.attributes:
+            parts.append(u"<note-attributes>")
+            for name, value in note.attributes.items():
+                parts.append(u"<{0}>{1}</{0}>".format(name, _xml_escape(value)))
+            parts.append(u"</note-attributes>")
+        self._write(u"".join(parts))
+        for resource in note.resources:
+            self.write_resource(resource)
+        self._write(u"</note>\n")
+        self.notes += 1
+
+    def write_resource(self, resource):
+        """
+        Write a <resource> element for the note being written, encoding its data in chunks.
+
+        @param resource EnexResource to write
+        """
+        self._write(u'<resource><data encoding="base64">\n')
+        with resource.open() as f:
+            for chunk in iter(lambda: f.read(ENCODE_CHUNK_SIZE), b""):
+                self._write(_encode_lines(chunk))
+        parts = [u"</data><mime>", _xml_escape(resource.mime), u"</mime>"]
+        for tag in ("width", "height"):
+            value = getattr(resource, tag)
+            if value is not None:
+                parts.append(u"<{0}>{1}</{0}>".format(tag, _xml_escape(value)))
+        if resource.recognition:
+            parts.append(u"<recognition>" + _cdata(resource.recognition) + u"</recognition>")
+        if resource.attributes:
+            parts.append(u"<resource-attributes>")
+            for name, value in resource.attributes.items():
+                parts.append(u"<{0}>{1}</{0}>".format(name, _xml_escape(value)))
+            parts.append(u"</resource-attributes>")
+        parts.append(u"</resource>")
+        self._write(u"".join(parts))
+
+    def close(self):
+        """Finish the export. The underlying file object is left open."""
+        if not self.closed:
+            self._write(u"</en-export>\n")
+            self.closed = True
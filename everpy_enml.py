@@ -0,0 +1,327 @@
+"""Helpers for working with ENML, the XHTML dialect Evernote stores note bodies in.
+
+Everything here works on the raw markup in one linear pass without building a document tree.
+"""
+import re
+
+try:
+    from htmlentitydefs import name2codepoint
+except ImportError:
+    from html.entities import name2codepoint
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# Anything that is not a text node: comments, CDATA, doctype, processing instructions and tags.
+# Quoted attribute values are matched as a whole so a '>' inside them does not end the tag.
+MARKUP_RE = re.compile(r"""<!--.*?-->|<!\[CDATA\[.*?\]\]>|<![^>]*>|<\?.*?\?>|<(?:[^>"']|"[^"]*"|'[^']*')*>""", re.S)
+ENTITY_RE = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);")
+# Control characters XML does not allow anywhere in a document.
+INVALID_XML_CHARS_RE = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Start tags, end tags and attributes as matched inside a markup token.
+TAG_RE = re.compile(r"<(/?)([A-Za-z][-A-Za-z0-9:_.]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*?)(/?)>$", re.S)
+ATTR_RE = re.compile(r"""\s*([^\s=/>"']+)\s*=\s*("[^"]*"|'[^']*')|\s*(\S)""", re.S)
+MD5_HEX_RE = re.compile(r"^[0-9a-fA-F]{32}$")
+
+# Elements the ENML DTD allows, see http://xml.evernote.com/pub/enml2.dtd
+ENML_ELEMENTS = frozenset("""
+    en-note en-media en-crypt en-todo
+    a abbr acronym address area b bdo big blockquote br caption center cite code col colgroup dd del dfn div dl
+    dt em font h1 h2 h3 h4 h5 h6 hr i img ins kbd li map ol p pre q s samp small span strike strong sub sup table
+    tbody td tfoot th thead title tr tt u ul var xmp
+""".split())
+# Attributes the ENML DTD does not allow on any element, besides the on* event handlers.
+ENML_FORBIDDEN_ATTRIBUTES = frozenset(["id", "class", "accesskey", "data", "dynsrc", "tabindex"])
+EN_MEDIA_REQUIRED_ATTRIBUTES = ("type", "hash")
+
+ENML_HEADER = "<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'><en-note>"
+ENML_FOOTER = "</en-note>"
+
+
+class EnmlError(ValueError):
+    """Content that is not valid ENML."""
+
+
+def _entity_char(match, as_bytes):
+    """Return the character an entity match stands for, in the same string type as the text."""
+    name = match.group(1)
+    if name[:2] in ("#x", "#X"):
+        char = unichr(int(name[2:], 16))
+    elif name[0] == "#":
+        char = unichr(int(name[1:]))
+    elif name in name2codepoint:
+        char = unichr(name2codepoint[name])
+    elif name == "apos":
+        char = u"'"
+    else:
+        return match.group(0)
+    return char.encode("utf-8") if as_bytes else char
+
+
+def unescape(text):
+    """
+    Replace character references and named entities with the characters they stand for.
+
+    @param text escaped text
+    @retval unescaped text of the same string type
+    """
+    if "&" not in text:
+        return text
+    as_bytes = not isinstance(text, type(u""))
+    return ENTITY_RE.sub(lambda m: _entity_char(m, as_bytes), text)
+
+
+def escape(text):
+    """
+    Escape text so it can be placed in a text node.
+
+    @param text unescaped text
+    @retval escaped text
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def iter_tokens(content):
+    """
+    Split markup into markup and text tokens.
+
+    @param content ENML or XHTML markup
+    @retval generator of (is_text, token) tuples covering the whole of content in order
+    """
+    pos = 0
+    for match in MARKUP_RE.finditer(content):
+        start = match.start()
+        if start > pos:
+            yield True, content[pos:start]
+        yield False, match.group(0)
+        pos = match.end()
+    if pos < len(content):
+        yield True, content[pos:]
+
+
+def _is_tag(token, name, closing=False):
+    """Check whether a markup token opens (or closes) an element."""
+    prefix = ("</" if closing else "<") + name
+    return token.startswith(prefix) and token[len(prefix):len(prefix) + 1] in (">", "/", " ", "\t", "\r", "\n")
+
+
+def _opens(token, name):
+    """Check whether a markup token starts an element that has content, not an empty <name/>."""
+    return _is_tag(token, name) and not token.endswith("/>")
+
+
+def rewrite_text(content, pattern, repl):
+    """
+    Run a regex replacement over the text nodes of a note.
+
+    Only text inside en-note is touched, tags, attributes, comments and the encrypted text of
+    en-crypt are copied through unchanged.
+    Text nodes are matched unescaped, just like a browser would show them, and escaped again if changed.
+
+    @param content full ENML content of a note
+    @param pattern compiled regex to find
+    @param repl replacement string or function, as for re.sub
+    @retval tuple (new content, number of replacements made)
+    """
+    parts = []
+    replacements = 0
+    in_note = in_crypt = False
+    for is_text, token in iter_tokens(content):
+        if not is_text:
+            if _is_tag(token, "en-note"):
+                in_note = _opens(token, "en-note")
+            elif _is_tag(token, "en-note", closing=True):
+                in_note = False
+            elif _is_tag(token, "en-crypt"):
+                in_crypt = _opens(token, "en-crypt")
+            elif _is_tag(token, "en-crypt", closing=True):
+                in_crypt = False
+            parts.append(token)
+            continue
+        if in_note and not in_crypt:
+            text = unescape(token)
+            new_text, count = pattern.subn(repl, text)
+            if count and new_text != text:
+                replacements += count
+                token = escape(new_text)
+        parts.append(token)
+    if not replacements:
+        return content, 0
+    return "".join(parts), replacements
+
+
+def extract_text(content):
+    """
+    Strip the markup from a note leaving only its text.
+
+    @param content full ENML content of a note
+    @retval the unescaped text inside en-note but outside en-crypt, with whitespace between elements
+    """
+    parts = []
+    in_note = in_crypt = False
+    for is_text, token in iter_tokens(content):
+        if not is_text:
+            if _is_tag(token, "en-note"):
+                in_note = _opens(token, "en-note")
+            elif _is_tag(token, "en-note", closing=True):
+                in_note = False
+            else:
+                if _is_tag(token, "en-crypt"):
+                    in_crypt = _opens(token, "en-crypt")
+                elif _is_tag(token, "en-crypt", closing=True):
+                    in_crypt = False
+                if in_note and parts and parts[-1] != " ":
+                    parts.append(" ")
+            continue
+        if in_note and not in_crypt:
+            parts.append(unescape(token))
+    return "".join(parts).strip()
+
+
+def _check_tag(name, attributes):
+    """Check the element name and attributes of a start tag, raise EnmlError if ENML does not allow them."""
+    if name not in ENML_ELEMENTS:
+        raise EnmlError("Element <{0}> is not allowed in ENML".format(name))
+    seen = {}
+    for match in ATTR_RE.finditer(attributes):
+        attribute, value, junk = match.groups()
+        if junk:
+            raise EnmlError("Malformed attributes in <{0}>".format(name))
+        attribute = attribute.lower()
+        if attribute in ENML_FORBIDDEN_ATTRIBUTES or attribute.startswith("on"):
+            raise EnmlError("Attribute {0} is not allowed on <{1}> in ENML".format(attribute, name))
+        if attribute in seen:
+            raise EnmlError("Duplicate attribute {0} on <{1}>".format(attribute, name))
+        seen[attribute] = value[1:-1]
+    if name == "en-media":
+        for attribute in EN_MEDIA_REQUIRED_ATTRIBUTES:
+            if not seen.get(attribute):
+                raise EnmlError("<en-media> needs a {0} attribute".format(attribute))
+        if not MD5_HEX_RE.match(seen["hash"]):
+            raise EnmlError("<en-media> hash {0!r} is not a hex md5".format(seen["hash"]))
+
+
+def validate_enml(content):
+    """
+    Check a note body against the ENML rules before it is sent.
+
+    Checks in one pass that the markup is well formed with a single en-note root, only uses the
+    elements and attributes ENML allows, has no bare ampersands or control characters and that
+    every en-media has a type and an md5 hash.
+
+    @param content full ENML content of a note
+    @retval content
+    @throws EnmlError describing the first problem found
+    """
+    if INVALID_XML_CHARS_RE.search(content):
+        raise EnmlError("Control characters are not allowed in ENML")
+    open_elements = []
+    seen_root = False
+    for is_text, token in iter_tokens(content):
+        if is_text:
+            if not open_elements and token.strip():
+                raise EnmlError("Text outside of <en-note>: {0!r}".format(token.strip()[:40]))
+            if "&" in token and token.count("&") != len(ENTITY_RE.findall(token)):
+                raise EnmlError("Unescaped & in {0!r}".format(token.strip()[:40]))
+            continue
+        if token.startswith("<?") or token.startswith("<!"):
+            if open_elements and not token.startswith("<!--"):
+                raise EnmlError("{0!r} is not allowed inside <en-note>".format(token[:40]))
+            continue
+        match = TAG_RE.match(token)
+        if not match:
+            raise EnmlError("Malformed tag {0!r}".format(token[:40]))
+        closing, name, attributes, self_closing = match.groups()
+        if closing:
+            if not open_elements:
+                raise EnmlError("Unexpected </{0}>".format(name))
+            if open_elements[-1] != name:
+                raise EnmlError("Expected </{0}> but found </{1}>".format(open_elements[-1], name))
+            open_elements.pop()
+            continue
+        if not open_elements:
+            if name != "en-note" or seen_root:
+                raise EnmlError("The note must have a single <en-note> root, found <{0}>".format(name))
+            seen_root = True
+        elif name == "en-note":
+            raise EnmlError("<en-note> can not be nested")
+        _check_tag(name, attributes)
+        if not self_closing:
+            open_elements.append(name)
+    if open_elements:
+        raise EnmlError("<{0}> is never closed".format(open_elements[-1]))
+    if not seen_root:
+        raise EnmlError("The note has no <en-note> root")
+    return content
+
+
+class EnmlBuilder(object):
+    """
+    Assemble a note body piece by piece and join it once at the end.
+    """
+
+    def __init__(self, header=ENML_HEADER, footer=ENML_FOOTER):
+        """
+        Initialize EnmlBuilder object.
+
+        @param header (optional) markup up to and including the en-note start tag
+        @param footer (optional) markup closing the en-note
+        """
+        super(EnmlBuilder, self).__init__()
+        self.footer = footer
+        self.parts = [header]
+
+    def markup(self, markup):
+        """Add ENML markup as is."""
+        self.parts.append(markup)
+        return self
+
+    def text(self, text):
+        """Add text, escaped, without the control characters XML does not allow."""
+        self.parts.append(escape(INVALID_XML_CHARS_RE.sub("", text)))
+        return self
+
+    def media(self, md5, mime):
+        """
+        Show an attachment.
+
+        @param md5 hex md5 of the attachment data
+        @param mime mime type of the attachment
+        """
+        self.parts.append('<en-media type="' + escape(mime).replace('"', "&quot;") + '" hash="' + md5 + '"/>')
+        return self
+
+    def build(self, validate=True):
+        """
+        Join the note body.
+
+        @param validate (optional) check it with validate_enml (default:True)
+        @retval ENML content
+        @throws EnmlError if validate and the content is not valid ENML
+        """
+        content = "".join(self.parts + [self.footer])
+        if validate:
+            validate_enml(content)
+        return content
+
+
+def text_to_enml(text, media=()):
+    """
+    Turn plain text into a complete ENML note, one div per line.
+
+    @param text plain text of the note
+    @param media (optional) (md5 hex, mime type) of attachments to show below the text
+    @retval ENML content
+    """
+    builder = EnmlBuilder()
+    for line in INVALID_XML_CHARS_RE.sub("", text).splitlines():
+        if line.strip():
+            builder.markup("<div>").text(line).markup("</div>")
+        else:
+            builder.markup("<div><br/></div>")
+    for md5, mime in media:
+        builder.media(md5, mime)
+    return builder.build(validate=False)
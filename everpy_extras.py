@@ -8,40 +8,79 @@ Some ideas are:
     4. Automated backup
 """
 import tempfile
+import json
+import mimetypes
 import os
+import shutil
+import time
+from collections import OrderedDict
 from everpy import EverPy
+from everpy_archive import COMPRESSION_SUFFIXES, compress_file, compression_suffix, describe_file, verify_file
+from everpy_enex import EnexNote, EnexResource, EnexWriter
+from everpy_enml import extract_text, text_to_enml
+from everpy_pool import imap_ordered
+from everpy_retention import GenerationIndex, generation_file_name
+from everpy_runner import ENSCRIPT_CONCURRENCY
+from everpy_scheduler import BackupJob, BackupScheduler
+from everpy_store import BackupStore
 from datetime import datetime
 
+BACKUP_FOLDER_PREFIX = "enotebk__"
+BACKUP_TIMESTAMP_FORMAT = "%m-%d-%Y__%H-%M-%S"
+BACKUP_MANIFEST = "manifest.json"
 
-def roll_files(backup_file, number_of_backups):
+# Largest generated .enex file handed to a single ENScript importNotes call (64MB).
+DEFAULT_IMPORT_CHUNK_BYTES = 64 * 1024 * 1024
+# Fields of a record for import_records, in tuple order.
+IMPORT_RECORD_FIELDS = ("content", "title", "tags", "notebook", "created", "attachments")
+
+
+def read_backup_manifest(backup_folder):
+    """
+    Read the manifest of a proper_backup snapshot.
+
+    @param backup_folder snapshot folder
+    @retval manifest dict, empty if the snapshot has none
+    """
+    try:
+        with open(os.path.join(backup_folder, BACKUP_MANIFEST), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_backup_manifest(backup_folder, manifest):
     """
-    Rotate files.
+    Write the manifest of a proper_backup snapshot.
 
-    @param backup_file file to roll
-    @param number_of_backups files to keep
+    @param backup_folder snapshot folder
+    @param manifest dict to store
     """
-    path_pieces = backup_file.split(os.sep)
-    file_name = path_pieces[-1]
-    file_path = os.sep.join(path_pieces[:-1])
-    items_in_dir = os.listdir(file_path)
-    current_number_of_backups = len([i for i in items_in_dir if file_name in i])
+    with open(os.path.join(backup_folder, BACKUP_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
 
-    backup_file_base = file_path + os.sep + file_name
 
-    if current_number_of_backups > number_of_backups:
-        # Delete oldest rename all others
-        os.remove(backup_file_base + "." + str(number_of_backups))
+def link_or_copy(source, dest):
+    """
+    Hard link a file, falling back to a copy where links are not possible.
 
-    # Roll the files
-    for i in range(current_number_of_backups - 1, 0, -1):
-        os.rename(backup_file_base + "." + str(i), backup_file_base + "." + str(i + 1))
-    os.rename(backup_file_base, backup_file_base + ".1")
+    @param source existing file
+    @param dest path of the new file
+    """
+    if hasattr(os, "link"):
+        try:
+            os.link(source, dest)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, dest)
 
 
 class EverPyExtras(EverPy):
     """Provide extra Evernote commands."""
 
-    def __init__(self, path_enscript_exe, username=None, password=None):
+    def __init__(self, path_enscript_exe, username=None, password=None, enscript_concurrency=ENSCRIPT_CONCURRENCY,
+                 enscript_timeout=None):
         r"""
         Initialize EverPyExtras object.
 
@@ -52,8 +91,11 @@ class EverPyExtras(EverPy):
                                  usually "C:\Program Files (x86)\Evernote\Evernote\ENScript.exe"
         @param username if not using the default account you'll need to provide a username
         @param password if not using the default account you'll need to provide a password
+        @param enscript_concurrency (optional) how many ENScript commands may run at once (default:2)
+        @param enscript_timeout (optional) seconds after which an ENScript command is killed (default: no timeout)
         """
-        super(EverPyExtras, self).__init__(path_enscript_exe, username, password)
+        super(EverPyExtras, self).__init__(path_enscript_exe, username, password, enscript_concurrency, enscript_timeout)
+        self.backup_engine = "enscript"
 
     @staticmethod
     def _build_query_from_items(*args):
@@ -73,9 +115,11 @@ class EverPyExtras(EverPy):
     def get_notes_to_manage(self):
         """Note(s) that need to be filtered managed etc.
 
-        A possible enhancement to this function would be to find all
-        tags with less than 3 notes and display that list. Then possibly use
-        google to find related words and help suggest notes to tag with a specific tag.
+        Opens the client with the untagged notes and notes with meaningless titles.
+        Tags with less than 3 notes, empty notebooks and the number of untagged notes are
+        counted on the server by EverPyPro.get_account_stats (the `stats` command).
+        A possible enhancement would be to use google to find related words for the sparse
+        tags and help suggest notes to tag with a specific tag.
 
         """
         untagged_notes_query = "-tag:*"
@@ -91,48 +135,435 @@ class EverPyExtras(EverPy):
         search_query = "any: " + self._build_query_from_items(untagged_notes_query, crappy_note_title_query)
         return EverPy.search_notes(self, search_query)
 
-    def proper_backup(self, backup_location, iterations=5):
+    def get_notebook_change_markers(self, notebooks):
+        """
+        Get a marker per notebook that changes whenever anything in the notebook does.
+
+        ENScript has no way to tell whether a notebook changed so no markers are available here.
+        Subclasses with access to the Evernote API override this.
+
+        @param notebooks list of notebook names
+        @retval dict of notebook name to marker string
+        """
+        return {}
+
+    def get_backup_notebooks(self):
+        """
+        Get the names of the notebooks a backup should cover.
+
+        @retval list of notebook names
+        """
+        return EverPy.get_notebooks(self)
+
+    def export_query(self, query, export_file):
+        """
+        Export the notes matching a query for a backup.
+
+        ENScript can only write plain .enex files, so for a compressed export_file (.gz, .xz)
+        the export is compressed afterwards and the plain file removed.
+
+        @param query query to filter the notes
+        @param export_file path of the .enex file to write
+        @retval tuple (exit status, error output)
+        """
+        plain_file = export_file
+        for suffix in COMPRESSION_SUFFIXES.values():
+            if export_file.endswith(suffix):
+                plain_file = export_file[:-len(suffix)]
+        out, err, returncode = self.run_enscript(self.export_notes_args(query, plain_file))
+        if plain_file != export_file and os.path.isfile(plain_file):
+            compress_file(plain_file, export_file)
+        return returncode, err
+
+    def export_notebook(self, notebook, export_file):
+        """
+        Export a single notebook for a backup.
+
+        @param notebook name of the notebook
+        @param export_file path of the .enex file to write
+        @retval tuple (exit status, error output)
+        """
+        return self.export_query("notebook:\"{0}\"".format(notebook), export_file)
+
+    def _timed_export(self, job):
+        """Run export_notebook for a (notebook, export_file) job and time it, not counting the wait for ENScript."""
+        notebook, export_file = job
+        waited = self.enscript_runner.waited_seconds()
+        start = time.time()
+        returncode, err = self.export_notebook(notebook, export_file)
+        return returncode, err, time.time() - start - (self.enscript_runner.waited_seconds() - waited)
+
+    def proper_backup(self, backup_location, iterations=None, incremental=False, workers=1, compress=None):
         """
         Do a proper backup of all notes retaining Notebook names.
 
+        With incremental set only notebooks whose change marker differs from the previous snapshot
+        are exported again, unchanged notebooks are hard linked from the previous snapshot.
+        Exports run workers at a time, largest notebook (by its size in the previous snapshot) first.
+        The timing, exit status, size and SHA-256 of every export end up in the snapshot's manifest.json.
+
+        Snapshots are tracked in the location's retention.json. A snapshot where any export failed is
+        left on disk but not tracked, so it is never the base of an incremental run and never pushes
+        out a good snapshot; remove it by hand once it is no longer needed. Only tracked snapshots are
+        ever pruned, folders written before retention.json existed are left alone.
+
         @param backup_location Path to save backup
-        @param iterations how many backup iterations to keep (default:5) (not currently being used)
+        @param iterations (optional) how many backups to keep or a RetentionPolicy (default: keep all)
+        @param incremental only re-export notebooks that changed since the last backup (default:False)
+        @param workers how many notebooks to export at once (default:1).
+                       The ENScript concurrency of this object is raised to workers if it is lower.
+        @param compress (optional) `gzip` or `xz` to store compressed .enex.gz/.enex.xz files
+        @retval path of the new backup folder
 
         @todo This should also retain stack information
         """
         if (not backup_location.endswith(os.sep)):
             backup_location += os.sep
+        suffix = compression_suffix(compress)
         # Get a list of all notebooks
-        notebooks = EverPy.get_notebooks(self)
+        notebooks = self.get_backup_notebooks()
+        started = time.time()
+        markers = self.get_notebook_change_markers(notebooks) if incremental else {}
+        index = GenerationIndex(backup_location)
+        backups = index.generations(BACKUP_FOLDER_PREFIX)
+        previous_folder, previous_notebooks = None, {}
+        if backups:
+            previous_folder = os.path.join(backup_location, backups[-1][1])
+            previous_notebooks = read_backup_manifest(previous_folder).get("notebooks", {})
         # Create a folder with time-stamp
-        ts = "{:%m-%d-%Y__%H-%M-%S}".format(datetime.now())
-        backup_folder = "{0}enotebk__{1}".format(backup_location, ts)
+        created = datetime.now()
+        ts = created.strftime(BACKUP_TIMESTAMP_FORMAT)
+        backup_folder = "{0}{1}{2}".format(backup_location, BACKUP_FOLDER_PREFIX, ts)
+        serial = 0
+        while os.path.exists(backup_folder):
+            # A second backup within the same second.
+            serial += 1
+            backup_folder = "{0}{1}{2}-{3}".format(backup_location, BACKUP_FOLDER_PREFIX, ts, serial)
         os.mkdir(backup_folder)
+        manifest = {"created": ts, "incremental": bool(markers), "compress": compress, "notebooks": {}}
+        exports = []
         for notebook in notebooks:
-            print("Backing up {0}".format(notebook))
-            EverPy.export_notes(
-                self,
-                "notebook:\"{0}\"".format(notebook),
-                "{0}{1}{2}.enex".format(backup_folder, os.sep, notebook)
-            )
+            export_file = "{0}{1}{2}.enex{3}".format(backup_folder, os.sep, notebook, suffix)
+            marker = markers.get(notebook)
+            previous_file = previous_folder and os.path.join(previous_folder, os.path.basename(export_file))
+            entry = manifest["notebooks"][notebook] = {
+                "file": os.path.basename(export_file),
+                "marker": marker,
+            }
+            previous = previous_notebooks.get(notebook, {})
+            if (marker is not None and previous.get("marker") == marker and previous.get("returncode", 0) == 0
+                    and os.path.isfile(previous_file)):
+                print("Unchanged {0}".format(notebook))
+                link_or_copy(previous_file, export_file)
+                entry["source"] = "linked"
+                for key in ("size", "sha256", "content_size", "content_sha256"):
+                    if key in previous:
+                        entry[key] = previous[key]
+            else:
+                size = os.path.getsize(previous_file) if previous_file and os.path.isfile(previous_file) else 0
+                exports.append((size, notebook, export_file))
+        failed = self._run_exports(exports, workers, manifest)
+        manifest["seconds"] = time.time() - started
+        manifest["failed"] = failed
+        write_backup_manifest(backup_folder, manifest)
+        if failed:
+            # Do not let a broken snapshot count as a generation and push out a good one.
+            print("Backup {0} is incomplete, it is kept but not counted as a generation".format(backup_folder))
+            return backup_folder
+        index.add(BACKUP_FOLDER_PREFIX, os.path.basename(backup_folder), created)
+        if iterations is not None:
+            for dropped in index.prune(BACKUP_FOLDER_PREFIX, iterations):
+                print("Removed old backup {0}".format(dropped))
+        return backup_folder
 
-    def automate_backup(self, query, backup_location, file_name, frequency, iterations):
+    def _run_exports(self, exports, workers, manifest, on_exported=None, checksum=True):
+        """
+        Export notebooks concurrently, largest first, recording the outcome in the manifest.
+
+        @param exports list of (estimated size, notebook, export_file) tuples
+        @param workers how many notebooks to export at once
+        @param manifest backup manifest whose notebook entries get timing and exit status
+        @param on_exported (optional) function(notebook, export_file, entry) called for each successful export
+        @param checksum record size and SHA-256 of every export file (default:True)
+        @retval sorted list of the notebooks that failed
+        """
+        if self.backup_engine == "enscript" and workers > self.enscript_runner.concurrency:
+            # Otherwise the extra workers would only queue for an ENScript slot.
+            self.set_enscript_limits(workers, self.enscript_runner.timeout)
+        # Largest first so the long exports do not end up running alone at the end.
+        exports = sorted(exports, key=lambda export: -export[0])
+        jobs = [(notebook, export_file) for _, notebook, export_file in exports]
+        failed = []
+        for (notebook, export_file), result, error in imap_ordered(self._timed_export, jobs, workers):
+            entry = manifest["notebooks"][notebook]
+            entry["source"] = "exported"
+            if error is not None:
+                returncode, err, seconds = None, str(error), None
+            else:
+                returncode, err, seconds = result
+            entry["returncode"] = returncode
+            entry["seconds"] = seconds
+            if returncode != 0:
+                entry["error"] = (err or "").strip()
+                # Without a marker the next incremental run exports the notebook again.
+                entry["marker"] = None
+                failed.append(notebook)
+                print("Failed to back up {0}: {1}".format(notebook, entry["error"]))
+                continue
+            if checksum and os.path.isfile(export_file):
+                entry.update(describe_file(export_file))
+            elif os.path.isfile(export_file):
+                entry["size"] = os.path.getsize(export_file)
+            if on_exported:
+                on_exported(notebook, export_file, entry)
+            print("Backed up {0} in {1:.1f}s".format(notebook, seconds))
+        return sorted(failed)
+
+    def store_backup(self, store_location, iterations=None, incremental=False, workers=1):
+        """
+        Back up all notebooks into a deduplicated BackupStore.
+
+        Every notebook is exported, split into note and attachment objects keyed by md5 and the
+        export removed again, so a snapshot only costs the notes and attachments that are new.
+        With incremental set unchanged notebooks are not even exported, they reuse the previous snapshot's notes.
+        With iterations given, the snapshots it does not keep are dropped and objects nothing refers
+        to any more are removed.
+
+        @param store_location folder of the store
+        @param iterations (optional) how many snapshots to keep or a RetentionPolicy (default: keep all)
+        @param incremental only re-export notebooks that changed since the last backup (default:False)
+        @param workers how many notebooks to export at once (default:1)
+        @retval name of the new snapshot
+        """
+        store = BackupStore(store_location)
+        notebooks = self.get_backup_notebooks()
+        started = time.time()
+        markers = self.get_notebook_change_markers(notebooks) if incremental else {}
+        previous_notebooks = store.latest_snapshot().get("notebooks", {})
+        staging = tempfile.mkdtemp(prefix="staging", dir=store_location)
+        manifest = {"incremental": bool(markers), "notebooks": {}}
+        exports = []
+        try:
+            for notebook in notebooks:
+                marker = markers.get(notebook)
+                previous = previous_notebooks.get(notebook, {})
+                entry = manifest["notebooks"][notebook] = {"marker": marker, "notes": []}
+                if marker is not None and previous.get("marker") == marker:
+                    print("Unchanged {0}".format(notebook))
+                    entry["notes"] = previous["notes"]
+                    entry["size"] = previous.get("size")
+                    entry["source"] = "linked"
+                else:
+                    export_file = os.path.join(staging, "{0}.enex".format(len(exports)))
+                    exports.append((previous.get("size") or 0, notebook, export_file))
+
+            def ingest(notebook, export_file, entry):
+                entry["notes"] = store.add_enex(export_file)
+                os.remove(export_file)
+
+            manifest["failed"] = self._run_exports(exports, workers, manifest, ingest, checksum=False)
+            for notebook in manifest["failed"]:
+                # Keep the last good copy rather than recording an empty notebook.
+                previous = previous_notebooks.get(notebook)
+                if previous:
+                    manifest["notebooks"][notebook]["notes"] = previous["notes"]
+                    # The marker has to describe the notes kept, or the next run would keep them again.
+                    manifest["notebooks"][notebook]["marker"] = previous.get("marker")
+                    manifest["notebooks"][notebook]["stale"] = True
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        manifest["seconds"] = time.time() - started
+        name = store.write_snapshot(manifest["notebooks"], extra=manifest)
+        if iterations is None:
+            return name
+        dropped, removed = store.prune(iterations)
+        if dropped:
+            print("Dropped {0} old snapshots and {1} unused objects".format(len(dropped), removed))
+        return name
+
+    def verify_backup(self, backup_folder, workers=4):
+        """
+        Check every file of a proper_backup snapshot against the sizes and SHA-256 in its manifest.
+
+        Files are checked in parallel, compressed ones are decompressed in memory only.
+
+        @param backup_folder snapshot folder
+        @param workers how many files to check at once (default:4)
+        @retval dict of notebook name to list of problems, empty if the snapshot is intact
+        """
+        manifest = read_backup_manifest(backup_folder)
+        if not manifest:
+            return {None: ["no manifest in {0}".format(backup_folder)]}
+        entries = sorted(manifest.get("notebooks", {}).items())
+
+        def check(item):
+            notebook, entry = item
+            if "sha256" not in entry:
+                return ["no checksum recorded"] if entry.get("returncode", 0) == 0 else ["export had failed"]
+            return verify_file(os.path.join(backup_folder, entry["file"]), entry)
+
+        problems = {}
+        for (notebook, entry), result, error in imap_ordered(check, entries, workers):
+            result = [str(error)] if error is not None else result
+            if result:
+                problems[notebook] = result
+        return problems
+
+    def restore_backup(self, store_location, dest_folder, snapshot=None):
+        """
+        Rebuild the .enex files of a store_backup snapshot.
+
+        @param store_location folder of the store
+        @param dest_folder folder to write one .enex file per notebook to
+        @param snapshot (optional) name of the snapshot (default: the newest)
+        @retval list of files written
+        """
+        store = BackupStore(store_location)
+        snapshot = snapshot or store.snapshots()[-1]
+        return store.restore(snapshot, dest_folder)
+
+    def backup_query(self, query, backup_location, file_name, iterations, compress=None):
+        """
+        Back up the notes matching a query to a single file.
+
+        Every backup is a new file with its timestamp in the name, e.g. notes.20240131T220000.enex,
+        nothing is renamed. Once it succeeded the backups iterations does not keep are removed.
+
+        @param query Query for notes to backup
+        @param backup_location Path to save backup
+        @param file_name for backup
+        @param iterations how many backups to keep or a RetentionPolicy
+        @param compress (optional) `gzip` or `xz` to store a compressed .enex.gz/.enex.xz file
+        @retval tuple (exit status, error output, path of the backup file)
+        """
+        if (not file_name.endswith(".enex")):
+            file_name += ".enex"
+        file_name += compression_suffix(compress)
+        created = datetime.now()
+        serial = 0
+        backup_file = backup_location + os.sep + generation_file_name(file_name, created)
+        while os.path.exists(backup_file):
+            serial += 1
+            backup_file = backup_location + os.sep + generation_file_name(file_name, created, serial)
+        returncode, err = self.export_query(query, backup_file)
+        if returncode != 0:
+            # Do not let a broken export count as a generation.
+            if os.path.isfile(backup_file):
+                os.remove(backup_file)
+            return returncode, err, backup_file
+        index = GenerationIndex(backup_location)
+        index.add(file_name, os.path.basename(backup_file), created)
+        index.prune(file_name, iterations)
+        return returncode, err, backup_file
+
+    def automate_backup(self, query, backup_location, file_name, frequency, iterations, compress=None, jitter=0,
+                        state_file=None):
         """
         Automate backup of notes.
 
+        This call blocks: it backs up every frequency minutes until the process is interrupted (Ctrl-C) and only
+        then returns. To back up in the background, create a BackupScheduler and call its run_forever from a thread.
+        When the account can be asked for its sync state (EverPyPro) runs where nothing changed are skipped.
+
         @param query Query for notes to backup
         @param backup_location Path to save backup
         @param file_name for backup
         @param frequency how often to backup in minutes
-        @param iterations how many backup iterations to keep
+        @param iterations how many backups to keep or a RetentionPolicy
+        @param compress (optional) `gzip` or `xz` to store a compressed .enex.gz/.enex.xz file
+        @param jitter (optional) up to how many seconds to delay each run (default:0)
+        @param state_file (optional) json file to keep the run statistics in
+        @retval dict of the run statistics once stopped
+        """
+        job = BackupJob(file_name, backup_location, frequency, query=query, iterations=iterations,
+                        file_name=file_name, compress=compress)
+        scheduler = BackupScheduler(self, [job], jitter=jitter, state_file=state_file)
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+        return job.stats()
 
-        @todo this is not really automated what so ever needs to start some sort of service
+    def record_to_enex_note(self, record, enml=False):
         """
-        if (not file_name.endswith(".enex")):
-            file_name += ".enex"
-        backup_file = backup_location + os.sep + file_name
-        roll_files(backup_file, iterations)
-        EverPy.export_notes(self, query, backup_file)
+        Build the ENEX note for an import_records record.
+
+        @param record tuple or dict with the IMPORT_RECORD_FIELDS, fields after content are optional
+        @param enml content is already complete ENML rather than plain text (default:False)
+        @retval tuple (EnexNote, notebook name or None)
+        """
+        if isinstance(record, dict):
+            fields = dict((name, record.get(name)) for name in IMPORT_RECORD_FIELDS)
+        else:
+            fields = dict(zip(IMPORT_RECORD_FIELDS, list(record) + [None] * len(IMPORT_RECORD_FIELDS)))
+        content = fields["content"]
+        resources = []
+        for attachment in fields["attachments"] or []:
+            mime = mimetypes.guess_type(attachment)[0] or "application/octet-stream"
+            resources.append(EnexResource(mime=mime, attributes={"file-name": os.path.basename(attachment)},
+                                          data_path=attachment))
+        title = fields["title"]
+        if enml:
+            title = title or self.get_title_from_content(extract_text(content))
+        else:
+            title = title or self.get_title_from_content(content)
+            content = text_to_enml(content, [(resource.hash, resource.mime) for resource in resources])
+        note = EnexNote(title or "Untitled", content, created=fields["created"], tags=fields["tags"])
+        note.resources = resources
+        return note, fields["notebook"]
+
+    def import_records(self, records, notebook_type="personal", max_chunk_bytes=DEFAULT_IMPORT_CHUNK_BYTES, enml=False):
+        """
+        Create many notes with a handful of ENScript calls instead of one per note.
+
+        Records are streamed into one .enex file per notebook. Whenever a file grows past max_chunk_bytes
+        it is handed to importNotes and a new one started, so disk use stays bounded however many notes there are.
+
+        @param records iterable of (content, title, tags, notebook, created, attachments) tuples or dicts with those keys.
+                    content is plain text (or ENML with enml set), title, tags, notebook, created and attachments
+                    are optional. created is a datetime in UTC, milliseconds since the epoch or an ENEX timestamp,
+                    attachments is a list of file paths. Notes without a notebook go to the default notebook.
+        @param notebook_type (optional) types are
+                    personal - what you most likely want to user(default)
+                    business - specify business notebook
+        @param max_chunk_bytes (optional) size at which an .enex file is imported and a new one started (default:64MB)
+        @param enml (optional) contents are complete ENML rather than plain text (default:False)
+        @retval list of (notebook name, notes imported, exit status, error output), one per importNotes call
+        """
+        staging = tempfile.mkdtemp(prefix="everpy_import")
+        # notebook name -> (file, EnexWriter, path) of the chunk being written
+        chunks = OrderedDict()
+        results = []
+
+        def import_chunk(notebook):
+            f, writer, path = chunks.pop(notebook)
+            writer.close()
+            f.close()
+            out, err, returncode = self.run_enscript(self.import_notes_args(path, notebook_type, notebook))
+            os.remove(path)
+            results.append((notebook, writer.notes, returncode, err))
+            if returncode != 0:
+                print("Failed to import {0} notes into {1}: {2}".format(
+                    writer.notes, notebook or "the default notebook", (err or "").strip()))
+
+        try:
+            for record in records:
+                note, notebook = self.record_to_enex_note(record, enml)
+                if notebook not in chunks:
+                    path = os.path.join(staging, "{0}.enex".format(len(results) + len(chunks)))
+                    f = open(path, "wb")
+                    chunks[notebook] = (f, EnexWriter(f), path)
+                writer = chunks[notebook][1]
+                writer.write(note)
+                if writer.bytes_written >= max_chunk_bytes:
+                    import_chunk(notebook)
+            while chunks:
+                import_chunk(next(iter(chunks)))
+        finally:
+            for f, _, _ in chunks.values():
+                f.close()
+            shutil.rmtree(staging, ignore_errors=True)
+        return results
 
     def create_note_from_content(self, content, notebook_type="personal", notebook_name=None, title=None,
                                  tags=[], create_date=None, file_attachments=[]):
@@ -152,6 +583,8 @@ class EverPyExtras(EverPy):
         @param create_date (optional) note creation date/time. { "YYYY/MM/DD hh:mm:ss" | filetime }.
                     If omitted, use current time.
         @param file_attachments list of file attachments.
+
+        Every call launches ENScript once, use import_records to create many notes.
         """
         if not title:
             title = self.get_title_from_content(content)
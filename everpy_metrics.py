@@ -0,0 +1,306 @@
+"""Count, time and size the calls everpy makes to ENScript and the Evernote service.
+
+Nothing is collected until a scope is opened:
+
+    with metrics_scope() as metrics:
+        my_evernote.update_metadata("tag:todo", add_tags=["done"])
+    print(metrics.as_dict())
+
+Every open scope sees every call made while it is open, from any thread, so a job scope can be
+nested in the process wide one the CLI opens for -metrics.
+"""
+import contextlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+# Metrics of the scopes currently open, innermost last.
+_scopes = []
+_scopes_lock = threading.Lock()
+
+
+class OperationStats(object):
+    """Totals and latency histogram of one operation."""
+
+    def __init__(self):
+        """Initialize OperationStats object."""
+        super(OperationStats, self).__init__()
+        self.calls = 0
+        self.seconds = 0.0
+        self.min_seconds = None
+        self.max_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # error name -> count
+        self.errors = {}
+        # one count per LATENCY_BUCKETS_MS bound plus one for slower calls
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, seconds, bytes_in=0, bytes_out=0, error=None):
+        """Add one call."""
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if self.min_seconds is None or seconds < self.min_seconds:
+            self.min_seconds = seconds
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def percentile_ms(self, fraction):
+        """Estimate a latency percentile as the upper bound of the bucket it falls in, None above the last bound."""
+        wanted = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return bound
+        return None
+
+    def as_dict(self):
+        """Return the stats as plain data for json."""
+        histogram = OrderedDict(("<={0}ms".format(bound), count)
+                                for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram) if count)
+        if self.histogram[-1]:
+            histogram[">{0}ms".format(LATENCY_BUCKETS_MS[-1])] = self.histogram[-1]
+        stats = OrderedDict()
+        stats["calls"] = self.calls
+        stats["errors"] = sum(self.errors.values())
+        stats["error_types"] = dict(self.errors)
+        stats["seconds"] = round(self.seconds, 6)
+        stats["mean_ms"] = round(self.seconds * 1000 / self.calls, 3) if self.calls else None
+        stats["min_ms"] = round(self.min_seconds * 1000, 3) if self.min_seconds is not None else None
+        stats["max_ms"] = round(self.max_seconds * 1000, 3)
+        stats["p50_ms"] = self.percentile_ms(0.5)
+        stats["p95_ms"] = self.percentile_ms(0.95)
+        stats["bytes_in"] = self.bytes_in
+        stats["bytes_out"] = self.bytes_out
+        stats["latency_histogram"] = histogram
+        return stats
+
+
+class Metrics(object):
+    """OperationStats keyed by operation name, safe to record into from many threads."""
+
+    def __init__(self):
+        """Initialize Metrics object."""
+        super(Metrics, self).__init__()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def record(self, operation, seconds, bytes_in=0, bytes_out=0, error=None):
+        """
+        Record one call.
+
+        @param operation name of the operation, e.g. `note_store.findNotesMetadata` or `enscript.exportNotes`
+        @param seconds how long the call took
+        @param bytes_in (optional) bytes received
+        @param bytes_out (optional) bytes sent
+        @param error (optional) name of the error the call failed with
+        """
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = OperationStats()
+            stats.add(seconds, bytes_in, bytes_out, error)
+
+    def __getitem__(self, operation):
+        """Return the OperationStats of an operation."""
+        return self._operations[operation]
+
+    def operations(self):
+        """Return the names of the operations recorded so far."""
+        with self._lock:
+            return sorted(self._operations)
+
+    def as_dict(self):
+        """Return all stats as plain data for json."""
+        with self._lock:
+            operations = OrderedDict((name, self._operations[name].as_dict()) for name in sorted(self._operations))
+        return OrderedDict([("seconds", round(time.time() - self.started, 6)), ("operations", operations)])
+
+    def dump(self, path):
+        """
+        Write the stats as json.
+
+        @param path file to write, `-` for stdout
+        """
+        text = json.dumps(self.as_dict(), indent=2)
+        if path == "-":
+            print(text)
+            return
+        with open(path, "w") as f:
+            f.write(text)
+
+
+@contextlib.contextmanager
+def metrics_scope(metrics=None):
+    """
+    Collect metrics for everything done inside the with block.
+
+    @param metrics (optional) Metrics to record into (default: a new one)
+    @retval Metrics
+    """
+    metrics = metrics or Metrics()
+    with _scopes_lock:
+        _scopes.append(metrics)
+    try:
+        yield metrics
+    finally:
+        with _scopes_lock:
+            _scopes.remove(metrics)
+
+
+def enabled():
+    """Check whether any scope is open."""
+    return bool(_scopes)
+
+
+def record(operation, seconds, bytes_in=0, bytes_out=0, error=None):
+    """Record one call in every open scope, see Metrics.record."""
+    for metrics in list(_scopes):
+        metrics.record(operation, seconds, bytes_in, bytes_out, error)
+
+
+def error_name(error):
+    """Name an exception for the error counts, using the Evernote error code when there is one."""
+    name = type(error).__name__
+    code = getattr(error, "errorCode", None)
+    if code is not None:
+        name += "({0})".format(code)
+    return name
+
+
+def enscript_operation(cmd):
+    """
+    Name the ENScript command of a command line, e.g. `enscript.exportNotes`.
+
+    @param cmd full command line, ENScript.exe followed by /u and /p options and the command
+    """
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg.startswith("/"):
+            next(args, None)
+            continue
+        return "enscript." + arg
+    return "enscript"
+
+
+class _CountingTransport(object):
+    """Wrap a thrift transport, counting the bytes that go through it."""
+
+    def __init__(self, transport):
+        """Wrap transport."""
+        super(_CountingTransport, self).__init__()
+        self._transport = transport
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read(self, size):
+        """Read and count."""
+        data = self._transport.read(size)
+        self.bytes_in += len(data)
+        return data
+
+    def readAll(self, size):
+        """Read exactly size bytes and count them."""
+        data = self._transport.readAll(size)
+        self.bytes_in += len(data)
+        return data
+
+    def write(self, data):
+        """Count and write."""
+        self.bytes_out += len(data)
+        self._transport.write(data)
+
+    def __getattr__(self, name):
+        """Pass everything else to the wrapped transport."""
+        return getattr(self._transport, name)
+
+
+def _count_bytes(store):
+    """Put a _CountingTransport under the thrift client of an Evernote Store, None if it has none."""
+    protocol = getattr(getattr(store, "_client", None), "_iprot", None)
+    if protocol is None or not hasattr(protocol, "trans"):
+        return None
+    if not isinstance(protocol.trans, _CountingTransport):
+        protocol.trans = _CountingTransport(protocol.trans)
+    return protocol.trans
+
+
+class InstrumentedStore(object):
+    """
+    Proxy to a note store or user store that records every method call.
+
+    Calls cost two clock reads extra while no scope is open. Bytes are counted on the thrift
+    transport, so like the store itself a proxy must only be used by one thread at a time.
+    """
+
+    def __init__(self, store, name):
+        """
+        Wrap a store.
+
+        @param store the store, usually an evernote.api.client.Store
+        @param name prefix of the operation names, e.g. `note_store`
+        """
+        super(InstrumentedStore, self).__init__()
+        self._store = store
+        self._name = name
+        self._transport = _count_bytes(store)
+
+    def __getattr__(self, attribute):
+        """Return the store attribute, methods wrapped so their calls are recorded."""
+        target = getattr(self._store, attribute)
+        if not callable(target):
+            return target
+        operation = self._name + "." + attribute
+        transport = self._transport
+
+        def call(*args, **kwargs):
+            if not _scopes:
+                return target(*args, **kwargs)
+            bytes_in, bytes_out = (transport.bytes_in, transport.bytes_out) if transport else (0, 0)
+            error = None
+            start = time.time()
+            try:
+                return target(*args, **kwargs)
+            except Exception as e:
+                error = error_name(e)
+                raise
+            finally:
+                seconds = time.time() - start
+                if transport:
+                    bytes_in, bytes_out = transport.bytes_in - bytes_in, transport.bytes_out - bytes_out
+                else:
+                    bytes_in, bytes_out = 0, 0
+                record(operation, seconds, bytes_in, bytes_out, error)
+
+        return call
+
+
+def print_profile(profiler, path=None, limit=25):
+    """
+    Report a cProfile run.
+
+    @param profiler cProfile.Profile that was run
+    @param path (optional) file to save the raw stats to, for pstats or snakeviz
+    @param limit (optional) how many of the most expensive functions to print to stderr (default:25)
+    """
+    import pstats
+    if path:
+        profiler.dump_stats(path)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(limit)
@@ -0,0 +1,107 @@
+"""Bounded thread pool used to overlap Evernote round trips.
+
+Results always come back in the order the work went in so output stays deterministic.
+"""
+import sys
+import threading
+from collections import deque
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class _Job(object):
+    """A single unit of work handed to a worker thread."""
+
+    __slots__ = ("item", "result", "error", "done")
+
+    def __init__(self, item):
+        """
+        Initialize _Job object.
+
+        @param item the item to pass to the work function
+        """
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self, func):
+        """Run func on the item capturing any exception."""
+        try:
+            self.result = func(self.item)
+        except Exception:
+            self.error = sys.exc_info()[1]
+        self.done.set()
+
+    def wait(self):
+        """
+        Block until the job finished.
+
+        @retval tuple (item, result, error)
+        """
+        # Waiting with a timeout keeps the main thread responsive to Ctrl+C on Python 2.
+        while not self.done.wait(0.5):
+            pass
+        return self.item, self.result, self.error
+
+
+def imap_ordered(func, iterable, workers=4, window=None):
+    """
+    Map func over iterable with a bounded number of worker threads.
+
+    Exceptions raised by func do not stop the run, they are handed back with the item that caused them.
+    At most window items are pulled from iterable ahead of the consumer so memory stays bounded.
+
+    @param func function taking one item
+    @param iterable items to process, consumed lazily
+    @param workers how many threads to run at once (default:4). 1 or less runs inline.
+    @param window how many items may be in flight (default: workers * 2)
+    @retval generator of (item, result, error) tuples in input order
+    """
+    if workers <= 1:
+        for item in iterable:
+            job = _Job(item)
+            job.run(func)
+            yield job.item, job.result, job.error
+        return
+
+    window = max(window or workers * 2, workers)
+    jobs = queue.Queue()
+    cancelled = threading.Event()
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            if cancelled.is_set():
+                job.done.set()
+                continue
+            job.run(func)
+
+    threads = [threading.Thread(target=worker, name="everpy-worker-{0}".format(i)) for i in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    pending = deque()
+    try:
+        for item in iterable:
+            job = _Job(item)
+            jobs.put(job)
+            pending.append(job)
+            if len(pending) >= window:
+                yield pending.popleft().wait()
+        while pending:
+            yield pending.popleft().wait()
+    finally:
+        # Stop workers picking up anything new if the consumer gave up early.
+        if pending:
+            cancelled.set()
+        for _ in threads:
+            jobs.put(None)
+        for t in threads:
+            t.join()
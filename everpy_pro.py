@@ -4,18 +4,79 @@ import re
 import os
 import binascii
 import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
 from mimetypes import MimeTypes
 
 import evernote.edam.type.ttypes as Types
+from evernote.edam.error.ttypes import EDAMErrorCode, EDAMUserException
 from evernote.edam.notestore.ttypes import NoteFilter, NotesMetadataResultSpec
-from evernote.api.client import EvernoteClient
-from bs4 import BeautifulSoup
+from evernote.edam.type.ttypes import NoteSortOrder
+from thrift.Thrift import TType
 
 import everpy_utilities
+from everpy_archive import open_archive
+from everpy_cache import FileHashCache, MetadataCache, MetadataIndex, NoteContentCache, DEFAULT_CONTENT_CACHE_BYTES
+from everpy_enex import EnexNote, EnexResource, EnexWriter, format_enex_date
+from everpy_enml import EnmlBuilder, rewrite_text, extract_text
+from everpy_sync import LocalMirror, mirror_path
+from everpy_templates import Template, iter_rows, load_template, template_tokens
 from everpy_extras import EverPyExtras
+from everpy_metrics import InstrumentedStore
+from everpy_pool import imap_ordered
 
 DEBUG = False
 
+# Largest page the service will return from a single findNotesMetadata call.
+MAX_PAGE_SIZE = 250
+
+# Tags on fewer notes than this are reported as sparse by get_account_stats.
+SPARSE_TAG_NOTES = 3
+
+# How long an update count read for the metadata cache is trusted before getSyncState is asked again, in seconds.
+METADATA_CHECK_SECONDS = 60
+
+# (time read, update count) last read for each account key, shared by every EverPyPro of the process.
+_update_counts = {}
+_update_counts_lock = threading.Lock()
+
+# Error codes the service rejects a token with, for which asking the user for a new token helps.
+AUTH_ERROR_CODES = (EDAMErrorCode.INVALID_AUTH, EDAMErrorCode.AUTH_EXPIRED)
+
+# NoteAttributes and ResourceAttributes fields and the element names ENEX files use for them.
+ENEX_NOTE_ATTRIBUTES = (
+    ("subjectDate", "subject-date"), ("latitude", "latitude"), ("longitude", "longitude"),
+    ("altitude", "altitude"), ("author", "author"), ("source", "source"), ("sourceURL", "source-url"),
+    ("sourceApplication", "source-application"), ("reminderOrder", "reminder-order"),
+    ("reminderTime", "reminder-time"), ("reminderDoneTime", "reminder-done-time"),
+    ("placeName", "place-name"), ("contentClass", "content-class"),
+)
+ENEX_RESOURCE_ATTRIBUTES = (
+    ("sourceURL", "source-url"), ("timestamp", "timestamp"), ("latitude", "latitude"),
+    ("longitude", "longitude"), ("altitude", "altitude"), ("cameraMake", "camera-make"),
+    ("cameraModel", "camera-model"), ("recoType", "reco-type"), ("fileName", "file-name"),
+    ("attachment", "attachment"),
+)
+# Attributes holding timestamps, which ENEX stores formatted rather than in milliseconds.
+ENEX_DATE_ATTRIBUTES = ("subjectDate", "reminderTime", "reminderDoneTime", "timestamp")
+
+
+def enex_attribute_value(field, value):
+    """
+    Format a NoteAttributes or ResourceAttributes value the way ENEX files store it.
+
+    @param field attribute name, e.g. `reminderTime`
+    @param value attribute value from the API
+    @retval formatted date for timestamps, `true` or `false` for booleans, value otherwise
+    """
+    if field in ENEX_DATE_ATTRIBUTES:
+        return format_enex_date(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
 
 def debug(msg):
     """
@@ -27,6 +88,24 @@ def debug(msg):
         print(msg)
 
 
+class ReplaceSummary(object):
+    """Running totals for a find and replace or bulk metadata update job."""
+
+    def __init__(self):
+        """Initialize ReplaceSummary object."""
+        self.scanned = 0
+        self.matched = 0
+        self.updated = 0
+        self.errors = 0
+
+    def __str__(self):
+        """Return a one line summary."""
+        summary = "Scanned {0} notes, {1} matched, {2} updated".format(self.scanned, self.matched, self.updated)
+        if self.errors:
+            summary += ", {0} failed".format(self.errors)
+        return summary
+
+
 class EverPyPro(EverPyExtras):
     """Python helper for evernote.
 
@@ -34,7 +113,8 @@ class EverPyPro(EverPyExtras):
     It requires user allow this application to modify data using OAuth
     """
 
-    def __init__(self, token, path_to_enscript, username=None, password=None):
+    def __init__(self, token, path_to_enscript, username=None, password=None, use_cache=True, cache_dir=None,
+                 content_cache_size=DEFAULT_CONTENT_CACHE_BYTES, backup_engine=None):
         r"""
         Initialize EverPyPro object.
 
@@ -46,38 +126,476 @@ class EverPyPro(EverPyExtras):
                                  usually "C:\Program Files (x86)\Evernote\Evernote\ENScript.exe"
         @param username if not using the default account you'll need to provide a username
         @param password if not using the default account you'll need to provide a password
+        @param use_cache keep downloaded note content, notebooks, tags and searches in local caches (default:True)
+        @param cache_dir folder to keep local caches in (default: ~/.everpy or $EVERPY_HOME).
+                         Accounts can share it, the metadata cache and mirror are kept per account.
+        @param content_cache_size how many bytes of note content to cache (default:256MB)
+        @param backup_engine how backups export notes. `enscript` or `api`.
+                             (default: `enscript` if ENScript.exe exists, `api` otherwise)
         """
         super(EverPyPro, self).__init__(path_to_enscript, username, password)
-        self.client = EvernoteClient(token=token, sandbox=False)
-        self.user_store = self.client.get_user_store()
-        self.note_store = self.client.get_note_store()
+        # The client, stores and notebook map are only created on first use, see the properties below.
+        self.token = token
+        # Names the per account cache files, see everpy_utilities.get_account_key.
+        self.account_key = everpy_utilities.get_account_key(token)
+        self._client = None
+        self._user_store = None
+        self._note_store = None
+        self._note_book_dict = None
+        # Thrift clients are not thread safe so every worker thread gets its own note store.
+        self.note_store_factory = self._new_note_store
+        self._local = threading.local()
 
         self.note_header = "<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'><en-note>"
         self.note_footer = "</en-note>"
 
-        self.note_book_dict = {}
         self.mimer = MimeTypes()
+        self.hash_cache = FileHashCache()
+        self.backup_engine = backup_engine or ("enscript" if os.path.isfile(path_to_enscript) else "api")
+        # How many notes of one notebook the api backup engine downloads at once.
+        self.backup_note_workers = 4
+        self.cache_dir = cache_dir
+        self.mirror = None
+        self.content_cache = None
+        self.metadata_cache = None
+        if use_cache:
+            cache_dir = cache_dir or everpy_utilities.get_everpy_dir()
+            self.content_cache = NoteContentCache(
+                os.path.join(cache_dir, "content_cache-{0}.db".format(self.account_key)), content_cache_size)
+            self.metadata_cache = MetadataCache(
+                os.path.join(cache_dir, "metadata-{0}.json".format(self.account_key)))
+
+    @property
+    def client(self):
+        """EvernoteClient, created on first use."""
+        if self._client is None:
+            from evernote.api.client import EvernoteClient
+            self._client = EvernoteClient(token=self.token, sandbox=False)
+        return self._client
+
+    @property
+    def user_store(self):
+        """User store, created on first use."""
+        if self._user_store is None:
+            self._user_store = InstrumentedStore(self.client.get_user_store(), "user_store")
+        return self._user_store
+
+    @property
+    def note_store(self):
+        """Note store of the thread that first used it, created on first use."""
+        if self._note_store is None:
+            self._note_store = self.note_store_factory()
+            self._local.note_store = self._note_store
+        return self._note_store
+
+    @note_store.setter
+    def note_store(self, note_store):
+        self._note_store = note_store
+        self._local.note_store = note_store
+
+    @property
+    def note_book_dict(self):
+        """Notebooks keyed by name, learnt on first use."""
+        if self._note_book_dict is None:
+            self.learn_notebooks()
+        return self._note_book_dict
+
+    @note_book_dict.setter
+    def note_book_dict(self, notebooks):
+        self._note_book_dict = notebooks
+
+    def _new_note_store(self):
+        """Create a new note store client, its calls are recorded by everpy_metrics."""
+        return InstrumentedStore(self.client.get_note_store(), "note_store")
+
+    @classmethod
+    def connect(cls, path_to_enscript, **kwargs):
+        """
+        Create an EverPyPro with the saved token, asking for a new token if the service rejects it.
+
+        Network and other errors of the check are raised, they are not a reason to replace the token.
+
+        @param path_to_enscript path to ENScript.exe
+        @param kwargs passed on to EverPyPro
+        @retval EverPyPro
+        """
+        my_evernote = cls(everpy_utilities.get_token(), path_to_enscript, **kwargs)
+        if not my_evernote.token_works():
+            my_evernote = cls(everpy_utilities.refresh_token(), path_to_enscript, **kwargs)
+        return my_evernote
+
+    def get_metadata(self, kind, refresh=False):
+        """
+        Get the notebooks, tags or saved searches of the account, from the metadata cache while nothing changed.
+
+        Whether anything changed costs a getSyncState call, at most once every METADATA_CHECK_SECONDS
+        for all EverPyPro objects of the account, see recent_update_count.
+
+        @param kind `notebooks`, `tags` or `searches`
+        @param refresh (optional) fetch the list from the service even if the cache is current (default:False)
+        @retval MetadataIndex of records keyed by name, with by_guid
+        """
+        # Backup and scheduler threads get here too, so use the calling thread's store.
+        note_store = self.thread_note_store()
+        fetch = {
+            "notebooks": note_store.listNotebooks,
+            "tags": note_store.listTags,
+            "searches": note_store.listSearches,
+        }[kind]
+        if self.metadata_cache is None:
+            return MetadataIndex(MetadataCache.RECORDS[kind].from_thrift(item) for item in fetch())
+        update_count = self.get_update_count() if refresh else self.recent_update_count()
+        index = None if refresh else self.metadata_cache.get(kind, update_count)
+        if index is None:
+            debug("Fetching {0}".format(kind))
+            index = self.metadata_cache.put(kind, update_count, fetch())
+        return index
+
+    def learn_notebooks(self, refresh=False):
+        """
+        Build dictionary of notebooks, keyed by name.
+
+        Comes from the metadata cache unless the account changed since it was filled.
+
+        @param refresh (optional) fetch the notebooks from the service even if the cache is current (default:False)
+        """
+        self.note_book_dict = self.get_metadata("notebooks", refresh)
+
+    def thread_note_store(self):
+        """
+        Get a note store that is safe to use from the calling thread.
+
+        @retval the main note store on the thread that first used it, a new one on any other thread
+        """
+        note_store = getattr(self._local, "note_store", None)
+        if note_store is None and self._note_store is None:
+            return self.note_store
+        if note_store is None:
+            note_store = self.note_store_factory()
+            self._local.note_store = note_store
+        return note_store
+
+    def get_note_content(self, note, note_store=None):
+        """
+        Get a note with its content, using the local content cache when the note has not changed.
+
+        @param note NoteMetadata (or Note) of the note. Needs guid, title and updateSequenceNum for the cache to be used.
+        @param note_store (optional) note store to use (default: self.note_store)
+        @retval Note with content. Notes served from the cache only carry guid, title, content and updateSequenceNum.
+        """
+        note_store = note_store or self.note_store
+        usn = getattr(note, "updateSequenceNum", None)
+        if self.content_cache is not None and usn is not None:
+            content = self.content_cache.get(note.guid, usn)
+            if content is not None:
+                debug("Content cache hit for {0}".format(note.guid))
+                return Types.Note(guid=note.guid, title=note.title, content=content, updateSequenceNum=usn)
+        withContent, withResoucesData, withResoucesRecognition, withResoucesAlternateData = (True, False, False, False)
+        full_note = note_store.getNote(note.guid, withContent, withResoucesData, withResoucesRecognition, withResoucesAlternateData)
+        self.cache_note_content(full_note)
+        return full_note
+
+    def cache_note_content(self, note, content=None):
+        """
+        Remember the content of a note in the local content cache.
+
+        @param note Note as returned by getNote, createNote or updateNote
+        @param content (optional) content to store if note does not carry it (updateNote does not return content)
+        """
+        content = content if content is not None else note.content
+        if self.content_cache is not None and content is not None and note.updateSequenceNum is not None:
+            self.content_cache.put(note.guid, note.updateSequenceNum, content, note.contentHash)
+
+    def get_mirror(self):
+        """
+        Get the local mirror of this account, opening it on first use.
+
+        Call sync_database to bring it up to date.
+
+        @retval LocalMirror
+        """
+        if self.mirror is None:
+            cache_dir = self.cache_dir or everpy_utilities.get_everpy_dir()
+            self.mirror = LocalMirror(mirror_path(cache_dir, self.account_key))
+        return self.mirror
+
+    def get_update_count(self):
+        """
+        Get the update count of the account, which changes whenever anything in it changes.
+
+        Costs a single getSyncState call. The count is remembered for recent_update_count.
+
+        @retval update count
+        """
+        update_count = self.thread_note_store().getSyncState().updateCount
+        with _update_counts_lock:
+            _update_counts[self.account_key] = (time.time(), update_count)
+        return update_count
+
+    def recent_update_count(self, max_age=METADATA_CHECK_SECONDS):
+        """
+        Get the update count of the account, reusing one read in this process less than max_age seconds ago.
+
+        Any EverPyPro of the same account may have read it, e.g. the token check of EverPyPro.connect.
+
+        @param max_age (optional) how old a count may be, in seconds (default:METADATA_CHECK_SECONDS)
+        @retval update count
+        """
+        with _update_counts_lock:
+            checked = _update_counts.get(self.account_key)
+        if checked is None or time.time() - checked[0] > max_age:
+            return self.get_update_count()
+        return checked[1]
+
+    def token_works(self):
+        """
+        Check the token with a single getSyncState call.
+
+        The update count it returns is reused by get_metadata, so the check costs no extra call.
+
+        @retval False if the service rejects the token as invalid or expired, True otherwise
+        """
+        try:
+            self.get_update_count()
+        except EDAMUserException as e:
+            if e.errorCode not in AUTH_ERROR_CODES:
+                raise
+            return False
+        return True
+
+    def sync_database(self, log_file=None):
+        """
+        Incrementally sync the local mirror of notes, notebooks, tags and searches with the service.
+
+        Only changes after the last synced update sequence number are downloaded.
+        When nothing changed this costs a single getSyncState call.
+
+        @param log_file (optional) file to append the sync summary to
+        @retval SyncSummary
+        """
+        summary = self.get_mirror().sync(self.thread_note_store())
+        debug(summary)
+        if log_file:
+            with open(log_file, "a") as f:
+                f.write("{0}\n".format(summary))
+        return summary
+
+    def update_search_index(self, workers=4):
+        """
+        Sync the local mirror and bring its full text index up to date.
+
+        Only notes that changed since they were last indexed are downloaded, through the content cache.
+
+        @param workers how many notes to download concurrently (default:4)
+        @retval number of notes (re)indexed
+        """
+        self.sync_database()
+        mirror = self.get_mirror()
+        mirror.prune_index()
+
+        def fetch(row):
+            guid, title, usn = row
+            note = Types.Note(guid=guid, title=title, updateSequenceNum=usn)
+            return extract_text(self.get_note_content(note, self.thread_note_store()).content)
+
+        indexed = 0
+        for (guid, title, usn), text, error in imap_ordered(fetch, mirror.notes_to_index(), workers):
+            if error is not None:
+                # stderr, search -local prints its results as JSON lines on stdout.
+                print("Failed to index note {0}: {1}".format(title, error), file=sys.stderr)
+                continue
+            mirror.index_note(guid, usn, title, text, commit=False)
+            indexed += 1
+            if indexed % 100 == 0:
+                mirror.commit()
+        mirror.commit()
+        return indexed
+
+    def search_local(self, match, limit=50, update=False):
+        """
+        Search notes in the local full text index.
+
+        @param match sqlite full text query over note titles, text and tag names
+        @param limit maximum number of results (default:50)
+        @param update sync and bring the index up to date first, which needs the network (default:False)
+        @retval generator of (guid, title, score) tuples, best match first
+        @throws ValueError when sqlite cannot parse match
+        """
+        if update:
+            self.update_search_index()
+        return self.get_mirror().search(match, limit)
+
+    def get_notebook_change_markers(self, notebooks):
+        """
+        Get a marker per notebook that changes whenever anything in the notebook does.
+
+        Markers come from the local mirror (synced first) and combine the highest note USN, the
+        note count and the notebook's own USN, so edits, moves, deletes and renames all show up.
+
+        @param notebooks list of notebook names
+        @retval dict of notebook name to marker string
+        """
+        self.sync_database()
+        stats = self.get_mirror().notebook_stats()
+        markers = {}
+        for notebook in notebooks:
+            if notebook in stats:
+                markers[notebook] = "{1}-{0}-{2}".format(*stats[notebook])
+        return markers
+
+    def get_backup_notebooks(self):
+        """
+        Get the names of the notebooks a backup should cover.
+
+        @retval list of notebook names
+        """
+        if self.backup_engine != "api":
+            return super(EverPyPro, self).get_backup_notebooks()
         self.learn_notebooks()
+        return sorted(self.note_book_dict)
+
+    def export_query(self, query, export_file):
+        """
+        Export the notes matching a query for a backup, with the configured backup engine.
 
-    def learn_notebooks(self):
+        @param query query to filter the notes
+        @param export_file path of the .enex file to write
+        @retval tuple (exit status, error output)
         """
-        Build dictionary of notebooks.
+        if self.backup_engine != "api":
+            return super(EverPyPro, self).export_query(query, export_file)
+        return self.export_notes_api(export_file, query=query)
 
-        Call this method to re-sync if Evernote database changed.
+    def export_notebook(self, notebook, export_file):
         """
-        notebooks = self.note_store.listNotebooks()
-        for n in notebooks:
-            self.note_book_dict[n.name] = {}
-            for key, val in vars(n).iteritems():
-                self.note_book_dict[n.name][key] = val
+        Export a single notebook for a backup, with the configured backup engine.
+
+        @param notebook name of the notebook
+        @param export_file path of the .enex file to write
+        @retval tuple (exit status, error output)
+        """
+        if self.backup_engine != "api":
+            return super(EverPyPro, self).export_notebook(notebook, export_file)
+        return self.export_notes_api(export_file, notebook_guid=self.note_book_dict[notebook]["guid"])
+
+    def export_notes_api(self, export_file, query="any:", notebook_guid=None, workers=None):
+        """
+        Export notes into an .enex file through the API, no ENScript needed.
+
+        Notes are paged through, downloaded with their attachments a few at a time and written
+        out as soon as they arrive, so memory use depends on workers rather than the notebook size.
+        A note that fails to download is left out and reported, the rest of the export goes on.
+
+        @param export_file path of the .enex file to write, compressed on the fly if it ends in .gz or .xz
+        @param query query to filter the notes (default:'any:')
+        @param notebook_guid (optional) only export notes in this notebook
+        @param workers how many notes to download at once (default: backup_note_workers)
+        @retval tuple (exit status, error output) like an ENScript export
+        """
+        workers = workers or self.backup_note_workers
+        # Backups export several notebooks at once, each on its own thread and note store.
+        note_store = self.thread_note_store()
+        tag_names = dict((tag.guid, tag.name) for tag in note_store.listTags())
+
+        def fetch(note):
+            return self.thread_note_store().getNote(note.guid, True, True, False, False)
+
+        errors = []
+        notes = self.iter_notes_metadata(query, NotesMetadataResultSpec(includeTitle=True), notebook_guid=notebook_guid,
+                                         note_store=note_store)
+        with open_archive(export_file, "wb") as f:
+            with EnexWriter(f) as writer:
+                for meta, note, error in imap_ordered(fetch, notes, workers):
+                    if error is not None:
+                        errors.append("{0}: {1}".format(meta.title, error))
+                        continue
+                    writer.write(self.note_to_enex(note, tag_names))
+        if errors:
+            return 1, "{0} notes failed to export\n{1}".format(len(errors), "\n".join(errors))
+        return 0, ""
+
+    @staticmethod
+    def note_to_enex(note, tag_names=None):
+        """
+        Convert a Note from the API into an EnexNote.
+
+        @param note Note fetched with content (and resource data to include attachments)
+        @param tag_names (optional) dict of tag guid to tag name
+        @retval EnexNote
+        """
+        tags = note.tagNames or [(tag_names or {}).get(guid, guid) for guid in note.tagGuids or []]
+        enex_note = EnexNote(note.title, note.content, note.created, note.updated, tags)
+        for field, name in ENEX_NOTE_ATTRIBUTES:
+            value = getattr(note.attributes, field, None)
+            if value is not None:
+                enex_note.attributes[name] = enex_attribute_value(field, value)
+        for res in note.resources or []:
+            body = res.data.body if res.data else None
+            enex_res = EnexResource(body or b"", res.mime)
+            enex_res.width = res.width
+            enex_res.height = res.height
+            if res.recognition and res.recognition.body:
+                enex_res.recognition = res.recognition.body
+            for field, name in ENEX_RESOURCE_ATTRIBUTES:
+                value = getattr(res.attributes, field, None)
+                if value is not None:
+                    enex_res.attributes[name] = enex_attribute_value(field, value)
+            enex_note.resources.append(enex_res)
+        return enex_note
 
     def get_tags(self):
         """Return list of tags."""
-        return [tag.name for tag in self.note_store.listTags()]
+        return sorted(self.get_metadata("tags"))
 
     def get_searches(self):
-        """Return list of tags."""
-        return [s.name for s in self.note_store.listSearches()]
+        """Return list of saved searches."""
+        return sorted(self.get_metadata("searches"))
+
+    def get_account_stats(self, query="any:", sparse_threshold=SPARSE_TAG_NOTES, untagged=True):
+        """
+        Count notes per notebook and per tag on the server instead of listing them.
+
+        One findNoteCounts call returns the counts per notebook and tag plus the number of notes in
+        the trash. Notebooks and tags come from the metadata cache, so the ones without any notes are
+        found without another round trip. The untagged count costs a second findNoteCounts.
+
+        @param query (optional) only count the notes matching this query (default:'any:')
+        @param sparse_threshold (optional) tags on fewer notes than this are sparse (default:3)
+        @param untagged (optional) count the notes without tags (default:True). The count is None for a query
+                        that starts with any: followed by more terms, which can not be narrowed to untagged notes.
+        @retval OrderedDict with notes, trash, untagged, notebooks and tags (name -> count),
+                empty_notebooks and sparse_tags (name -> count, fewest notes first)
+        """
+        notebooks = self.get_metadata("notebooks")
+        tags = self.get_metadata("tags")
+        counts = self.note_store.findNoteCounts(NoteFilter(words=query), True)
+        notebook_counts = counts.notebookCounts or {}
+        tag_counts = counts.tagCounts or {}
+
+        stats = OrderedDict()
+        stats["notes"] = sum(notebook_counts.values())
+        stats["trash"] = counts.trashCount or 0
+        if untagged:
+            words = query.strip()
+            if words in ("", "any:"):
+                untagged_query = "-tag:*"
+            elif words.startswith("any:"):
+                # any: would make -tag:* just another alternative, there is no query for "untagged and any of".
+                untagged_query = None
+            else:
+                untagged_query = words + " -tag:*"
+            stats["untagged"] = None
+            if untagged_query:
+                untagged_counts = self.note_store.findNoteCounts(NoteFilter(words=untagged_query), False)
+                stats["untagged"] = sum((untagged_counts.notebookCounts or {}).values())
+        stats["notebooks"] = OrderedDict(
+            (name, notebook_counts.get(notebooks[name].guid, 0)) for name in sorted(notebooks))
+        stats["tags"] = OrderedDict((name, tag_counts.get(tags[name].guid, 0)) for name in sorted(tags))
+        stats["empty_notebooks"] = [name for name, count in stats["notebooks"].items() if not count]
+        stats["sparse_tags"] = OrderedDict(sorted(
+            ((name, count) for name, count in stats["tags"].items() if count < sparse_threshold),
+            key=lambda item: (item[1], item[0])))
+        return stats
 
     def test(self):
         """Test function."""
@@ -89,7 +607,110 @@ class EverPyPro(EverPyExtras):
         # out = self.note_store.getSearch("hello")
         # print(out)
 
-    def find_and_replace(self, find_string, replace_string, query="any:", content_only=True):
+    def iter_notes_metadata(self, query="any:", result_spec=None, page_size=MAX_PAGE_SIZE, notebook_guid=None,
+                            note_store=None):
+        """
+        Page through every note matching query.
+
+        Notes are requested page_size at a time so memory stays flat no matter how many notes match.
+        Results are ordered by creation date so notes modified while paging do not move around.
+
+        @param query the query to search for. (default:'any:')
+        @param result_spec NotesMetadataResultSpec of the fields to fetch (default: title only)
+        @param page_size how many notes to request per call (default:250, the service maximum)
+        @param notebook_guid (optional) only notes in this notebook
+        @param note_store (optional) note store to use (default: self.note_store)
+        @retval generator of NoteMetadata objects
+        """
+        note_store = note_store or self.note_store
+        if result_spec is None:
+            result_spec = NotesMetadataResultSpec(includeTitle=True)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        n_filter = NoteFilter(words=query, notebookGuid=notebook_guid, order=NoteSortOrder.CREATED, ascending=True)
+        offset = 0
+        total = None
+        last_page = set()
+        while total is None or offset < total:
+            result_list = note_store.findNotesMetadata(n_filter, offset, page_size, result_spec)
+            if total is not None and result_list.totalNotes < total:
+                # Notes we already handled dropped out of the query, step back so none are skipped.
+                offset = max(0, offset - (total - result_list.totalNotes))
+                result_list = note_store.findNotesMetadata(n_filter, offset, page_size, result_spec)
+            total = result_list.totalNotes
+            debug("Fetched notes {0}-{1} of {2}".format(offset, offset + len(result_list.notes), total))
+            if not result_list.notes:
+                break
+            for note in result_list.notes:
+                if note.guid not in last_page:
+                    yield note
+            last_page = set(note.guid for note in result_list.notes)
+            offset += len(result_list.notes)
+
+    def replace_in_note(self, note, pattern, replace_string, note_store=None):
+        """
+        Run a regex replacement over the text of a single note.
+
+        @param note NoteMetadata (or Note) of the note to modify
+        @param pattern compiled regex to find
+        @param replace_string string to replace
+        @param note_store (optional) note store to use (default: self.note_store)
+        @retval tuple (matched, updated)
+        """
+        note_store = note_store or self.note_store
+        new_note = self.get_note_content(note, note_store)
+        new_content, replacements = rewrite_text(new_note.content, pattern, replace_string)
+        if not replacements:
+            # Nothing was found in this note continue to the next
+            return False, False
+
+        debug("{0} replacements in note {1}".format(replacements, note.title))
+        debug("new content = {0}".format(new_content))
+
+        new_note.content = new_content
+        updated_note = note_store.updateNote(new_note)
+        self.cache_note_content(updated_note, new_content)
+        return True, True
+
+    def iter_find_and_replace(self, find_string, replace_string, query="any:", page_size=MAX_PAGE_SIZE, summary=None,
+                              workers=1):
+        """
+        Find and replace across your notes one note at a time.
+
+        With more than one worker the getNote/updateNote round trips of several notes overlap.
+        Results are still yielded in the order the notes were found.
+
+        @param find_string string to find
+        @param replace_string string to replace
+        @param query the query in which to replace notes. (default:'any:'')
+        @param page_size how many notes to request from the server at a time (default:250)
+        @param summary (optional) ReplaceSummary to keep the running totals in
+        @param workers how many notes to process concurrently (default:1)
+        @retval generator of (note, updated, error) tuples, one for every note scanned
+        """
+        if summary is None:
+            summary = ReplaceSummary()
+        pattern = re.compile(find_string)
+
+        def replace(note):
+            return self.replace_in_note(note, pattern, replace_string, self.thread_note_store())
+
+        result_spec = NotesMetadataResultSpec(includeTitle=True, includeUpdateSequenceNum=True)
+        notes = self.iter_notes_metadata(query, result_spec, page_size)
+        for note, result, error in imap_ordered(replace, notes, workers):
+            summary.scanned += 1
+            if error is not None:
+                summary.errors += 1
+                yield note, False, error
+                continue
+            matched, updated = result
+            if matched:
+                summary.matched += 1
+            if updated:
+                summary.updated += 1
+            yield note, updated, None
+
+    def find_and_replace(self, find_string, replace_string, query="any:", content_only=True, page_size=MAX_PAGE_SIZE,
+                         workers=1):
         """
         Find and replace across your notes.
 
@@ -97,43 +718,142 @@ class EverPyPro(EverPyExtras):
         @param replace_string string to replace
         @param query the query in which to replace notes. (default:'any:'')
         @param content_only Modify only the content of the note not the structure (default:True)
+        @param page_size how many notes to request from the server at a time (default:250)
+        @param workers how many notes to process concurrently (default:1)
+        @retval ReplaceSummary with the number of notes scanned, matched, updated and failed
 
         @todo find a way to modify the structure of the note when content_only is True
         """
-        withContent, withResoucesData, withResoucesRecognition, withResoucesAlternateData = (True, False, False, False)
-        n_filter = NoteFilter(words=query)
-        result_list = self.note_store.findNotesMetadata(n_filter, 0, 10000, NotesMetadataResultSpec(includeTitle=True))
-        if len(result_list.notes) > 249:
-            raise Exception("Too many notes found!")
-        for note in result_list.notes:
-            new_note = self.note_store.getNote(note.guid, withContent, withResoucesData, withResoucesRecognition, withResoucesAlternateData)
-            # Make a soup from the HTML part of the note
-            original_content = re.search(r"<en-note>((.|\n)+)<\/en-note>", new_note.content).group(1)
-            soup = BeautifulSoup(original_content, "html.parser")
-
-            original_matches = soup.findAll(text=re.compile(find_string))
-            if not original_matches:
-                # Nothing was found in this note continue to the next
-                continue
+        summary = ReplaceSummary()
+        for note, updated, error in self.iter_find_and_replace(find_string, replace_string, query, page_size, summary,
+                                                               workers):
+            if error is not None:
+                print("Failed to update note {0}: {1}".format(note.title, error))
+            elif updated:
+                print("Replaced content in note {0}".format(note.title))
+        return summary
+
+    @staticmethod
+    def parse_note_attributes(assignments):
+        """
+        Turn name=value strings into NoteAttributes values of the right type.
+
+        @param assignments iterable of `name=value` strings, an empty value clears the attribute
+        @retval dict of attribute name to value
+        """
+        types = dict((spec[2], spec[1]) for spec in Types.NoteAttributes.thrift_spec if spec)
+        converters = {TType.I64: int, TType.I32: int, TType.DOUBLE: float, TType.STRING: str}
+        attributes = {}
+        for assignment in assignments:
+            name, _, value = assignment.partition("=")
+            name = name.strip()
+            if types.get(name) not in converters:
+                raise ValueError("Can not set note attribute {0}".format(name))
+            attributes[name] = converters[types[name]](value) if value else None
+        return attributes
 
-            print("Replacing content in note {0}".format(note.title))
-            debug("new_note.content = {0}".format(new_note.content))
-            debug("original_matches = {0}".format(original_matches))
+    def _resolve_tags(self, names, create=False):
+        """
+        Look up tag guids by name.
 
-            # Run a regex replacement for each match
-            new_matches = [re.sub(find_string, replace_string, match) for match in original_matches]
+        @param names tag names
+        @param create (optional) create the tags that do not exist yet (default:False)
+        @retval set of guids of the tags that exist
+        """
+        tags = self.get_metadata("tags")
+        missing = [name for name in names if name not in tags]
+        if missing and create:
+            for name in missing:
+                debug("Creating tag {0}".format(name))
+                self.note_store.createTag(Types.Tag(name=name))
+            tags = self.get_metadata("tags", refresh=True)
+        return set(tags[name].guid for name in names if name in tags)
 
-            debug("new_matches = {0}".format(new_matches))
+    def iter_update_metadata(self, query="any:", add_tags=(), remove_tags=(), notebook=None, attributes=None,
+                             page_size=MAX_PAGE_SIZE, summary=None, workers=4):
+        """
+        Change the tags, notebook or attributes of every note matching a query, without touching the content.
 
-            # Get the matches from the soup AGAIN to change it.... :/ ??
-            for i, m in enumerate(soup.findAll(text=re.compile(find_string))):
-                m.replaceWith(new_matches[i])
+        Only the metadata fields the change needs are requested while paging, and notes that need a change
+        get an updateNote with no content or resources, so no note body is ever downloaded or uploaded.
 
-            debug("soup = \r\n{0}".format(str(soup)))
+        @param query the query of the notes to change (default:'any:')
+        @param add_tags (optional) names of tags to add, tags that do not exist are created
+        @param remove_tags (optional) names of tags to remove
+        @param notebook (optional) name of the notebook to move the notes to, created if it does not exist
+        @param attributes (optional) dict of NoteAttributes to set, None clears an attribute
+        @param page_size how many notes to request from the server at a time (default:250)
+        @param summary (optional) ReplaceSummary to keep the running totals in
+        @param workers how many notes to update concurrently (default:4)
+        @retval generator of (note, updated, error) tuples, one for every note scanned
+        """
+        if summary is None:
+            summary = ReplaceSummary()
+        add_guids = self._resolve_tags(add_tags, create=True)
+        remove_guids = self._resolve_tags(remove_tags)
+        notebook_guid = None
+        if notebook:
+            if notebook not in self.note_book_dict:
+                self.create_notebook_pro(notebook)
+            notebook_guid = self.note_book_dict[notebook]["guid"]
+        attributes = attributes or {}
+
+        def update(note):
+            changes = Types.Note(guid=note.guid, title=note.title)
+            changed = False
+            if add_guids or remove_guids:
+                tag_guids = note.tagGuids or []
+                new_guids = [guid for guid in tag_guids if guid not in remove_guids]
+                new_guids += sorted(add_guids.difference(new_guids))
+                if new_guids != tag_guids:
+                    changes.tagGuids = new_guids
+                    changed = True
+            if notebook_guid and note.notebookGuid != notebook_guid:
+                changes.notebookGuid = notebook_guid
+                changed = True
+            if attributes:
+                # updateNote replaces the attributes as a whole, so start from the current ones.
+                note_attributes = note.attributes or Types.NoteAttributes()
+                for name, value in attributes.items():
+                    if getattr(note_attributes, name) != value:
+                        setattr(note_attributes, name, value)
+                        changes.attributes = note_attributes
+                        changed = True
+            if changed:
+                self.thread_note_store().updateNote(changes)
+            return changed
 
-            # Replace the original HTML part of the note with the new soup
-            new_note.content = new_note.content.replace(original_content, str(soup))
-            self.note_store.updateNote(new_note)
+        result_spec = NotesMetadataResultSpec(
+            includeTitle=True,
+            includeTagGuids=bool(add_guids or remove_guids),
+            includeNotebookGuid=bool(notebook_guid),
+            includeAttributes=bool(attributes)
+        )
+        notes = self.iter_notes_metadata(query, result_spec, page_size)
+        for note, updated, error in imap_ordered(update, notes, workers):
+            summary.scanned += 1
+            if error is not None:
+                summary.errors += 1
+                yield note, False, error
+                continue
+            if updated:
+                summary.matched += 1
+                summary.updated += 1
+            yield note, updated, None
+
+    def update_metadata(self, query="any:", add_tags=(), remove_tags=(), notebook=None, attributes=None,
+                        page_size=MAX_PAGE_SIZE, workers=4):
+        """
+        Retag, move or set attributes on every note matching a query, see iter_update_metadata.
+
+        @retval ReplaceSummary with the number of notes scanned, changed and failed
+        """
+        summary = ReplaceSummary()
+        for note, updated, error in self.iter_update_metadata(query, add_tags, remove_tags, notebook, attributes,
+                                                              page_size, summary, workers):
+            if error is not None:
+                print("Failed to update note {0}: {1}".format(note.title, error))
+        return summary
 
     def create_notebook_pro(self, notebook_name):
         """
@@ -147,7 +867,7 @@ class EverPyPro(EverPyExtras):
         n_data.name = notebook_name
         n_book_guid = self.note_store.createNotebook(n_data)
         debug("Created notebook {0} guid = {1}".format(notebook_name, n_book_guid))
-        self.learn_notebooks()  # Need to relearn notebooks now.
+        self.learn_notebooks(refresh=True)  # Need to relearn notebooks now.
 
     def delete_notebook(self, name):
         """
@@ -161,25 +881,32 @@ class EverPyPro(EverPyExtras):
             n_guid = self.note_book_dict[name]["guid"]
         except KeyError:
             print("Couldn't find notebook {0}. Refreshing notebook list...".format(name))
-            self.learn_notebooks()
+            self.learn_notebooks(refresh=True)
             if name in self.note_book_dict.keys():
                 print("Okay found it")
+                n_guid = self.note_book_dict[name]["guid"]
             else:
                 return False
         update_sequence_num = self.note_store.expungeNotebook(n_guid)
+        self.learn_notebooks(refresh=True)
         print("Deleted notebook update_sequence_num = {0}".format(update_sequence_num))
         return True
 
     def get_resource(self, res):
         """Get a resource object to attach to note.
 
+        The whole file is read into the resource, so it is held in memory once until the note is sent.
+        Its md5 comes from hash_cache when the same file (path, size and mtime) was attached before.
+
         @param res resource or attachment to attach.
         """
-        resource_data = open(res, "rb").read()
-        md5 = hashlib.md5()
-        md5.update(resource_data)
-        hash_val = md5.digest()
-        hash_hex = binascii.hexlify(hash_val)
+        key = self.hash_cache.key(res)
+        hash_hex = self.hash_cache.get(key)
+        with open(res, "rb") as f:
+            resource_data = f.read()
+        if hash_hex is None:
+            hash_hex = binascii.hexlify(hashlib.md5(resource_data).digest())
+            self.hash_cache.put(key, hash_hex)
 
         data = Types.Data()
         data.size = len(resource_data)
@@ -200,21 +927,24 @@ class EverPyPro(EverPyExtras):
 
         return resource
 
-    def create_note(self, content, title=None, notebook=None, tags=[], file_attachments=[]):
-        """Create a note and send to server.
+    def build_note(self, content, title=None, notebook=None, tags=[], file_attachments=[]):
+        """Build a note ready to send to the server.
+
+        Attachments are read here, so the note holds their data until it is sent.
 
         @param content
         @param title (optional) specifies note title.
                     If omitted, note title will be generated automatically.
         @param notebook (optional) name of notebook to store note.
                     If omitted, use default notebook.
-                    @todo If does not exist, lazy create.
         @param tags (optional) specify list of tags to tag note with.
                     If tag does not exist, lazy create it.
         @param file_attachments (optional) list of file attachments.
+        @retval Note
+        @throws EnmlError if the note body is not valid ENML
         """
         note = Types.Note()
-        note_body = self.note_header + content
+        note_body = EnmlBuilder(self.note_header, self.note_footer).markup(content)
         if title:
             note.title = title
         else:
@@ -226,17 +956,59 @@ class EverPyPro(EverPyExtras):
         if file_attachments:
             resources = [self.get_resource(a) for a in file_attachments]
             # Add Resource objects to note body
-            note_body += "<br />" * 2
+            note_body.markup("<br />" * 2)
             note.resources = resources
             for resource in resources:
-                note_body += "Attachment with hash {hash}: <br /><en-media type=\"{mime}\" hash=\"{hash}\" /><br />".format(
-                    hash=resource.data.bodyHash,
-                    mime=resource.mime
-                )
+                note_body.markup("Attachment with hash " + resource.data.bodyHash + ": <br />")
+                note_body.media(resource.data.bodyHash, resource.mime).markup("<br />")
+
+        # Invalid ENML fails here rather than after the whole note was uploaded.
+        note.content = note_body.build()
+        return note
+
+    def create_note(self, content, title=None, notebook=None, tags=[], file_attachments=[]):
+        """Create a note and send to server.
+
+        @param content
+        @param title (optional) specifies note title.
+                    If omitted, note title will be generated automatically.
+        @param notebook (optional) name of notebook to store note.
+                    If omitted, use default notebook.
+                    @todo If does not exist, lazy create.
+        @param tags (optional) specify list of tags to tag note with.
+                    If tag does not exist, lazy create it.
+        @param file_attachments (optional) list of file attachments.
+        @retval the created Note
+        """
+        return self.note_store.createNote(self.build_note(content, title, notebook, tags, file_attachments))
+
+    def create_notes(self, notes, workers=4):
+        """Create many notes, sending up to workers at once.
+
+        A note's attachments are only read by the thread sending it, so at most about workers notes
+        worth of attachment data are in memory however many notes there are.
+
+        @param notes iterable of dicts with the create_note arguments (content and optionally title,
+                    notebook, tags and file_attachments), consumed lazily
+        @param workers how many notes to send at once (default:4)
+        @retval generator of (note dict, created Note, error) in the order of notes. A note that is not
+                valid ENML gets an EnmlError and is never sent.
+        """
+        # Learn the notebooks up front, the worker threads must not use the main note store.
+        if not self.note_book_dict:
+            self.learn_notebooks()
 
-        note_body += self.note_footer
-        note.content = note_body
-        self.note_store.createNote(note)
+        def send(item):
+            note = self.build_note(
+                item["content"],
+                title=item.get("title"),
+                notebook=item.get("notebook"),
+                tags=item.get("tags") or [],
+                file_attachments=item.get("file_attachments") or []
+            )
+            return self.thread_note_store().createNote(note)
+
+        return imap_ordered(send, notes, workers, window=workers)
 
     def simple_template(self):
         """Create a simple note template.
@@ -244,7 +1016,7 @@ class EverPyPro(EverPyExtras):
         This is experimental for now.
         It should create a template then open that template for viewing
         """
-        template = open("Templates/simple_sections.txt", "r").read()
+        template = load_template("Templates/simple_sections.txt").text
         i = 1
         note_content = ""
         section_title = raw_input("Section {0} title (q:quit)".format(i))
@@ -255,7 +1027,7 @@ class EverPyPro(EverPyExtras):
         self.create_note(note_content)
 
     def create_template(self, template_file, notebook=None, title=None, tags=[], file_attachments=[]):
-        """Create a simple note template.
+        """Create a note from a template, asking for the token values.
 
         @param notebook (optional) name of notebook to store note.
                     If omitted, use default notebook.
@@ -266,44 +1038,69 @@ class EverPyPro(EverPyExtras):
                     If tag does not exist, lazy create it.
         @param file_attachments (optional) list of file attachments.
         """
-        template = open(template_file, "r").read()
-        template_tokens = self.get_template_tokens(template)
+        template = load_template(template_file)
 
-        new_tokens = []
+        rows = []
         another = ""
         while(another != "q"):
-            # Why do i need to do this strange stuff with the dict to get it working?
-            temp_dict = dict()
-            for token, token_content in template_tokens.iteritems():
-                temp_dict[token] = {}
-                temp_dict[token]["name"] = token_content["name"]
-                temp_dict[token]["val"] = raw_input("{0}: ".format(token_content["name"]))
-            new_tokens.append(temp_dict)
+            values = {}
+            for token, name in template.tokens.items():
+                values[token] = raw_input("{0}: ".format(name or token))
+            rows.append(values)
             another = raw_input("Another (q:quit)")
 
-        content = self.create_content_with_tokens(template, new_tokens)
+        content = "".join(template.render(values) for values in rows)
         self.create_note(content, title=title, notebook=notebook, tags=tags, file_attachments=file_attachments)
 
+    def create_notes_from_template(self, template_file, data_file, per_note=False, notebook=None, title=None,
+                                   tags=[], file_attachments=[], workers=4):
+        """Fill in a template once per row of a data file, without asking anything.
+
+        The template is compiled once and the rows are streamed from the file. Values are escaped,
+        so they show as text in the note.
+
+        @param template_file path to the template file
+        @param data_file .csv file with a header of token ids or names, or a JSON lines file
+                    (see everpy_templates.iter_rows)
+        @param per_note (optional) create a note per row instead of one note with all rows (default:False)
+        @param notebook (optional) name of notebook to store the notes.
+                    If omitted, use default notebook.
+        @param title (optional) note title. With per_note it may use the template's tokens, e.g. "Ticket ${1}".
+        @param tags (optional) specify list of tags to tag the notes with.
+        @param file_attachments (optional) list of file attachments added to every note.
+        @param workers (optional) how many notes to send at once with per_note (default:4)
+        @retval the created Note, or with per_note a generator of (note dict, created Note, error) in row order
+        """
+        template = load_template(template_file)
+        rows = iter_rows(data_file)
+        if not per_note:
+            content = "".join(template.render_row(row) for row in rows)
+            return self.create_note(content, title=title, notebook=notebook, tags=tags,
+                                    file_attachments=file_attachments)
+
+        title_template = Template(title) if title else None
+
+        def notes():
+            for row in rows:
+                values = template.values_for(row)
+                yield {
+                    "content": template.render(values, escape_values=True),
+                    "title": title_template.render(values) if title_template else None,
+                    "notebook": notebook,
+                    "tags": tags,
+                    "file_attachments": file_attachments
+                }
+
+        return self.create_notes(notes(), workers=workers)
+
     def get_template_tokens(self, content):
         """
         Get the tokens from a template file.
 
         @param content the content of the template file
-        @retval a tokenization of the template
-        """
-        regex = r"\$\{(\d+.*?)\}"
-        tokens = {}
-        matches = re.finditer(regex, content)
-        for match_num, match in enumerate(matches):
-            match_num = match_num + 1
-            tok = match.group(1)
-            tok_id, tok_name = None, None
-            if len(tok.split(":", 1)) == 2:
-                tok_id, tok_name = tok.split(":", 1)
-            else:
-                tok_id, tok_name = tok, None
-            if tok_id not in tokens.keys():
-                tokens[tok_id] = {"name": tok_name, "val": None}
+        @retval a tokenization of the template, {token id: {"name": name, "val": None}} in template order
+        """
+        tokens = template_tokens(content)
         debug(tokens)
         return tokens
 
@@ -315,11 +1112,5 @@ class EverPyPro(EverPyExtras):
         @param tokens the full list of tokens
         @retval a string containing the note body of a template
         """
-        content = ""
-        for token in tokens:
-            temp_content = template
-            for key, val in token.iteritems():
-                findval = r"\$\{" + key + r".*?\}"
-                temp_content = re.sub(findval, val["val"], temp_content)
-            content += temp_content
-        return content
+        compiled = Template(template)
+        return "".join(compiled.render(dict((key, val["val"]) for key, val in token.items())) for token in tokens)
@@ -0,0 +1,200 @@
+"""Retention of backup generations.
+
+Every backup gets a name with its timestamp in it and is never renamed afterwards. The
+generations of a backup location are listed in its retention.json, so deciding what to keep
+is one pass over that list instead of scanning the folder.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+GENERATION_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+RETENTION_MANIFEST = "retention.json"
+
+# Scheduled jobs can share a backup location, the manifest is only touched under this lock.
+_manifest_lock = threading.Lock()
+
+
+class RetentionPolicy(object):
+    """
+    Which generations to keep: the newest keep ones plus the newest of each of the last
+    daily days, weekly weeks and monthly months that have a backup (grandfather-father-son).
+    """
+
+    def __init__(self, keep=5, daily=0, weekly=0, monthly=0):
+        """
+        Initialize RetentionPolicy object.
+
+        @param keep (optional) how many of the newest generations to keep (default:5)
+        @param daily (optional) for how many days to keep the newest generation of the day (default:0)
+        @param weekly (optional) for how many weeks to keep the newest generation of the week (default:0)
+        @param monthly (optional) for how many months to keep the newest generation of the month (default:0)
+        """
+        super(RetentionPolicy, self).__init__()
+        self.keep = keep
+        self.daily = daily
+        self.weekly = weekly
+        self.monthly = monthly
+
+    def __repr__(self):
+        """Return a readable representation."""
+        return "RetentionPolicy(keep={0}, daily={1}, weekly={2}, monthly={3})".format(
+            self.keep, self.daily, self.weekly, self.monthly)
+
+    def select(self, timestamps):
+        """
+        Pick the generations to keep.
+
+        @param timestamps datetimes of the generations
+        @retval set of the timestamps to keep
+        """
+        newest_first = sorted(timestamps, reverse=True)
+        kept = set(newest_first[:self.keep])
+        buckets = (
+            (self.daily, lambda ts: ts.date()),
+            (self.weekly, lambda ts: ts.isocalendar()[:2]),
+            (self.monthly, lambda ts: (ts.year, ts.month)),
+        )
+        for count, bucket_of in buckets:
+            seen = set()
+            for ts in newest_first:
+                if len(seen) >= count:
+                    break
+                bucket = bucket_of(ts)
+                if bucket not in seen:
+                    seen.add(bucket)
+                    kept.add(ts)
+        return kept
+
+
+def as_policy(iterations):
+    """
+    Turn a number of backups to keep into a RetentionPolicy.
+
+    @param iterations number of generations to keep or a RetentionPolicy
+    @retval RetentionPolicy
+    """
+    if isinstance(iterations, RetentionPolicy):
+        return iterations
+    return RetentionPolicy(keep=int(iterations))
+
+
+def kept_generations(policy, created):
+    """
+    Pick the generations a policy keeps.
+
+    Generations created within the same second are ordered by name, so each one still counts on its own.
+
+    @param policy RetentionPolicy or number of generations to keep
+    @param created dict of generation name to datetime
+    @retval set of the generation names to keep
+    """
+    unique, previous = {}, None
+    for name in sorted(created, key=lambda item: (created[item], item)):
+        ts = created[name]
+        if previous is not None and ts <= previous:
+            ts = previous + timedelta(microseconds=1)
+        unique[name] = previous = ts
+    kept = as_policy(policy).select(unique.values())
+    return set(name for name, ts in unique.items() if ts in kept)
+
+
+def generation_file_name(file_name, created, serial=0):
+    """
+    Name a generation of a single file backup by putting its timestamp before the .enex extension.
+
+    @param file_name name of the backup, e.g. notes.enex or notes.enex.gz
+    @param created datetime of the generation
+    @param serial (optional) tells apart generations created within the same second
+    @retval e.g. notes.20240131T220000.enex.gz or notes.20240131T220000-1.enex.gz
+    """
+    ts = created.strftime(GENERATION_TIMESTAMP_FORMAT)
+    if serial:
+        ts += "-{0}".format(serial)
+    stem, dot, extension = file_name.partition(".enex")
+    return "{0}.{1}{2}{3}".format(stem, ts, dot, extension)
+
+
+def remove_generation(path):
+    """Delete a generation, a file or a folder."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class GenerationIndex(object):
+    """The generations of every backup series in a folder, kept in its retention.json."""
+
+    def __init__(self, folder):
+        """
+        Initialize GenerationIndex object.
+
+        @param folder backup location
+        """
+        super(GenerationIndex, self).__init__()
+        self.folder = folder
+        self.path = os.path.join(folder, RETENTION_MANIFEST)
+
+    def _load(self):
+        """Read the manifest, {series: {generation name: timestamp}}."""
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f).get("series", {})
+
+    def _save(self, series):
+        """Write the manifest atomically."""
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"series": series}, f, indent=1, sort_keys=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.path + ".tmp", self.path)
+
+    def generations(self, name):
+        """
+        List the generations of a series.
+
+        @param name name of the series
+        @retval list of (datetime, generation name) tuples, oldest first
+        """
+        with _manifest_lock:
+            generations = self._load().get(name, {})
+        return sorted((datetime.strptime(ts, GENERATION_TIMESTAMP_FORMAT), item) for item, ts in generations.items())
+
+    def add(self, name, generation, created):
+        """
+        Record a new generation of a series.
+
+        @param name name of the series
+        @param generation file or folder name of the generation, relative to the backup location
+        @param created datetime of the generation
+        """
+        with _manifest_lock:
+            series = self._load()
+            series.setdefault(name, {})[generation] = created.strftime(GENERATION_TIMESTAMP_FORMAT)
+            self._save(series)
+
+    def prune(self, name, policy, remove=remove_generation):
+        """
+        Delete the generations of a series the policy does not keep.
+
+        @param name name of the series
+        @param policy RetentionPolicy or number of generations to keep
+        @param remove (optional) function deleting a generation given its path
+        @retval list of the generation names removed
+        """
+        with _manifest_lock:
+            series = self._load()
+            generations = series.get(name, {})
+            kept = kept_generations(policy, dict((item, datetime.strptime(ts, GENERATION_TIMESTAMP_FORMAT))
+                                                 for item, ts in generations.items()))
+            dropped = sorted(item for item in generations if item not in kept)
+            for item in dropped:
+                remove(os.path.join(self.folder, item))
+                del generations[item]
+            if dropped:
+                self._save(series)
+        return dropped
@@ -0,0 +1,182 @@
+"""Run ENScript commands with a concurrency limit, per command timeouts and streamed output.
+
+Every command is a separate ENScript process. Its stdout can be read line by line while it
+runs, its stderr is drained on a thread of its own so neither pipe can fill up and stall it.
+"""
+import subprocess
+import threading
+import time
+
+from everpy_metrics import enscript_operation, record
+from everpy_pool import imap_ordered
+
+# How many ENScript processes may run at the same time.
+ENSCRIPT_CONCURRENCY = 2
+
+
+class EnscriptProcess(object):
+    """A running ENScript command."""
+
+    def __init__(self, cmd, timeout=None, release=None):
+        """
+        Start the command.
+
+        @param cmd full command line as a list
+        @param timeout (optional) seconds after which the command is killed
+        @param release (optional) function called once the command finished
+        """
+        super(EnscriptProcess, self).__init__()
+        self.cmd = cmd
+        self.timeout = timeout
+        self.returncode = None
+        self.err = b""
+        self.timed_out = False
+        self.seconds = None
+        # bytes of stdout read so far
+        self.bytes_read = 0
+        self._release = release
+        self._start = time.time()
+        self._err_chunks = []
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._err_thread = threading.Thread(target=self._drain_err)
+        self._err_thread.daemon = True
+        self._err_thread.start()
+        self._timer = None
+        if timeout:
+            self._timer = threading.Timer(timeout, self._kill)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _drain_err(self):
+        """Collect stderr."""
+        self._err_chunks.append(self._process.stderr.read())
+
+    def _kill(self):
+        """Kill the command once its timeout passed."""
+        self.timed_out = True
+        self.kill()
+
+    def kill(self):
+        """Kill the command if it is still running."""
+        try:
+            self._process.kill()
+        except OSError:
+            pass
+
+    @property
+    def finished(self):
+        """Check whether close already collected the exit status."""
+        return self.returncode is not None
+
+    def lines(self):
+        """
+        Yield stdout line by line as the command writes it.
+
+        The command is waited for (or killed, when the caller stops early) at the end.
+        """
+        exhausted = False
+        try:
+            for line in iter(self._process.stdout.readline, b""):
+                self.bytes_read += len(line)
+                yield line.rstrip(b"\r\n")
+            exhausted = True
+        finally:
+            if not exhausted:
+                self.kill()
+            self.close()
+
+    def read(self):
+        """Read all of stdout and wait for the command."""
+        try:
+            out = self._process.stdout.read()
+            self.bytes_read += len(out)
+            return out
+        finally:
+            self.close()
+
+    def close(self):
+        """Wait for the command and collect its exit status and stderr."""
+        if self.finished:
+            return
+        try:
+            self._process.stdout.close()
+            self._process.wait()
+            if self._timer:
+                self._timer.cancel()
+            self._err_thread.join()
+            self.err = b"".join(self._err_chunks)
+            if self.timed_out:
+                self.err += "ENScript timed out after {0}s\n".format(self.timeout).encode("ascii")
+            self.returncode = self._process.returncode
+            self.seconds = time.time() - self._start
+            error = None
+            if self.timed_out:
+                error = "timeout"
+            elif self.returncode:
+                error = "exit {0}".format(self.returncode)
+            record(enscript_operation(self.cmd), self.seconds, bytes_in=self.bytes_read + len(self.err), error=error)
+        finally:
+            if self._release:
+                self._release()
+                self._release = None
+
+
+class EnscriptRunner(object):
+    """Start ENScript commands, at most concurrency at a time."""
+
+    def __init__(self, concurrency=ENSCRIPT_CONCURRENCY, timeout=None):
+        """
+        Initialize EnscriptRunner object.
+
+        @param concurrency (optional) how many commands may run at once (default:2)
+        @param timeout (optional) default seconds after which a command is killed (default: no timeout)
+        """
+        super(EnscriptRunner, self).__init__()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        # seconds the commands of each thread spent waiting for a slot
+        self._local = threading.local()
+
+    def waited_seconds(self):
+        """Return how long the commands started from the calling thread waited for a free slot in total."""
+        return getattr(self._local, "waited", 0.0)
+
+    def start(self, cmd, timeout=None):
+        """
+        Start a command once a slot is free.
+
+        @param cmd full command line as a list
+        @param timeout (optional) seconds after which the command is killed (default: the runner's timeout)
+        @retval EnscriptProcess. Read it with lines() or read() so its slot is given back.
+        """
+        waiting = time.time()
+        self._slots.acquire()
+        self._local.waited = self.waited_seconds() + time.time() - waiting
+        try:
+            return EnscriptProcess(cmd, timeout or self.timeout, self._slots.release)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def run(self, cmd, timeout=None):
+        """
+        Run a command to completion.
+
+        @param cmd full command line as a list
+        @param timeout (optional) seconds after which the command is killed (default: the runner's timeout)
+        @retval tuple with stdout, stderr and the exit status
+        """
+        process = self.start(cmd, timeout)
+        out = process.read()
+        return out, process.err, process.returncode
+
+    def run_many(self, cmds, timeout=None):
+        """
+        Run many commands, concurrency at a time.
+
+        @param cmds iterable of full command lines
+        @param timeout (optional) seconds after which each command is killed (default: the runner's timeout)
+        @retval generator of (cmd, (stdout, stderr, exit status), error) in the order of cmds
+        """
+        return imap_ordered(lambda cmd: self.run(cmd, timeout), cmds, self.concurrency)
@@ -0,0 +1,281 @@
+"""Scheduler that keeps running backup jobs at their interval.
+
+Every job runs in its own thread so a slow export does not hold the others back, and a job
+is never started again while its previous run is still going. When the account did not
+change since a job last ran (same getSyncState updateCount) the run is skipped.
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from everpy import debug
+from everpy_retention import RetentionPolicy
+
+# Longest the scheduler sleeps before looking at the jobs again, in seconds.
+POLL_INTERVAL = 30
+
+
+class BackupJob(object):
+    """A backup to run every interval minutes and what happened the last time it ran."""
+
+    STATS = ("runs", "skipped", "failures", "last_run", "last_status", "last_duration", "last_bytes",
+             "last_error", "update_count")
+
+    def __init__(self, name, destination, interval, query="any:", iterations=5, file_name=None, compress=None):
+        """
+        Initialize BackupJob object.
+
+        @param name name of the job, used in the logs and the state file
+        @param destination folder to write the backup to
+        @param interval how often to back up in minutes
+        @param query (optional) query for the notes to back up (default:'any:')
+        @param iterations (optional) how many backups to keep or a RetentionPolicy (default:5)
+        @param file_name (optional) name of the backup file (default: the job name)
+        @param compress (optional) `gzip` or `xz` to store a compressed file
+        """
+        super(BackupJob, self).__init__()
+        self.name = name
+        self.destination = destination
+        self.interval = interval
+        self.query = query
+        self.iterations = iterations
+        self.file_name = file_name or name
+        self.compress = compress
+        self.next_run = None
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_status = None
+        self.last_duration = None
+        self.last_bytes = None
+        self.last_error = None
+        self.update_count = None
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Create a job from one entry of the scheduler config.
+
+        @param config dict with name, destination and interval and optionally query, iterations,
+                      daily, weekly, monthly, file_name and compress
+        @retval BackupJob
+        """
+        policy = RetentionPolicy(
+            keep=int(config.get("iterations", 5)),
+            daily=int(config.get("daily", 0)),
+            weekly=int(config.get("weekly", 0)),
+            monthly=int(config.get("monthly", 0))
+        )
+        return cls(
+            config["name"],
+            config["destination"],
+            float(config["interval"]),
+            query=config.get("query", "any:"),
+            iterations=policy,
+            file_name=config.get("file_name"),
+            compress=config.get("compress")
+        )
+
+    @property
+    def running(self):
+        """Check whether the job is running right now."""
+        return self.lock.locked()
+
+    def stats(self):
+        """Return the job statistics as a dict."""
+        stats = dict((key, getattr(self, key)) for key in self.STATS)
+        stats["running"] = self.running
+        stats["next_run"] = self.next_run
+        return stats
+
+    def load_stats(self, stats):
+        """Restore statistics saved by a previous scheduler."""
+        for key in self.STATS:
+            if key in stats:
+                setattr(self, key, stats[key])
+
+
+class BackupScheduler(object):
+    """Run backup jobs at their interval until stopped."""
+
+    def __init__(self, everpy, jobs, jitter=60, state_file=None, clock=time.time, wait=None):
+        """
+        Initialize BackupScheduler object.
+
+        @param everpy EverPyExtras (or EverPyPro) object running the backups.
+                      When it has get_update_count unchanged accounts are skipped.
+        @param jobs list of BackupJob
+        @param jitter (optional) up to how many seconds to delay each run so jobs do not start at once (default:60)
+        @param state_file (optional) json file to keep the job statistics in between restarts
+        @param clock (optional) function returning the current time in seconds (default: time.time)
+        @param wait (optional) function(seconds) run_forever sleeps with between looks at the jobs
+                    (default: waiting for stop to be called)
+        """
+        super(BackupScheduler, self).__init__()
+        self.everpy = everpy
+        self.jobs = jobs
+        self.jitter = jitter
+        self.state_file = state_file
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.wait = wait or self.stopped.wait
+        self.threads = []
+        self.state_lock = threading.Lock()
+        if state_file and os.path.isfile(state_file):
+            with open(state_file, "r") as f:
+                state = json.load(f)
+            for job in jobs:
+                job.load_stats(state.get(job.name, {}))
+
+    @classmethod
+    def from_config(cls, everpy, config_file):
+        """
+        Create a scheduler from a json config.
+
+        The config looks like {"jitter": 60, "state_file": "...", "jobs": [{"name": ..., "destination": ...,
+        "interval": ..., "query": ..., "iterations": ..., "daily": ..., "weekly": ..., "monthly": ...,
+        "file_name": ..., "compress": ...}]}
+
+        @param everpy EverPyExtras object running the backups
+        @param config_file path of the json config
+        @retval BackupScheduler
+        """
+        with open(config_file, "r") as f:
+            config = json.load(f)
+        jobs = [BackupJob.from_dict(job) for job in config["jobs"]]
+        return cls(everpy, jobs, jitter=config.get("jitter", 60), state_file=config.get("state_file"))
+
+    def schedule(self, job, now=None):
+        """Set when a job runs next: an interval after now plus some jitter."""
+        now = now or self.clock()
+        job.next_run = now + job.interval * 60 + random.uniform(0, self.jitter)
+
+    def account_changed(self, job):
+        """
+        Check whether anything changed in the account since the job last ran.
+
+        @param job BackupJob
+        @retval tuple (changed, current update count or None when it can not be asked for)
+        """
+        get_update_count = getattr(self.everpy, "get_update_count", None)
+        if get_update_count is None:
+            return True, None
+        try:
+            update_count = get_update_count()
+        except Exception as e:
+            debug("Could not get the sync state: {0}".format(e))
+            return True, None
+        return job.update_count is None or update_count != job.update_count, update_count
+
+    def run_job(self, job):
+        """
+        Run a job once unless it is already running or nothing changed since its last run.
+
+        @param job BackupJob
+        @retval `ok`, `failed`, `skipped` or `running`
+        """
+        if not job.lock.acquire(False):
+            debug("{0} is still running".format(job.name))
+            return "running"
+        try:
+            changed, update_count = self.account_changed(job)
+            if not changed:
+                job.skipped += 1
+                job.last_status = "skipped"
+                return job.last_status
+            start = self.clock()
+            job.last_error = None
+            try:
+                returncode, err, backup_file = self.everpy.backup_query(
+                    job.query, job.destination, job.file_name, job.iterations, compress=job.compress
+                )
+                if returncode != 0:
+                    job.last_error = err or "exit status {0}".format(returncode)
+                job.last_bytes = os.path.getsize(backup_file) if os.path.isfile(backup_file) else 0
+            except Exception as e:
+                job.last_error = str(e)
+                job.last_bytes = 0
+            job.runs += 1
+            job.last_run = datetime.now().isoformat()
+            job.last_duration = self.clock() - start
+            if job.last_error:
+                job.failures += 1
+                job.last_status = "failed"
+            else:
+                job.last_status = "ok"
+                job.update_count = update_count
+            print("Backup {0} {1} in {2:.1f}s, {3} bytes".format(
+                job.name, job.last_status, job.last_duration, job.last_bytes))
+            return job.last_status
+        finally:
+            job.lock.release()
+            self.save_state()
+
+    def save_state(self):
+        """Write the job statistics to the state file, if there is one."""
+        if not self.state_file:
+            return
+        with self.state_lock:
+            state = dict((job.name, job.stats()) for job in self.jobs)
+            with open(self.state_file + ".tmp", "w") as f:
+                json.dump(state, f, indent=1, sort_keys=True)
+            if os.path.exists(self.state_file):
+                os.remove(self.state_file)
+            os.rename(self.state_file + ".tmp", self.state_file)
+
+    def stats(self):
+        """Return the statistics of every job keyed by job name."""
+        return dict((job.name, job.stats()) for job in self.jobs)
+
+    def run_pending(self, now=None):
+        """
+        Start every job that is due in a thread of its own.
+
+        @retval list of the jobs started
+        """
+        now = now or self.clock()
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        started = []
+        for job in self.jobs:
+            if job.next_run is None or job.next_run > now or job.running:
+                continue
+            self.schedule(job, now)
+            thread = threading.Thread(target=self.run_job, args=(job,), name="backup-" + job.name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+            started.append(job)
+        return started
+
+    def run_once(self):
+        """Run every job now, one after the other, and return their statuses keyed by job name."""
+        return dict((job.name, self.run_job(job)) for job in self.jobs)
+
+    def run_forever(self):
+        """
+        Run the jobs at their intervals until stop is called or the process is interrupted.
+
+        The first run of every job only waits for its jitter.
+        """
+        now = self.clock()
+        for job in self.jobs:
+            job.next_run = now + random.uniform(0, self.jitter)
+        try:
+            while not self.stopped.is_set():
+                self.run_pending()
+                next_run = min(job.next_run for job in self.jobs) if self.jobs else self.clock() + POLL_INTERVAL
+                self.wait(max(0.1, min(POLL_INTERVAL, next_run - self.clock())))
+        finally:
+            self.stop()
+
+    def stop(self, timeout=None):
+        """Stop scheduling and wait for the running jobs to finish."""
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
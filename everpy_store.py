@@ -0,0 +1,267 @@
+"""Content addressed backup store.
+
+Notes and attachments are stored once as objects named by their md5, the same hash
+`EverPyPro.get_resource` computes and en-media tags refer to. A snapshot is a small manifest
+listing the notes of every notebook, so an attachment that did not change between backups
+costs nothing in the next one.
+
+Layout:
+    objects/ab/ab01...ef    note (json) and attachment (raw bytes) objects
+    snapshots/<YYYYMMDDTHHMMSS>.json    one manifest per snapshot, <YYYYMMDDTHHMMSS>-1.json for a second
+                                        snapshot within the same second
+"""
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from everpy_enex import EnexNote, EnexResource, EnexWriter, iter_enex
+from everpy_retention import kept_generations
+
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def md5_hex(data):
+    """Return the hex md5 of some bytes."""
+    return binascii.hexlify(hashlib.md5(data).digest()).decode("ascii")
+
+
+class BackupStore(object):
+    """Deduplicated store of backup snapshots."""
+
+    def __init__(self, root):
+        """
+        Initialize BackupStore object.
+
+        @param root folder of the store. Created if it does not exist.
+        """
+        super(BackupStore, self).__init__()
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        for folder in (self.objects_dir, self.snapshots_dir):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+    def object_path(self, object_id):
+        """Return the path an object is stored at."""
+        return os.path.join(self.objects_dir, object_id[:2], object_id)
+
+    def has_object(self, object_id):
+        """Check whether an object is in the store."""
+        return os.path.isfile(self.object_path(object_id))
+
+    def put_object(self, data, object_id=None):
+        """
+        Store some bytes unless an object with the same hash already exists.
+
+        @param data bytes to store
+        @param object_id (optional) md5 of data if already known
+        @retval the object id (hex md5 of data)
+        """
+        object_id = object_id or md5_hex(data)
+        path = self.object_path(object_id)
+        if os.path.isfile(path):
+            return object_id
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        return object_id
+
+    def put_object_file(self, path, object_id):
+        """
+        Move a file into the store unless an object with the same hash already exists.
+
+        The file is consumed either way.
+
+        @param path file to store, on the same file system as the store
+        @param object_id md5 of the file contents
+        @retval the object id
+        """
+        dest = self.object_path(object_id)
+        if os.path.isfile(dest):
+            os.remove(path)
+            return object_id
+        folder = os.path.dirname(dest)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        shutil.move(path, dest)
+        return object_id
+
+    def get_object(self, object_id):
+        """Read an object back."""
+        with open(self.object_path(object_id), "rb") as f:
+            return f.read()
+
+    def put_note(self, note):
+        """
+        Store a note and its attachments.
+
+        @param note EnexNote
+        @retval object id of the note
+        """
+        resources = []
+        for resource in note.resources:
+            if resource.data_path:
+                object_id = self.put_object_file(resource.data_path, resource.hash)
+                resource.data_path = self.object_path(object_id)
+            else:
+                object_id = self.put_object(resource.data or b"", resource.hash)
+            resources.append({
+                "object": object_id,
+                "mime": resource.mime,
+                "width": resource.width,
+                "height": resource.height,
+                "recognition": resource.recognition,
+                "attributes": list(resource.attributes.items()),
+            })
+        record = {
+            "title": note.title,
+            "content": note.content,
+            "created": note.created,
+            "updated": note.updated,
+            "tags": note.tags,
+            "attributes": list(note.attributes.items()),
+            "resources": resources,
+        }
+        return self.put_object(json.dumps(record, sort_keys=True).encode("utf-8"))
+
+    def get_note(self, object_id):
+        """
+        Rebuild a note from the store.
+
+        @param object_id object id of the note
+        @retval EnexNote whose attachments point at their objects (data_path)
+        """
+        record = json.loads(self.get_object(object_id).decode("utf-8"))
+        note = EnexNote(record["title"], record["content"], record["created"], record["updated"], record["tags"])
+        note.attributes.update(record["attributes"])
+        for item in record["resources"]:
+            resource = EnexResource(None, item["mime"], item["attributes"], self.object_path(item["object"]))
+            resource.width = item["width"]
+            resource.height = item["height"]
+            resource.recognition = item["recognition"]
+            note.resources.append(resource)
+        return note
+
+    def add_enex(self, enex_file):
+        """
+        Store every note of an ENEX file.
+
+        Attachments are decoded straight into the store so memory use does not depend on their size.
+
+        @param enex_file path of the .enex file
+        @retval list of note object ids in file order
+        """
+        staging = tempfile.mkdtemp(prefix="ingest", dir=self.root)
+        try:
+            return [self.put_note(note) for note in iter_enex(enex_file, data_dir=staging)]
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def write_snapshot(self, notebooks, created=None, extra=None):
+        """
+        Record a snapshot. An existing snapshot is never overwritten.
+
+        @param notebooks dict of notebook name to list of note object ids
+        @param created (optional) datetime of the snapshot (default: now)
+        @param extra (optional) dict of additional information to keep in the manifest
+        @retval snapshot name
+        """
+        created = created or datetime.now()
+        ts = name = created.strftime(SNAPSHOT_NAME_FORMAT)
+        serial = 0
+        while os.path.exists(os.path.join(self.snapshots_dir, name + ".json")):
+            serial += 1
+            name = "{0}-{1}".format(ts, serial)
+        manifest = dict(extra or {})
+        manifest["created"] = name
+        manifest["notebooks"] = notebooks
+        path = os.path.join(self.snapshots_dir, name + ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.rename(path + ".tmp", path)
+        return name
+
+    def snapshots(self):
+        """Return the snapshot names, oldest first."""
+        return sorted(item[:-len(".json")] for item in os.listdir(self.snapshots_dir) if item.endswith(".json"))
+
+    def read_snapshot(self, name):
+        """Return the manifest of a snapshot."""
+        with open(os.path.join(self.snapshots_dir, name + ".json"), "r") as f:
+            return json.load(f)
+
+    def latest_snapshot(self):
+        """Return the manifest of the newest snapshot or an empty dict."""
+        snapshots = self.snapshots()
+        return self.read_snapshot(snapshots[-1]) if snapshots else {}
+
+    def restore(self, name, dest_folder):
+        """
+        Rebuild the .enex files of a snapshot.
+
+        @param name snapshot name
+        @param dest_folder folder to write one .enex file per notebook to
+        @retval list of files written
+        """
+        if not os.path.isdir(dest_folder):
+            os.makedirs(dest_folder)
+        written = []
+        for notebook, entry in sorted(self.read_snapshot(name)["notebooks"].items()):
+            path = os.path.join(dest_folder, notebook + ".enex")
+            with open(path, "wb") as f:
+                with EnexWriter(f) as writer:
+                    for object_id in entry["notes"]:
+                        writer.write(self.get_note(object_id))
+            written.append(path)
+        return written
+
+    def delete_snapshot(self, name):
+        """Forget a snapshot. Its objects stay until gc runs."""
+        os.remove(os.path.join(self.snapshots_dir, name + ".json"))
+
+    def prune(self, keep):
+        """
+        Drop the snapshots a retention policy does not keep and collect the objects nothing refers to any more.
+
+        @param keep how many of the newest snapshots to keep or a RetentionPolicy
+        @retval tuple (snapshots dropped, objects removed)
+        """
+        created = dict((name, datetime.strptime(name.split("-")[0], SNAPSHOT_NAME_FORMAT)) for name in self.snapshots())
+        kept = kept_generations(keep, created)
+        dropped = sorted(name for name in created if name not in kept)
+        for name in dropped:
+            self.delete_snapshot(name)
+        return dropped, self.gc() if dropped else 0
+
+    def gc(self):
+        """
+        Remove objects no snapshot refers to.
+
+        @retval number of objects removed
+        """
+        live = set()
+        for name in self.snapshots():
+            for entry in self.read_snapshot(name)["notebooks"].values():
+                for object_id in entry["notes"]:
+                    if object_id in live:
+                        continue
+                    live.add(object_id)
+                    record = json.loads(self.get_object(object_id).decode("utf-8"))
+                    live.update(item["object"] for item in record["resources"])
+        removed = 0
+        for shard in os.listdir(self.objects_dir):
+            shard_dir = os.path.join(self.objects_dir, shard)
+            for object_id in os.listdir(shard_dir):
+                if object_id not in live:
+                    os.remove(os.path.join(shard_dir, object_id))
+                    removed += 1
+        return removed
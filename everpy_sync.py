@@ -0,0 +1,346 @@
+"""Incremental local mirror of an Evernote account.
+
+The mirror keeps note metadata, notebooks, tags and saved searches in sqlite and is brought up
+to date with sync chunks, so full text search and backup planning can be answered without a
+round trip per note.
+"""
+import os
+import sqlite3
+import threading
+
+from evernote.edam.notestore.ttypes import SyncChunkFilter
+
+# How many objects to request per getFilteredSyncChunk call.
+SYNC_CHUNK_SIZE = 250
+
+# File name of the mirror of one account in the cache folder, see everpy_utilities.get_account_key.
+MIRROR_FILE_FORMAT = "mirror-{0}.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS notebooks (guid TEXT PRIMARY KEY, name TEXT, stack TEXT, usn INTEGER);
+CREATE TABLE IF NOT EXISTS tags (guid TEXT PRIMARY KEY, name TEXT, parent_guid TEXT, usn INTEGER);
+CREATE TABLE IF NOT EXISTS searches (guid TEXT PRIMARY KEY, name TEXT, query TEXT, usn INTEGER);
+CREATE TABLE IF NOT EXISTS notes (
+    guid TEXT PRIMARY KEY, title TEXT, notebook_guid TEXT, created INTEGER, updated INTEGER, deleted INTEGER,
+    active INTEGER, usn INTEGER, content_length INTEGER, content_hash BLOB
+);
+CREATE INDEX IF NOT EXISTS notes_notebook ON notes (notebook_guid);
+CREATE TABLE IF NOT EXISTS note_tags (note_guid TEXT, tag_guid TEXT, PRIMARY KEY (note_guid, tag_guid));
+CREATE INDEX IF NOT EXISTS note_tags_tag ON note_tags (tag_guid);
+CREATE TABLE IF NOT EXISTS note_index (id INTEGER PRIMARY KEY, guid TEXT UNIQUE, usn INTEGER);
+"""
+
+# Full text index over note titles, text and tag names. Rows share their rowid with note_index.id.
+# FTS5 gives bm25 ranking, older sqlite builds fall back to FTS4 without ranking.
+FTS_SCHEMAS = (
+    ("fts5", "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5 (title, body, tags)"),
+    ("fts4", "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts4 (title, body, tags)"),
+)
+
+
+def mirror_path(cache_dir, account_key):
+    """Return the path of the mirror of an account."""
+    return os.path.join(cache_dir, MIRROR_FILE_FORMAT.format(account_key))
+
+
+def find_mirror(cache_dir, account_key=None):
+    """
+    Find the mirror to use without the Evernote API.
+
+    @param cache_dir cache folder
+    @param account_key (optional) account whose mirror to use. Without it the only mirror in cache_dir is used.
+    @retval path of the mirror, None if there is none or several to choose from
+    """
+    if account_key is not None:
+        path = mirror_path(cache_dir, account_key)
+        return path if os.path.isfile(path) else None
+    prefix, suffix = MIRROR_FILE_FORMAT.split("{0}")
+    names = [name for name in os.listdir(cache_dir) if name.startswith(prefix) and name.endswith(suffix)]
+    return os.path.join(cache_dir, names[0]) if len(names) == 1 else None
+
+
+class SyncSummary(object):
+    """What a call to LocalMirror.sync changed."""
+
+    def __init__(self):
+        """Initialize SyncSummary object."""
+        self.full = False
+        self.chunks = 0
+        self.updated = 0
+        self.expunged = 0
+        self.update_count = 0
+
+    def __str__(self):
+        """Return a one line summary."""
+        if not self.chunks:
+            return "Already up to date (update count {0})".format(self.update_count)
+        return "{0} sync: {1} chunks, {2} objects updated, {3} expunged (update count {4})".format(
+            "Full" if self.full else "Incremental", self.chunks, self.updated, self.expunged, self.update_count)
+
+
+class LocalMirror(object):
+    """Sqlite mirror of the metadata in an Evernote account."""
+
+    def __init__(self, path):
+        """
+        Initialize LocalMirror object.
+
+        @param path path of the sqlite database. Created if it does not exist.
+        """
+        super(LocalMirror, self).__init__()
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.executescript(SCHEMA)
+        self.fts = None
+        for fts, schema in FTS_SCHEMAS:
+            try:
+                self._db.execute(schema)
+            except sqlite3.OperationalError:
+                continue
+            self.fts = fts
+            break
+        self._db.commit()
+
+    def _get_state(self, key, default=0):
+        """Read a value from the state table."""
+        row = self._db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_state(self, key, value):
+        """Write a value to the state table."""
+        self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def last_usn(self):
+        """Return the highest USN that has been applied to the mirror."""
+        with self._lock:
+            return self._get_state("last_usn")
+
+    @property
+    def last_sync_time(self):
+        """Return the service time of the last successful sync in milliseconds."""
+        with self._lock:
+            return self._get_state("last_sync_time")
+
+    def reset(self):
+        """Forget everything so the next sync is a full one."""
+        with self._lock:
+            for table in ("state", "notebooks", "tags", "searches", "notes", "note_tags", "note_index"):
+                self._db.execute("DELETE FROM {0}".format(table))
+            if self.fts:
+                self._db.execute("DELETE FROM note_fts")
+            self._db.commit()
+
+    def apply_chunk(self, chunk):
+        """
+        Write a sync chunk into the mirror.
+
+        @param chunk SyncChunk from getFilteredSyncChunk
+        @retval tuple (objects updated, objects expunged)
+        """
+        updated, expunged = 0, 0
+        with self._lock:
+            db = self._db
+            for n in chunk.notebooks or []:
+                db.execute("INSERT OR REPLACE INTO notebooks (guid, name, stack, usn) VALUES (?, ?, ?, ?)",
+                           (n.guid, n.name, n.stack, n.updateSequenceNum))
+                updated += 1
+            for t in chunk.tags or []:
+                db.execute("INSERT OR REPLACE INTO tags (guid, name, parent_guid, usn) VALUES (?, ?, ?, ?)",
+                           (t.guid, t.name, t.parentGuid, t.updateSequenceNum))
+                updated += 1
+            for s in chunk.searches or []:
+                db.execute("INSERT OR REPLACE INTO searches (guid, name, query, usn) VALUES (?, ?, ?, ?)",
+                           (s.guid, s.name, s.query, s.updateSequenceNum))
+                updated += 1
+            for n in chunk.notes or []:
+                db.execute(
+                    "INSERT OR REPLACE INTO notes (guid, title, notebook_guid, created, updated, deleted, active, usn, "
+                    "content_length, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (n.guid, n.title, n.notebookGuid, n.created, n.updated, n.deleted,
+                     1 if n.active is None else int(n.active), n.updateSequenceNum, n.contentLength,
+                     n.contentHash and sqlite3.Binary(n.contentHash))
+                )
+                db.execute("DELETE FROM note_tags WHERE note_guid = ?", (n.guid,))
+                db.executemany("INSERT INTO note_tags (note_guid, tag_guid) VALUES (?, ?)",
+                               [(n.guid, t) for t in n.tagGuids or []])
+                updated += 1
+            for guid in chunk.expungedNotes or []:
+                db.execute("DELETE FROM notes WHERE guid = ?", (guid,))
+                db.execute("DELETE FROM note_tags WHERE note_guid = ?", (guid,))
+                expunged += 1
+            for guid in chunk.expungedNotebooks or []:
+                db.execute("DELETE FROM notebooks WHERE guid = ?", (guid,))
+                expunged += 1
+            for guid in chunk.expungedTags or []:
+                db.execute("DELETE FROM tags WHERE guid = ?", (guid,))
+                db.execute("DELETE FROM note_tags WHERE tag_guid = ?", (guid,))
+                expunged += 1
+            for guid in chunk.expungedSearches or []:
+                db.execute("DELETE FROM searches WHERE guid = ?", (guid,))
+                expunged += 1
+            if chunk.chunkHighUSN is not None:
+                self._set_state("last_usn", chunk.chunkHighUSN)
+            db.commit()
+        return updated, expunged
+
+    def sync(self, note_store, chunk_size=SYNC_CHUNK_SIZE):
+        """
+        Bring the mirror up to date with the service.
+
+        When nothing changed since the last run this costs a single getSyncState call.
+        Progress is committed after every chunk so an interrupted sync resumes where it stopped.
+
+        @param note_store note store to sync from
+        @param chunk_size how many objects to request per chunk (default:250)
+        @retval SyncSummary
+        """
+        summary = SyncSummary()
+        state = note_store.getSyncState()
+        summary.update_count = state.updateCount
+        after_usn = self.last_usn
+        if after_usn and state.fullSyncBefore > self.last_sync_time:
+            # The service can no longer replay everything we missed.
+            self.reset()
+            after_usn = 0
+        summary.full = after_usn == 0
+
+        sync_filter = SyncChunkFilter(includeNotes=True, includeNotebooks=True, includeTags=True,
+                                      includeSearches=True, includeExpunged=not summary.full)
+        while after_usn < state.updateCount:
+            chunk = note_store.getFilteredSyncChunk(after_usn, chunk_size, sync_filter)
+            summary.chunks += 1
+            updated, expunged = self.apply_chunk(chunk)
+            summary.updated += updated
+            summary.expunged += expunged
+            if chunk.chunkHighUSN is None or chunk.chunkHighUSN >= chunk.updateCount:
+                break
+            after_usn = chunk.chunkHighUSN
+
+        with self._lock:
+            self._set_state("last_usn", max(self._get_state("last_usn"), state.updateCount))
+            self._set_state("last_sync_time", state.currentTime)
+            self._db.commit()
+        return summary
+
+    def notebooks(self):
+        """Return list of (guid, name, stack) for every notebook."""
+        with self._lock:
+            return self._db.execute("SELECT guid, name, stack FROM notebooks ORDER BY name").fetchall()
+
+    def notebook_stats(self):
+        """
+        Per notebook note count and highest note USN, useful for planning backups.
+
+        @retval dict of notebook name to (note count, max note USN, notebook USN)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT notebooks.name, COUNT(notes.guid), COALESCE(MAX(notes.usn), 0), notebooks.usn FROM notebooks "
+                "LEFT JOIN notes ON notes.notebook_guid = notebooks.guid AND notes.active = 1 GROUP BY notebooks.guid"
+            ).fetchall()
+        return dict((name, (count, max_usn, usn)) for name, count, max_usn, usn in rows)
+
+    def notes_to_index(self):
+        """
+        Find the notes whose text is missing from or out of date in the full text index.
+
+        @retval list of (guid, title, usn) tuples
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT notes.guid, notes.title, notes.usn FROM notes LEFT JOIN note_index ON note_index.guid = notes.guid "
+                "WHERE notes.active = 1 AND (note_index.usn IS NULL OR note_index.usn < notes.usn) ORDER BY notes.created"
+            ).fetchall()
+
+    def tag_names(self, note_guid):
+        """Return the names of the tags on a note."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT tags.name FROM note_tags JOIN tags ON tags.guid = note_tags.tag_guid WHERE note_tags.note_guid = ?",
+                (note_guid,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def index_note(self, guid, usn, title, text, commit=True):
+        """
+        Add or refresh a note in the full text index.
+
+        @param guid guid of the note
+        @param usn updateSequenceNum of the indexed version
+        @param title note title
+        @param text note text with the markup stripped
+        @param commit commit straight away (default:True)
+        """
+        tags = " ".join(self.tag_names(guid))
+        with self._lock:
+            row = self._db.execute("SELECT id FROM note_index WHERE guid = ?", (guid,)).fetchone()
+            if row is None:
+                row_id = self._db.execute("INSERT INTO note_index (guid, usn) VALUES (?, ?)", (guid, usn)).lastrowid
+            else:
+                row_id = row[0]
+                self._db.execute("UPDATE note_index SET usn = ? WHERE id = ?", (usn, row_id))
+                self._db.execute("DELETE FROM note_fts WHERE rowid = ?", (row_id,))
+            self._db.execute("INSERT INTO note_fts (rowid, title, body, tags) VALUES (?, ?, ?, ?)",
+                             (row_id, title or "", text or "", tags))
+            if commit:
+                self._db.commit()
+
+    def prune_index(self):
+        """
+        Drop notes that were deleted or moved to the trash from the full text index.
+
+        @retval number of notes dropped
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT note_index.id FROM note_index LEFT JOIN notes ON notes.guid = note_index.guid "
+                "WHERE notes.guid IS NULL OR notes.active = 0"
+            ).fetchall()
+            for (row_id,) in rows:
+                self._db.execute("DELETE FROM note_fts WHERE rowid = ?", (row_id,))
+                self._db.execute("DELETE FROM note_index WHERE id = ?", (row_id,))
+            self._db.commit()
+        return len(rows)
+
+    def commit(self):
+        """Commit pending writes."""
+        with self._lock:
+            self._db.commit()
+
+    def search(self, match, limit=50):
+        """
+        Search the full text index.
+
+        @param match sqlite full text query, for example `lease AND "fake st"` or `title:invoice`
+        @param limit maximum number of rows to return (default:50)
+        @retval generator of (guid, title, score) tuples, best match first. score is None without FTS5.
+        @throws ValueError when sqlite cannot parse match
+        """
+        if self.fts == "fts5":
+            # Title hits weigh most, then tags, then body text. bm25 is lower for better matches.
+            sql = ("SELECT note_index.guid, note_fts.title, -bm25(note_fts, 10.0, 1.0, 5.0) AS score FROM note_fts "
+                   "JOIN note_index ON note_index.id = note_fts.rowid WHERE note_fts MATCH ? ORDER BY score DESC LIMIT ?")
+        elif self.fts == "fts4":
+            sql = ("SELECT note_index.guid, note_fts.title, NULL FROM note_fts "
+                   "JOIN note_index ON note_index.id = note_fts.rowid WHERE note_fts MATCH ? LIMIT ?")
+        else:
+            raise RuntimeError("This sqlite build has no full text search support")
+        with self._lock:
+            try:
+                rows = self._db.execute(sql, (match, limit)).fetchall()
+            except sqlite3.OperationalError as e:
+                raise ValueError("Invalid full text query {0!r}: {1}".format(match, e))
+        for row in rows:
+            yield row
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
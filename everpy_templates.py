@@ -0,0 +1,213 @@
+"""Everpy note templates.
+
+A template is ENML with tokens like ${1:Card title}: a numeric id and an optional name.
+Templates are compiled once into literal text and token slots, so rendering a row is a
+single join however many tokens the template has.
+"""
+import csv
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from everpy_enml import escape
+
+TOKEN_RE = re.compile(r"\$\{(\d+.*?)\}")
+
+# How many compiled templates load_template remembers.
+DEFAULT_TEMPLATE_CACHE_ENTRIES = 64
+
+
+def _native(value):
+    """Turn a value read from csv or json into the str templates are made of."""
+    if isinstance(value, type(u"")):
+        return value.encode("utf-8") if str is bytes else value
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def parse_token(token):
+    """
+    Split the inside of a ${...} token into its id and name.
+
+    @param token text between ${ and }, e.g. `1:Card title`
+    @retval tuple (token id, name or None)
+    """
+    parts = token.split(":", 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return token, None
+
+
+class Template(object):
+    """A template compiled into literal text and token slots."""
+
+    def __init__(self, text):
+        """
+        Compile a template.
+
+        @param text template text
+        """
+        super(Template, self).__init__()
+        self.text = text
+        # literals[i] comes before slots[i], the last literal after the last slot
+        self.literals = []
+        self.slots = []
+        # token id -> name, in the order the tokens first appear
+        self.tokens = OrderedDict()
+        position = 0
+        for match in TOKEN_RE.finditer(text):
+            token_id, name = parse_token(match.group(1))
+            if token_id not in self.tokens:
+                self.tokens[token_id] = name
+            self.literals.append(text[position:match.start()])
+            self.slots.append(token_id)
+            position = match.end()
+        self.literals.append(text[position:])
+        self._names = dict(((name or "").strip(), token_id) for token_id, name in self.tokens.items() if name)
+
+    @classmethod
+    def from_file(cls, path):
+        """Compile a template file, see load_template for the cached version."""
+        with open(path, "r") as f:
+            return cls(f.read())
+
+    def values_for(self, row):
+        """
+        Map a data row onto the token ids.
+
+        @param row dict keyed by token id or token name, or a list of values in token order
+        @retval dict of token id to value
+        """
+        if isinstance(row, dict):
+            values = {}
+            for key, value in row.items():
+                key = _native(key).strip() if key is not None else None
+                token_id = key if key in self.tokens else self._names.get(key)
+                if token_id is not None:
+                    values[token_id] = _native(value)
+            return values
+        return dict(zip(self.tokens, [_native(value) for value in row]))
+
+    def render(self, values, escape_values=False):
+        """
+        Fill in the tokens.
+
+        @param values dict of token id to value, missing tokens render empty
+        @param escape_values escape the values so they show as text rather than markup (default:False)
+        @retval rendered text
+        """
+        parts = [self.literals[0]]
+        for token_id, literal in zip(self.slots, self.literals[1:]):
+            value = values.get(token_id)
+            if value is None:
+                value = ""
+            elif escape_values:
+                value = escape(value)
+            parts.append(value)
+            parts.append(literal)
+        return "".join(parts)
+
+    def render_row(self, row, escape_values=True):
+        """Render one data row, see values_for."""
+        return self.render(self.values_for(row), escape_values)
+
+
+def template_tokens(content):
+    """
+    Get the tokens of a template.
+
+    @param content the content of the template
+    @retval {token id: {"name": name, "val": None}} in template order
+    """
+    tokens = OrderedDict()
+    for tok_id, tok_name in Template(content).tokens.items():
+        tokens[tok_id] = {"name": tok_name, "val": None}
+    return tokens
+
+
+class TemplateCache(object):
+    """
+    Compiled templates, keyed by path, size and modification time.
+
+    A template file is read and compiled once until it changes on disk.
+    """
+
+    def __init__(self, max_entries=DEFAULT_TEMPLATE_CACHE_ENTRIES):
+        """
+        Initialize TemplateCache object.
+
+        @param max_entries how many templates to remember, least recently used ones are dropped first (default:64)
+        """
+        super(TemplateCache, self).__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+
+    @staticmethod
+    def key(path):
+        """Return the cache key of a file: (absolute path, size, mtime)."""
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+    def get(self, path):
+        """
+        Get the compiled template of a file, compiling it unless it is cached.
+
+        @param path path of the template file
+        @retval Template
+        """
+        key = self.key(path)
+        with self._lock:
+            template = self._templates.pop(key, None)
+            if template is not None:
+                self._templates[key] = template
+                return template
+        template = Template.from_file(path)
+        with self._lock:
+            # An older version of the file is of no use anymore.
+            for stale in [k for k in self._templates if k[0] == key[0]]:
+                del self._templates[stale]
+            self._templates[key] = template
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+        return template
+
+    def clear(self):
+        """Forget all templates."""
+        with self._lock:
+            self._templates.clear()
+
+
+# Shared by everything in the process that loads templates.
+template_cache = TemplateCache()
+
+
+def load_template(path):
+    """
+    Get the compiled template of a file from the process wide cache.
+
+    @param path path of the template file
+    @retval Template
+    """
+    return template_cache.get(path)
+
+
+def iter_rows(path):
+    """
+    Read template data rows from a file.
+
+    @param path .csv file with a header row of token ids or names, or a JSON lines file (.jsonl, .json)
+                with one object (keyed by token id or name) or list per line
+    @retval generator of rows for Template.render_row
+    """
+    with open(path, "r") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
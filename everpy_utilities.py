@@ -1,42 +1,73 @@
 """Some generic utilties."""
-import keyring
-import getpass
+import hashlib
+import os
 import re
 
+from everpy_templates import template_tokens
+
 UN = "everpy"
 
 
+def get_everpy_dir():
+    """Get the folder everpy keeps its local caches in, creating it if needed."""
+    path = os.environ.get("EVERPY_HOME") or os.path.join(os.path.expanduser("~"), ".everpy")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def get_account_key(token):
+    """
+    Name the account a token belongs to, so local caches of different accounts stay apart.
+
+    Evernote tokens start with the shard and the hex user id (`S=s1:U=8f219:...`), which stay the
+    same when the token is renewed. Tokens without them are keyed by a digest of the token.
+
+    @param token developer or OAuth token
+    @retval string safe to use in a file name, e.g. `s1-8f219`
+    """
+    token = token or ""
+    fields = dict(part.split("=", 1) for part in token.split(":") if "=" in part)
+    shard, user = fields.get("S"), fields.get("U")
+    if shard and user and re.match(r"^[A-Za-z0-9]+$", shard + user):
+        return "{0}-{1}".format(shard, user)
+    if not isinstance(token, bytes):
+        token = token.encode("utf-8")
+    return "token-" + hashlib.sha1(token).hexdigest()[:12]
+
+
 def refresh_token():
     """Set new token."""
+    # keyring is slow to import, only commands that need a token pay for it.
+    import getpass
+    import keyring
     print("Set a new a token")
     keyring.set_password(UN, UN, getpass.getpass("Password: "))
     return keyring.get_password(UN, UN)
 
 
+def get_saved_token():
+    """Get the saved token without asking for one, None if there is none."""
+    import keyring
+    return keyring.get_password(UN, UN)
+
+
 def get_token():
     """Get a token."""
-    dev_token = keyring.get_password(UN, UN)
+    dev_token = get_saved_token()
     if not dev_token:
         dev_token = refresh_token()
     return dev_token
 
 
 def get_template_tokens(content):
-    regex = r"\$\{(\d+.*?)\}"
-    tokens = {}
-    with open("Templates/simple_sections.txt", "r") as f:
-        content = f.read()
-        matches = re.finditer(regex, content)
-        for match_num, match in enumerate(matches):
-            match_num = match_num + 1
-            tok = match.group(1)
-            tok_id, tok_name = None, None
-            if len(tok.split(":")) == 2:
-                tok_id, tok_name = tok.split(":")
-            else:
-                tok_id, tok_name = tok, None
-            tokens[tok_id] = {"name": tok_name, "val": None}
-    return tokens
+    """
+    Get the tokens of a template.
+
+    @param content the content of the template
+    @retval {token id: {"name": name, "val": None}} in template order
+    """
+    return template_tokens(content)
 
 if __name__ == '__main__':
 
@@ -2,7 +2,6 @@
 
 # from everpy_extras import EverPyExtras
 from everpy_pro import EverPyPro
-import everpy_utilities
 
 PATH_TO_ENSCRIPT = r"C:\Program Files (x86)\Evernote\Evernote\ENScript.exe"
 
@@ -19,12 +18,8 @@ def createnote(epy):
 
 def main():
     """Example usages."""
-    dev_token = everpy_utilities.get_token()
-    try:
-        my_evernote = EverPyPro(dev_token, PATH_TO_ENSCRIPT)
-    except:
-        everpy_utilities.refresh_token()
-        my_evernote = EverPyPro(dev_token, PATH_TO_ENSCRIPT)
+    # Asks for a new token if the saved one no longer works.
+    my_evernote = EverPyPro.connect(PATH_TO_ENSCRIPT)
 
     # Find and replace
     # my_evernote.find_and_replace("evernote", "Evernote", "any:")
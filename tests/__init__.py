@@ -0,0 +1 @@
+"""Everpy tests, run with `python -m unittest discover -s tests -t .` from the repository root."""
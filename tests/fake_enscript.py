@@ -0,0 +1,83 @@
+"""Stand-in for ENScript.exe, run as `python fake_enscript.py <action> [args]`.
+
+    lines N DELAY   print N lines, DELAY seconds apart
+    sleep SECONDS   print nothing for a while
+    fail CODE MSG   print MSG on stderr and exit with CODE
+    flood BYTES     write BYTES to stdout and to stderr, interleaved
+
+and a few ENScript commands, working on the account described by the json file
+$FAKE_ENSCRIPT_ACCOUNT: {"notebooks": {name: note count}, "fail": [names], "delay": seconds, "log": path}
+
+    listNotebooks
+    exportNotes /q notebook:"NAME" /f FILE [/s SCOPE]
+"""
+import json
+import os
+import sys
+import time
+
+
+def load_account():
+    with open(os.environ["FAKE_ENSCRIPT_ACCOUNT"], "r") as f:
+        return json.load(f)
+
+
+def log(account, event, name):
+    if account.get("log"):
+        with open(account["log"], "a") as f:
+            f.write("{0} {1!r} {2}\n".format(event, time.time(), name))
+
+
+def options(args):
+    """Parse `/x value` pairs."""
+    return dict(zip(args[::2], args[1::2]))
+
+
+def export_notes(args):
+    account = load_account()
+    opts = options(args)
+    name = opts["/q"][len("notebook:"):].strip('"')
+    log(account, "start", name)
+    time.sleep(account.get("delay", 0))
+    try:
+        if name in account.get("fail", []):
+            sys.stderr.write("Notebook {0} could not be exported\n".format(name))
+            return 1
+        with open(opts["/f"], "w") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<en-export application="Fake">\n')
+            for i in range(account["notebooks"][name]):
+                f.write("<note><title>{0} {1}</title><content><![CDATA[<en-note>{1}</en-note>]]></content>"
+                        "</note>\n".format(name, i))
+            f.write("</en-export>\n")
+        return 0
+    finally:
+        log(account, "end", name)
+
+
+def main(args):
+    action = args[0]
+    if action == "lines":
+        for i in range(int(args[1])):
+            sys.stdout.write("line {0}\n".format(i))
+            sys.stdout.flush()
+            time.sleep(float(args[2]))
+    elif action == "sleep":
+        time.sleep(float(args[1]))
+    elif action == "fail":
+        sys.stderr.write(args[2] + "\n")
+        return int(args[1])
+    elif action == "flood":
+        chunk = "x" * 1023 + "\n"
+        for _ in range(int(args[1]) // len(chunk)):
+            sys.stdout.write(chunk)
+            sys.stderr.write(chunk)
+    elif action == "listNotebooks":
+        for name in sorted(load_account()["notebooks"]):
+            sys.stdout.write(name + "\n")
+    elif action == "exportNotes":
+        return export_notes(args[1:])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
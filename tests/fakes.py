@@ -0,0 +1,333 @@
+"""Stand-ins for the Evernote note store and for ENScript.exe the tests run everpy against."""
+import copy
+import json
+import os
+import sys
+import threading
+import time
+
+import evernote.edam.type.ttypes as Types
+from evernote.edam.error.ttypes import EDAMNotFoundException
+from evernote.edam.notestore.ttypes import NoteCollectionCounts, NotesMetadataList, NoteMetadata, SyncChunk, SyncState
+
+from everpy_pro import EverPyPro
+
+NOTE_HEADER = "<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'><en-note>"
+NOTE_FOOTER = "</en-note>"
+
+FAKE_ENSCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_enscript.py")
+
+
+class FakeAccount(object):
+    """Notebooks, tags and notes shared by every FakeNoteStore of one account."""
+
+    def __init__(self):
+        """Initialize FakeAccount object."""
+        super(FakeAccount, self).__init__()
+        self.lock = threading.Lock()
+        self.usn = 0
+        self.notebooks = []
+        self.tags = []
+        self.notes = []
+        # notes ever added, so expunged notes do not free their guid
+        self.notes_added = 0
+        # guids of the notes getNote and updateNote fail for
+        self.failing = set()
+        # calls made while another call was running on the same FakeNoteStore
+        self.overlaps = 0
+        self.updates = []
+        # search queries findNoteCounts was asked for
+        self.counted_queries = []
+        # (usn, guid) of the notes expunged so far
+        self.expunged = []
+        # service time in ms before which clients must do a full sync again
+        self.full_sync_before = 0
+        # getSyncState calls made so far
+        self.sync_state_calls = 0
+        # error getSyncState raises, e.g. an EDAMUserException for an expired token
+        self.sync_state_error = None
+
+    def _next_usn(self):
+        self.usn += 1
+        return self.usn
+
+    def add_notebook(self, name):
+        """Add a notebook, return its guid."""
+        guid = "notebook-{0}".format(len(self.notebooks))
+        self.notebooks.append(Types.Notebook(guid=guid, name=name, updateSequenceNum=self._next_usn()))
+        return guid
+
+    def add_tag(self, name):
+        """Add a tag, return its guid."""
+        guid = "tag-{0}".format(len(self.tags))
+        self.tags.append(Types.Tag(guid=guid, name=name, updateSequenceNum=self._next_usn()))
+        return guid
+
+    def add_note(self, title, text, notebook_guid, tag_guids=None, resources=None):
+        """Add a note with text as its content, return its guid."""
+        guid = "note-{0}".format(self.notes_added)
+        created = 1500000000000 + self.notes_added * 1000
+        self.notes_added += 1
+        self.notes.append(Types.Note(guid=guid, title=title, content=NOTE_HEADER + text + NOTE_FOOTER,
+                                     created=created, updated=created, active=True, notebookGuid=notebook_guid,
+                                     tagGuids=tag_guids, resources=resources, attributes=Types.NoteAttributes(),
+                                     updateSequenceNum=self._next_usn()))
+        return guid
+
+    def expunge_note(self, guid):
+        """Delete a note for good, like emptying the trash."""
+        self.notes.remove(self.note(guid))
+        self.expunged.append((self._next_usn(), guid))
+
+    def notebook(self, guid):
+        """Get a notebook by guid."""
+        return next(notebook for notebook in self.notebooks if notebook.guid == guid)
+
+    def tag(self, guid):
+        """Get a tag by guid."""
+        return next(tag for tag in self.tags if tag.guid == guid)
+
+    def matches(self, note, words):
+        """
+        Check a note against a search query.
+
+        Understands just enough of the search grammar for the tests: any:, notebook:NAME, tag:NAME,
+        tag:* and -tag:*, all terms required unless the query starts with any:.
+        """
+        terms = (words or "").split()
+        match_any = terms[:1] == ["any:"]
+        terms = terms[1:] if match_any else terms
+        if not terms:
+            return True
+        tag_names = [self.tag(guid).name for guid in note.tagGuids or []]
+        results = []
+        for term in terms:
+            if term == "tag:*":
+                results.append(bool(tag_names))
+            elif term == "-tag:*":
+                results.append(not tag_names)
+            elif term.startswith("tag:"):
+                results.append(term[len("tag:"):].strip('"') in tag_names)
+            elif term.startswith("notebook:"):
+                results.append(self.notebook(note.notebookGuid).name == term[len("notebook:"):].strip('"'))
+            else:
+                raise ValueError("FakeAccount does not understand {0!r}".format(term))
+        return any(results) if match_any else all(results)
+
+    def note(self, guid):
+        """Get a note by guid."""
+        for note in self.notes:
+            if note.guid == guid:
+                return note
+        raise EDAMNotFoundException(identifier="Note.guid", key=guid)
+
+
+class FakeNoteStore(object):
+    """
+    A note store client of a FakeAccount.
+
+    Like a thrift client it must only be used by one thread at a time: a call made while
+    another one runs on the same client is counted in FakeAccount.overlaps.
+    """
+
+    def __init__(self, account, latency=0.0):
+        """
+        Initialize FakeNoteStore object.
+
+        @param account FakeAccount the client talks to
+        @param latency (optional) seconds every call takes
+        """
+        super(FakeNoteStore, self).__init__()
+        self.account = account
+        self.latency = latency
+        self._busy = threading.Lock()
+
+    def _call(self):
+        if not self._busy.acquire(False):
+            with self.account.lock:
+                self.account.overlaps += 1
+            self._busy.acquire()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            self._busy.release()
+
+    def listNotebooks(self):
+        self._call()
+        return copy.deepcopy(self.account.notebooks)
+
+    def listTags(self):
+        self._call()
+        return copy.deepcopy(self.account.tags)
+
+    def createTag(self, tag):
+        self._call()
+        with self.account.lock:
+            return self.account.tag(self.account.add_tag(tag.name))
+
+    def createNote(self, note):
+        self._call()
+        with self.account.lock:
+            note = copy.deepcopy(note)
+            note.guid = "note-{0}".format(self.account.notes_added)
+            self.account.notes_added += 1
+            note.active = True
+            note.updateSequenceNum = self.account._next_usn()
+            self.account.notes.append(note)
+            return copy.deepcopy(note)
+
+    def createNotebook(self, notebook):
+        self._call()
+        with self.account.lock:
+            return self.account.notebook(self.account.add_notebook(notebook.name))
+
+    def listSearches(self):
+        self._call()
+        return []
+
+    def getSyncState(self):
+        self._call()
+        with self.account.lock:
+            self.account.sync_state_calls += 1
+        if self.account.sync_state_error is not None:
+            raise self.account.sync_state_error
+        return SyncState(currentTime=int(time.time() * 1000), fullSyncBefore=self.account.full_sync_before,
+                         updateCount=self.account.usn)
+
+    def getFilteredSyncChunk(self, after_usn, max_entries, sync_filter):
+        self._call()
+        with self.account.lock:
+            changed = [(item.updateSequenceNum, kind, item)
+                       for kind, items in (("notebooks", self.account.notebooks), ("tags", self.account.tags),
+                                           ("notes", self.account.notes))
+                       for item in items if item.updateSequenceNum > after_usn]
+            if sync_filter.includeExpunged:
+                changed += [(usn, "expungedNotes", guid) for usn, guid in self.account.expunged if usn > after_usn]
+            changed = sorted(changed, key=lambda change: change[0])[:max_entries]
+            chunk = SyncChunk(currentTime=int(time.time() * 1000), updateCount=self.account.usn,
+                              chunkHighUSN=changed[-1][0] if changed else None)
+            for _, kind, item in changed:
+                if kind == "notes":
+                    item = copy.deepcopy(item)
+                    item.content = None
+                    item.resources = None
+                if getattr(chunk, kind) is None:
+                    setattr(chunk, kind, [])
+                getattr(chunk, kind).append(item)
+        return chunk
+
+    def findNotesMetadata(self, note_filter, offset, max_notes, result_spec):
+        self._call()
+        with self.account.lock:
+            notes = [note for note in self.account.notes
+                     if note_filter.notebookGuid in (None, note.notebookGuid)
+                     and note_filter.words in (None, "", "any:")]
+            page = [NoteMetadata(guid=note.guid, title=note.title,
+                                 updateSequenceNum=note.updateSequenceNum if result_spec.includeUpdateSequenceNum else None,
+                                 tagGuids=list(note.tagGuids or []) if result_spec.includeTagGuids else None,
+                                 notebookGuid=note.notebookGuid if result_spec.includeNotebookGuid else None,
+                                 attributes=copy.deepcopy(note.attributes) if result_spec.includeAttributes else None)
+                    for note in notes[offset:offset + max_notes]]
+        return NotesMetadataList(startIndex=offset, totalNotes=len(notes), notes=page)
+
+    def findNoteCounts(self, note_filter, with_trash):
+        self._call()
+        with self.account.lock:
+            self.account.counted_queries.append(note_filter.words)
+            notes = [note for note in self.account.notes if self.account.matches(note, note_filter.words)]
+            notebook_counts, tag_counts = {}, {}
+            for note in notes:
+                if not note.active:
+                    continue
+                notebook_counts[note.notebookGuid] = notebook_counts.get(note.notebookGuid, 0) + 1
+                for guid in note.tagGuids or []:
+                    tag_counts[guid] = tag_counts.get(guid, 0) + 1
+            trash = len([note for note in notes if not note.active]) if with_trash else None
+        return NoteCollectionCounts(notebookCounts=notebook_counts or None, tagCounts=tag_counts or None,
+                                    trashCount=trash)
+
+    def getNote(self, guid, with_content, with_resources_data, with_resources_recognition,
+                with_resources_alternate_data):
+        self._call()
+        with self.account.lock:
+            if guid in self.account.failing:
+                raise EDAMNotFoundException(identifier="Note.guid", key=guid)
+            note = copy.deepcopy(self.account.note(guid))
+        if not with_content:
+            note.content = None
+        for resource in note.resources or []:
+            if not with_resources_data:
+                resource.data.body = None
+        return note
+
+    def updateNote(self, note):
+        self._call()
+        with self.account.lock:
+            if note.guid in self.account.failing:
+                raise EDAMNotFoundException(identifier="Note.guid", key=note.guid)
+            stored = self.account.note(note.guid)
+            # Like the service, fields left unset are not changed.
+            for field in ("title", "content", "tagGuids", "notebookGuid", "attributes"):
+                if getattr(note, field) is not None:
+                    setattr(stored, field, copy.deepcopy(getattr(note, field)))
+            stored.updateSequenceNum = self.account._next_usn()
+            self.account.updates.append(note.guid)
+            return copy.deepcopy(stored)
+
+
+def make_pro(account, latency=0.0, token="S=s1:U=1:E=0:C=0:P=1:A=en-devtoken:V=2:H=0", **kwargs):
+    """
+    Create an EverPyPro whose note stores are FakeNoteStores of account.
+
+    @param account FakeAccount
+    @param latency (optional) seconds every note store call takes
+    @param token (optional) token the EverPyPro is given, only its shard and user id matter
+    @param kwargs passed on to EverPyPro, local caches are off unless asked for
+    @retval EverPyPro
+    """
+    kwargs.setdefault("use_cache", False)
+    my_evernote = EverPyPro(token, "/nonexistent/ENScript.exe", **kwargs)
+    my_evernote.note_store_factory = lambda: FakeNoteStore(account, latency)
+    return my_evernote
+
+
+class FakeEnscriptAccount(object):
+    """
+    The account tests/fake_enscript.py works on.
+
+    It is kept in a json file the fake finds through $FAKE_ENSCRIPT_ACCOUNT, and the fake logs
+    when every export starts and ends so tests can see how many ran at once.
+    """
+
+    def __init__(self, folder, notebooks, fail=(), delay=0.0):
+        """
+        Write the account and point $FAKE_ENSCRIPT_ACCOUNT at it.
+
+        @param folder folder to keep the account and log files in
+        @param notebooks dict of notebook name to note count
+        @param fail (optional) names of the notebooks whose export fails
+        @param delay (optional) seconds every export takes
+        """
+        super(FakeEnscriptAccount, self).__init__()
+        self.path = os.path.join(folder, "enscript_account.json")
+        self.log = os.path.join(folder, "enscript.log")
+        with open(self.path, "w") as f:
+            json.dump({"notebooks": notebooks, "fail": list(fail), "delay": delay, "log": self.log}, f)
+        os.environ["FAKE_ENSCRIPT_ACCOUNT"] = self.path
+
+    def max_concurrent_exports(self):
+        """Return the largest number of exports that ran at the same time."""
+        with open(self.log, "r") as f:
+            events = sorted((float(line.split()[1]), line.split()[0] == "start") for line in f)
+        running = most = 0
+        for _, started in events:
+            running += 1 if started else -1
+            most = max(most, running)
+        return most
+
+
+def use_fake_enscript(everpy):
+    """Make an EverPy object run tests/fake_enscript.py instead of ENScript.exe."""
+    everpy.enscript_core_args = [sys.executable, FAKE_ENSCRIPT]
+    return everpy
@@ -0,0 +1,126 @@
+"""Local caches of different accounts sharing one cache folder."""
+import shutil
+import tempfile
+import unittest
+
+import evernote.edam.type.ttypes as Types
+from evernote.edam.notestore.ttypes import SyncChunk
+
+import everpy_pro
+from everpy_utilities import get_account_key
+from tests.fakes import FakeAccount, make_pro
+
+TOKEN_1 = "S=s1:U=8f219:E=15e2:C=16d:P=1cd:A=en-devtoken:V=2:H=2bd1"
+TOKEN_2 = "S=s7:U=1a2b3:E=15e2:C=16d:P=1cd:A=en-devtoken:V=2:H=77fe"
+
+
+class AccountKeyTest(unittest.TestCase):
+
+    def test_key_is_shard_and_user(self):
+        self.assertEqual(get_account_key(TOKEN_1), "s1-8f219")
+        self.assertEqual(get_account_key(TOKEN_2), "s7-1a2b3")
+
+    def test_renewed_token_keeps_its_key(self):
+        self.assertEqual(get_account_key(TOKEN_1.replace("H=2bd1", "H=9c0e")), get_account_key(TOKEN_1))
+
+    def test_other_tokens_are_digested(self):
+        key = get_account_key("oauth-token/with:odd=chars")
+        self.assertTrue(key.startswith("token-"))
+        self.assertNotIn("/", key)
+        self.assertNotEqual(key, get_account_key("another-token"))
+
+
+class MetadataCacheAccountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.accounts = []
+        for name in ("Personal", "Business"):
+            account = FakeAccount()
+            account.add_notebook(name)
+            self.accounts.append(account)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_accounts_sharing_a_cache_dir_keep_their_own_notebooks(self):
+        first = make_pro(self.accounts[0], token=TOKEN_1, use_cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(list(first.get_metadata("notebooks")), ["Personal"])
+        # Both accounts are at the same update count, the cache must still tell them apart.
+        self.assertEqual(self.accounts[0].usn, self.accounts[1].usn)
+        second = make_pro(self.accounts[1], token=TOKEN_2, use_cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(list(second.get_metadata("notebooks")), ["Business"])
+        self.assertEqual(list(first.get_metadata("notebooks")), ["Personal"])
+
+    def test_cache_is_reused_by_the_same_account(self):
+        first = make_pro(self.accounts[0], token=TOKEN_1, use_cache=True, cache_dir=self.cache_dir)
+        first.get_metadata("notebooks")
+        again = make_pro(self.accounts[0], token=TOKEN_1, use_cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(again.metadata_cache.get("notebooks", self.accounts[0].usn).keys(), ["Personal"])
+
+
+class UpdateCountSharingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.account = FakeAccount()
+        self.account.add_notebook("Personal")
+        everpy_pro._update_counts.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_pro(self, account=None, token=TOKEN_1):
+        return make_pro(account or self.account, token=token, use_cache=True, cache_dir=self.cache_dir)
+
+    def test_one_check_per_process(self):
+        self.assertTrue(self.make_pro().token_works())
+        self.make_pro().get_metadata("notebooks")
+        self.make_pro().get_metadata("tags")
+        self.assertEqual(self.account.sync_state_calls, 1)
+
+    def test_old_count_is_read_again(self):
+        first = self.make_pro()
+        first.get_metadata("notebooks")
+        checked, update_count = everpy_pro._update_counts[first.account_key]
+        everpy_pro._update_counts[first.account_key] = (checked - everpy_pro.METADATA_CHECK_SECONDS - 1, update_count)
+        self.account.add_notebook("Travel")
+        self.assertEqual(sorted(self.make_pro().get_metadata("notebooks")), ["Personal", "Travel"])
+        self.assertEqual(self.account.sync_state_calls, 2)
+
+    def test_refresh_reads_the_count(self):
+        self.make_pro().get_metadata("notebooks")
+        self.make_pro().get_metadata("notebooks", refresh=True)
+        self.assertEqual(self.account.sync_state_calls, 2)
+
+    def test_accounts_are_checked_apart(self):
+        other = FakeAccount()
+        self.make_pro().get_metadata("notebooks")
+        self.make_pro(other, TOKEN_2).get_metadata("notebooks")
+        self.assertEqual((self.account.sync_state_calls, other.sync_state_calls), (1, 1))
+
+
+class LocalMirrorAccountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_accounts_sharing_a_cache_dir_keep_their_own_mirror(self):
+        first = make_pro(FakeAccount(), token=TOKEN_1, cache_dir=self.cache_dir)
+        mirror = first.get_mirror()
+        mirror.apply_chunk(SyncChunk(notebooks=[Types.Notebook(guid="nb-1", name="Personal", updateSequenceNum=5)]))
+        mirror.commit()
+        mirror.close()
+        second = make_pro(FakeAccount(), token=TOKEN_2, cache_dir=self.cache_dir)
+        self.assertEqual(second.get_mirror().notebooks(), [])
+        again = make_pro(FakeAccount(), token=TOKEN_1, cache_dir=self.cache_dir)
+        self.assertEqual([name for _, name, _ in again.get_mirror().notebooks()], ["Personal"])
+        second.get_mirror().close()
+        again.get_mirror().close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Compressed backup files: compress_file, describe_file, verify_file and verified compressed backups."""
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from everpy_archive import CHUNK_SIZE, compress_file, compression_suffix, describe_file, lzma, open_archive, verify_file
+from everpy_enex import iter_enex
+from everpy_extras import EverPyExtras, read_backup_manifest
+from tests.fakes import FakeEnscriptAccount, use_fake_enscript
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "Work.enex")
+        # More than a chunk, and compressible like an export.
+        self.data = (b"<note><title>lease</title></note>\n" * (CHUNK_SIZE // 20)) + os.urandom(1000)
+        with open(self.source, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def round_trip(self, compression):
+        dest = self.source + compression_suffix(compression)
+        plain = describe_file(self.source)
+        compress_file(self.source, dest)
+        self.assertFalse(os.path.exists(self.source))
+        with open_archive(dest) as f:
+            self.assertEqual(f.read(), self.data)
+
+        info = describe_file(dest)
+        self.assertEqual(info["size"], os.path.getsize(dest))
+        self.assertLess(info["size"], len(self.data))
+        self.assertEqual((info["content_size"], info["content_sha256"]), (plain["size"], plain["sha256"]))
+        self.assertEqual(verify_file(dest, info), [])
+
+        with open(dest, "r+b") as f:
+            f.seek(info["size"] // 2)
+            f.write(b"\0" * 16)
+        problems = verify_file(dest, info)
+        self.assertTrue(problems)
+        self.assertTrue(problems[0].startswith("sha256 is ") or problems[0].startswith("unreadable"), problems)
+
+    def test_gzip(self):
+        self.round_trip("gzip")
+        with gzip.open(self.source + ".gz", "rb") as f:
+            self.assertEqual(f.read(5), b"<note")
+
+    @unittest.skipIf(lzma is None, "no lzma module")
+    def test_xz(self):
+        self.round_trip("xz")
+
+    @unittest.skipIf(lzma is not None, "lzma module available")
+    def test_xz_without_lzma(self):
+        self.assertRaises(ValueError, compression_suffix, "xz")
+
+    def test_plain_file(self):
+        info = describe_file(self.source)
+        self.assertEqual(sorted(info), ["sha256", "size"])
+        self.assertEqual(verify_file(self.source, info), [])
+        with open(self.source, "ab") as f:
+            f.write(b"x")
+        self.assertEqual(verify_file(self.source, info)[0], "size is {0}, expected {1}".format(
+            len(self.data) + 1, len(self.data)))
+        self.assertEqual(verify_file(self.source + ".missing", info), ["missing"])
+
+    def test_unknown_compression(self):
+        self.assertEqual(compression_suffix(None), "")
+        self.assertRaises(ValueError, compression_suffix, "zip")
+
+
+class CompressedBackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        FakeEnscriptAccount(self.folder, {"Work": 3, "Home": 1})
+        self.my_evernote = use_fake_enscript(EverPyExtras("ENScript.exe"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compressed_backup_verifies(self):
+        backup_folder = self.my_evernote.proper_backup(self.folder, compress="gzip", workers=2)
+        self.assertEqual(sorted(os.listdir(backup_folder)), ["Home.enex.gz", "Work.enex.gz", "manifest.json"])
+        with open_archive(os.path.join(backup_folder, "Work.enex.gz")) as f:
+            self.assertEqual(len(list(iter_enex(f))), 3)
+        entry = read_backup_manifest(backup_folder)["notebooks"]["Work"]
+        self.assertEqual(sorted(key for key in entry if "size" in key or "sha256" in key),
+                         ["content_sha256", "content_size", "sha256", "size"])
+        self.assertEqual(self.my_evernote.verify_backup(backup_folder), {})
+
+        with open(os.path.join(backup_folder, "Home.enex.gz"), "ab") as f:
+            f.write(b"junk")
+        os.remove(os.path.join(backup_folder, "Work.enex.gz"))
+        problems = self.my_evernote.verify_backup(backup_folder)
+        self.assertEqual(sorted(problems), ["Home", "Work"])
+        self.assertEqual(problems["Work"], ["missing"])
+
+
+if __name__ == "__main__":
+    unittest.main()
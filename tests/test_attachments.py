@@ -0,0 +1,46 @@
+"""Attachments read by EverPyPro.get_resource."""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.fakes import FakeAccount, make_pro
+
+
+class GetResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "scan.pdf")
+        # Larger than a megabyte and not a multiple of any power of two read size.
+        self.body = os.urandom(3 * 1024 * 1024 + 123)
+        with open(self.path, "wb") as f:
+            f.write(self.body)
+        self.my_evernote = make_pro(FakeAccount())
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_large_file(self):
+        resource = self.my_evernote.get_resource(self.path)
+        self.assertEqual(resource.data.size, len(self.body))
+        self.assertEqual(resource.data.body, self.body)
+        self.assertEqual(resource.data.bodyHash, hashlib.md5(self.body).hexdigest())
+        self.assertEqual(resource.mime, "application/pdf")
+        self.assertEqual(resource.attributes.fileName, self.path)
+
+    def test_hash_is_cached_per_file_version(self):
+        key = self.my_evernote.hash_cache.key(self.path)
+        self.my_evernote.hash_cache.put(key, "cached")
+        self.assertEqual(self.my_evernote.get_resource(self.path).data.bodyHash, "cached")
+
+        with open(self.path, "ab") as f:
+            f.write(b"more")
+        resource = self.my_evernote.get_resource(self.path)
+        self.assertEqual(resource.data.bodyHash, hashlib.md5(self.body + b"more").hexdigest())
+        self.assertEqual(resource.data.size, len(self.body) + 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""proper_backup with the ENScript engine, against tests/fake_enscript.py."""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from everpy_enex import iter_enex
+from everpy_extras import BACKUP_FOLDER_PREFIX, EverPyExtras, read_backup_manifest
+from tests.fakes import FakeEnscriptAccount, use_fake_enscript
+
+NOTEBOOKS = {"Work": 3, "Home": 2, "Broken": 1, "Travel": 4}
+
+
+class EnscriptBackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, "backups")
+        os.mkdir(self.location)
+        self.account = FakeEnscriptAccount(self.folder, NOTEBOOKS, fail=["Broken"], delay=0.3)
+        self.my_evernote = use_fake_enscript(EverPyExtras("ENScript.exe"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_folder_layout_and_manifest(self):
+        backup_folder = self.my_evernote.proper_backup(self.location, workers=3)
+        self.assertEqual(os.path.dirname(backup_folder), self.location)
+        self.assertTrue(os.path.basename(backup_folder).startswith(BACKUP_FOLDER_PREFIX))
+        self.assertEqual(sorted(os.listdir(backup_folder)), ["Home.enex", "Travel.enex", "Work.enex", "manifest.json"])
+        self.assertEqual(len(list(iter_enex(os.path.join(backup_folder, "Travel.enex")))), 4)
+
+        manifest = read_backup_manifest(backup_folder)
+        self.assertEqual(manifest["failed"], ["Broken"])
+        self.assertEqual(sorted(manifest["notebooks"]), sorted(NOTEBOOKS))
+        broken = manifest["notebooks"]["Broken"]
+        self.assertEqual(broken["returncode"], 1)
+        self.assertIn("Broken could not be exported", broken["error"])
+        for name in ("Work", "Home", "Travel"):
+            entry = manifest["notebooks"][name]
+            self.assertEqual(entry["returncode"], 0)
+            self.assertEqual(entry["file"], name + ".enex")
+            self.assertEqual(entry["size"], os.path.getsize(os.path.join(backup_folder, name + ".enex")))
+            self.assertEqual(len(entry["sha256"]), 64)
+            self.assertGreater(entry["seconds"], 0.25)
+
+    def test_workers_run_exports_concurrently(self):
+        self.my_evernote.proper_backup(self.location, workers=3)
+        self.assertEqual(self.my_evernote.enscript_runner.concurrency, 3)
+        self.assertGreaterEqual(self.account.max_concurrent_exports(), 2)
+        self.assertLessEqual(self.account.max_concurrent_exports(), 3)
+
+    def test_export_seconds_leave_out_the_wait_for_enscript(self):
+        self.account = FakeEnscriptAccount(self.folder, NOTEBOOKS, delay=0.6)
+        self.my_evernote.set_enscript_limits(1)
+        results = {}
+
+        def export(name):
+            results[name] = self.my_evernote._timed_export((name, os.path.join(self.folder, name + ".enex")))
+
+        threads = [threading.Thread(target=export, args=(name,)) for name in ("Work", "Home")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.account.max_concurrent_exports(), 1)
+        for returncode, err, seconds in results.values():
+            self.assertEqual(returncode, 0)
+            # Each export takes 0.6s, the second one also waited about as long for the first.
+            self.assertLess(seconds, 0.95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Checking the token with EverPyPro.token_works and replacing a rejected one with EverPyPro.connect."""
+import shutil
+import socket
+import tempfile
+import unittest
+
+from evernote.edam.error.ttypes import EDAMErrorCode, EDAMUserException
+
+import everpy_utilities
+from everpy_pro import EverPyPro
+from tests.fakes import FakeAccount, FakeNoteStore, make_pro
+
+
+class TokenWorksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.account = FakeAccount()
+        self.account.add_notebook("Work")
+        self.my_evernote = make_pro(self.account, use_cache=True, cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_check_is_reused_for_metadata(self):
+        self.assertTrue(self.my_evernote.token_works())
+        self.assertEqual(list(self.my_evernote.note_book_dict), ["Work"])
+        self.assertEqual(self.account.sync_state_calls, 1)
+
+    def test_rejected_token(self):
+        for code in (EDAMErrorCode.AUTH_EXPIRED, EDAMErrorCode.INVALID_AUTH):
+            self.account.sync_state_error = EDAMUserException(errorCode=code, parameter="authenticationToken")
+            self.assertFalse(self.my_evernote.token_works())
+
+    def test_other_errors_are_raised(self):
+        self.account.sync_state_error = EDAMUserException(errorCode=EDAMErrorCode.DATA_REQUIRED)
+        self.assertRaises(EDAMUserException, self.my_evernote.token_works)
+        self.account.sync_state_error = socket.error("network is unreachable")
+        self.assertRaises(socket.error, self.my_evernote.token_works)
+
+
+class FakeEverPyPro(EverPyPro):
+    """EverPyPro on the FakeAccount of the test that is running."""
+
+    account = None
+
+    def __init__(self, token, path_to_enscript, **kwargs):
+        super(FakeEverPyPro, self).__init__(token, path_to_enscript, use_cache=False, **kwargs)
+        self.note_store_factory = lambda: FakeNoteStore(self.account)
+
+
+class ConnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.account = FakeEverPyPro.account = FakeAccount()
+        self.refreshed = []
+        self.saved = (everpy_utilities.get_token, everpy_utilities.refresh_token)
+        everpy_utilities.get_token = lambda: "S=s1:U=1:E=0:C=0:P=1:A=en-devtoken:V=2:H=old"
+        everpy_utilities.refresh_token = self.refresh_token
+
+    def tearDown(self):
+        everpy_utilities.get_token, everpy_utilities.refresh_token = self.saved
+
+    def refresh_token(self):
+        self.refreshed.append(True)
+        self.account.sync_state_error = None
+        return "S=s1:U=1:E=0:C=0:P=1:A=en-devtoken:V=2:H=new"
+
+    def test_working_token(self):
+        self.assertEqual(FakeEverPyPro.connect("ENScript.exe").token[-3:], "old")
+        self.assertEqual(self.refreshed, [])
+
+    def test_expired_token_is_replaced(self):
+        self.account.sync_state_error = EDAMUserException(errorCode=EDAMErrorCode.AUTH_EXPIRED)
+        self.assertEqual(FakeEverPyPro.connect("ENScript.exe").token[-3:], "new")
+        self.assertEqual(self.refreshed, [True])
+
+    def test_network_error_keeps_token(self):
+        self.account.sync_state_error = socket.error("network is unreachable")
+        self.assertRaises(socket.error, FakeEverPyPro.connect, "ENScript.exe")
+        self.assertEqual(self.refreshed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""NoteContentCache eviction, shared by several processes, and one cache file per account."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from everpy_cache import NoteContentCache
+from tests.fakes import FakeAccount, make_pro
+
+TOKEN_1 = "S=s1:U=8f219:E=15e2:C=16d:P=1cd:A=en-devtoken:V=2:H=2bd1"
+TOKEN_2 = "S=s7:U=1a2b3:E=15e2:C=16d:P=1cd:A=en-devtoken:V=2:H=77fe"
+
+
+class NoteContentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "content_cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_usn_must_match(self):
+        cache = NoteContentCache(self.path, 100)
+        cache.put("a", 1, "<en-note>a</en-note>")
+        self.assertEqual(cache.get("a", 1), "<en-note>a</en-note>")
+        self.assertIsNone(cache.get("a", 2))
+        cache.put("a", 2, "<en-note/>")
+        self.assertEqual((len(cache), cache.size), (1, 10))
+        cache.close()
+
+    def test_least_recently_used_is_evicted(self):
+        cache = NoteContentCache(self.path, 30)
+        for guid in "abc":
+            cache.put(guid, 1, guid * 10)
+        cache.get("a")
+        cache.put("d", 1, "d" * 10)
+        self.assertEqual([guid for guid in "abcd" if cache.get(guid)], ["a", "c", "d"])
+        self.assertEqual(cache.size, 30)
+        cache.put("e", 1, "e" * 31)
+        self.assertIsNone(cache.get("e"))
+        cache.close()
+
+    def test_processes_sharing_the_file_stay_within_max_bytes(self):
+        first = NoteContentCache(self.path, 30)
+        second = NoteContentCache(self.path, 30)
+        first.put("a", 1, "a" * 10)
+        second.put("b", 1, "b" * 10)
+        first.put("c", 1, "c" * 10)
+        self.assertEqual(first.size, 30)
+        second.put("d", 1, "d" * 10)
+        self.assertEqual((first.size, second.size), (30, 30))
+        self.assertIsNone(first.get("a"))
+        second.discard("b")
+        self.assertEqual(first.size, 20)
+        first.close()
+        second.close()
+
+
+class ContentCacheAccountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_accounts_sharing_a_cache_dir_keep_their_own_content(self):
+        first = make_pro(FakeAccount(), token=TOKEN_1, use_cache=True, cache_dir=self.cache_dir)
+        second = make_pro(FakeAccount(), token=TOKEN_2, use_cache=True, cache_dir=self.cache_dir)
+        first.content_cache.put("note-1", 1, "<en-note>first</en-note>")
+        self.assertIsNone(second.content_cache.get("note-1", 1))
+        self.assertEqual(sorted(name for name in os.listdir(self.cache_dir) if name.startswith("content_cache")),
+                         ["content_cache-s1-8f219.db", "content_cache-s7-1a2b3.db"])
+        first.content_cache.close()
+        second.content_cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
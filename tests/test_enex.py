@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Writing ENEX files with EnexWriter and streaming them back with iter_enex."""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from everpy_enex import ENCODE_CHUNK_SIZE, EnexNote, EnexResource, EnexWriter, iter_enex
+
+CONTENT = (u"<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'>"
+           u"<en-note><div>Fish &amp; chips, caf\xe9 ]]&gt;</div></en-note>")
+# Sizes around the encoder's chunk, none of them a multiple of 3, so every base64 padding case shows up.
+SIZES = (1, 2, ENCODE_CHUNK_SIZE - 1, ENCODE_CHUNK_SIZE + 1, 3 * ENCODE_CHUNK_SIZE + 2)
+
+
+class Collector(object):
+    """Resource sink output that keeps the chunks it is given."""
+
+    def __init__(self, chunks):
+        self.write = chunks.append
+
+
+class EnexRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.attachments = [os.urandom(size) for size in SIZES]
+        note = EnexNote(u"Caf\xe9 <menu> & \"prices\"", CONTENT, datetime(2024, 1, 31, 22, 0, 5), "20240201T080000Z",
+                        tags=[u"food & drink", u"d\xe9j\xe0 vu"])
+        note.attributes["source-url"] = "http://example.com/?a=1&b=2"
+        for i, data in enumerate(self.attachments):
+            if i % 2:
+                path = os.path.join(self.folder, "attachment{0}".format(i))
+                with open(path, "wb") as f:
+                    f.write(data)
+                resource = EnexResource(mime="image/png", attributes={"file-name": u"\xe9{0}.png".format(i)},
+                                        data_path=path)
+            else:
+                resource = EnexResource(data, "application/pdf", {"file-name": "{0}.pdf".format(i)})
+            note.resources.append(resource)
+        note.resources[0].width, note.resources[0].height = 640, 480
+        note.resources[0].recognition = u"<recoIndex><item>caf\xe9</item></recoIndex>"
+        self.path = os.path.join(self.folder, "export.enex")
+        with open(self.path, "wb") as f:
+            with EnexWriter(f) as writer:
+                writer.write(note)
+                writer.write(EnexNote("Empty", CONTENT))
+        self.assertEqual(writer.notes, 2)
+        self.assertEqual(writer.bytes_written, os.path.getsize(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def check_note(self, note):
+        self.assertEqual(note.title, u"Caf\xe9 <menu> & \"prices\"")
+        self.assertEqual(note.content, CONTENT)
+        self.assertEqual((note.created, note.updated), ("20240131T220005Z", "20240201T080000Z"))
+        self.assertEqual(note.tags, [u"food & drink", u"d\xe9j\xe0 vu"])
+        self.assertEqual(dict(note.attributes), {"source-url": "http://example.com/?a=1&b=2"})
+        self.assertEqual(len(note.resources), len(SIZES))
+        first = note.resources[0]
+        self.assertEqual((first.mime, first.width, first.height), ("application/pdf", "640", "480"))
+        self.assertEqual(first.recognition, u"<recoIndex><item>caf\xe9</item></recoIndex>")
+        self.assertEqual(note.resources[1].attributes["file-name"], u"\xe91.png")
+        for resource, data in zip(note.resources, self.attachments):
+            self.assertEqual(resource.size, len(data))
+            self.assertEqual(resource.hash, hashlib.md5(data).hexdigest())
+
+    def test_in_memory(self):
+        # An odd feed size splits the base64 text at every possible offset.
+        notes = list(iter_enex(self.path, chunk_size=1001))
+        self.assertEqual([note.title for note in notes[1:]], ["Empty"])
+        self.assertEqual(notes[1].resources, [])
+        self.check_note(notes[0])
+        self.assertEqual([resource.data for resource in notes[0].resources], self.attachments)
+
+    def test_data_dir(self):
+        data_dir = os.path.join(self.folder, "data")
+        os.mkdir(data_dir)
+        with open(self.path, "rb") as f:
+            note = next(iter_enex(f, data_dir=data_dir))
+        self.check_note(note)
+        for resource, data in zip(note.resources, self.attachments):
+            self.assertIsNone(resource.data)
+            self.assertEqual(os.path.dirname(resource.data_path), data_dir)
+            with resource.open() as f:
+                self.assertEqual(f.read(), data)
+
+    def test_resource_sink(self):
+        received = []
+
+        def sink(resource):
+            received.append([])
+            return Collector(received[-1])
+
+        note = next(iter_enex(self.path, resource_sink=sink, chunk_size=4096))
+        self.assertEqual([b"".join(chunks) for chunks in received], self.attachments)
+        self.assertTrue(all(len(chunks) > 1 for chunks in received[2:]))
+        self.assertEqual([resource.hash for resource in note.resources],
+                         [hashlib.md5(data).hexdigest() for data in self.attachments])
+
+
+if __name__ == "__main__":
+    unittest.main()
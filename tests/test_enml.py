@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""everpy_enml: rewriting, text extraction, validation and building of note bodies."""
+import re
+import unittest
+
+from everpy_enml import (ENML_FOOTER, ENML_HEADER, EnmlBuilder, EnmlError, extract_text, rewrite_text, text_to_enml,
+                         validate_enml)
+
+MD5 = "0123456789abcdef0123456789abcdef"
+
+
+def note(body):
+    return ENML_HEADER + body + ENML_FOOTER
+
+
+class RewriteTextTest(unittest.TestCase):
+
+    def test_only_text_nodes_change(self):
+        content = note('<div title="cat">cat <a href="http://cat.example/">cats</a><!-- cat --></div>')
+        new_content, count = rewrite_text(content, re.compile("cat"), "dog")
+        self.assertEqual(count, 2)
+        self.assertEqual(new_content, note('<div title="cat">dog <a href="http://cat.example/">dogs</a><!-- cat --></div>'))
+
+    def test_text_is_matched_unescaped_and_escaped_again(self):
+        new_content, count = rewrite_text(note("<div>Tom &amp; Jerry &lt;3</div>"), re.compile("&"), "<and>")
+        self.assertEqual(count, 1)
+        self.assertEqual(new_content, note("<div>Tom &lt;and&gt; Jerry &lt;3</div>"))
+
+    def test_greater_than_in_attribute_does_not_end_the_tag(self):
+        content = note('<div title="a > b">a</div>')
+        self.assertEqual(rewrite_text(content, re.compile("b"), "c"), (content, 0))
+        self.assertEqual(rewrite_text(content, re.compile("a"), "c")[0], note('<div title="a > b">c</div>'))
+
+    def test_cdata_and_comments_are_copied(self):
+        content = note("<div>x</div>").replace("<en-note>", "<!-- x --><en-note>") + "<![CDATA[x]]>"
+        new_content, count = rewrite_text(content, re.compile("x"), "y")
+        self.assertEqual(count, 1)
+        self.assertEqual(new_content, content.replace("<div>x</div>", "<div>y</div>"))
+
+    def test_encrypted_text_is_left_alone(self):
+        content = note('<div>secret</div><en-crypt hint="secret">c2VjcmV0secret==</en-crypt><div>secret</div>')
+        new_content, count = rewrite_text(content, re.compile("secret"), "public")
+        self.assertEqual(count, 2)
+        self.assertEqual(new_content, note('<div>public</div><en-crypt hint="secret">c2VjcmV0secret==</en-crypt>'
+                                           '<div>public</div>'))
+
+    def test_no_match_returns_content_unchanged(self):
+        content = note("<div>a&#39;b</div>")
+        self.assertIs(rewrite_text(content, re.compile("z"), "y")[0], content)
+        self.assertEqual(rewrite_text(content, re.compile("b"), "b"), (content, 0))
+
+
+class ExtractTextTest(unittest.TestCase):
+
+    def test_text_with_entities(self):
+        content = note(u"<div>Fish &amp; chips</div><div>caf&#233; &#x263A; &eacute;&apos;</div>")
+        self.assertEqual(extract_text(content), u"Fish & chips caf\xe9 ☺ \xe9'")
+
+    def test_skips_markup_outside_en_note_and_encrypted_text(self):
+        content = note('<div>a</div><en-crypt cipher="AES">Zm9v</en-crypt><div title="x > y">b</div><!-- c -->')
+        self.assertEqual(extract_text(content), "a b")
+
+    def test_unknown_entity_is_kept(self):
+        self.assertEqual(extract_text(note("<div>&bogus; x</div>")), "&bogus; x")
+
+
+class ValidateEnmlTest(unittest.TestCase):
+
+    def assertInvalid(self, content, message):
+        with self.assertRaises(EnmlError) as raised:
+            validate_enml(content)
+        self.assertIn(message, str(raised.exception))
+
+    def test_valid(self):
+        content = note('<div title="a > b">x &amp; y<br/><en-media type="image/png" hash="{0}"/><!-- ok --></div>'
+                       '<en-todo checked="true"/>'.format(MD5))
+        self.assertIs(validate_enml(content), content)
+        self.assertEqual(validate_enml("<en-note/>"), "<en-note/>")
+
+    def test_document_structure(self):
+        self.assertInvalid(note("<div>\x07</div>"), "Control characters")
+        self.assertInvalid("hello" + note(""), "Text outside of <en-note>")
+        self.assertInvalid(note("<div>fish & chips</div>"), "Unescaped &")
+        self.assertInvalid(note("<![CDATA[x]]>"), "is not allowed inside <en-note>")
+        self.assertInvalid(note("<?php echo 1 ?>"), "is not allowed inside <en-note>")
+        self.assertInvalid(note("<1div>"), "Malformed tag")
+        self.assertInvalid(note("") + "</div>", "Unexpected </div>")
+        self.assertInvalid(note("<div><b></div></b>"), "Expected </b> but found </div>")
+        self.assertInvalid("<div></div>", "single <en-note> root, found <div>")
+        self.assertInvalid(note("") + "<en-note></en-note>", "single <en-note> root, found <en-note>")
+        self.assertInvalid(note("<en-note></en-note>"), "can not be nested")
+        self.assertInvalid(ENML_HEADER + "<div>", "<div> is never closed")
+        self.assertInvalid("<!-- nothing -->", "no <en-note> root")
+
+    def test_elements_and_attributes(self):
+        self.assertInvalid(note("<script></script>"), "Element <script> is not allowed")
+        self.assertInvalid(note("<div nowrap></div>"), "Malformed attributes in <div>")
+        self.assertInvalid(note('<div class="x"></div>'), "Attribute class is not allowed")
+        self.assertInvalid(note('<div onClick="x()"></div>'), "Attribute onclick is not allowed")
+        self.assertInvalid(note('<div title="a" TITLE="b"></div>'), "Duplicate attribute title")
+        self.assertInvalid(note('<en-media hash="{0}"/>'.format(MD5)), "needs a type attribute")
+        self.assertInvalid(note('<en-media type="image/png"/>'), "needs a hash attribute")
+        self.assertInvalid(note('<en-media type="image/png" hash="abc"/>'), "is not a hex md5")
+
+
+class EnmlBuilderTest(unittest.TestCase):
+
+    def test_build(self):
+        content = EnmlBuilder().markup("<div>").text("1 < 2 & 3\x0b").markup("</div>").media(MD5, 'image/"png"').build()
+        self.assertEqual(content, note('<div>1 &lt; 2 &amp; 3</div><en-media type="image/&quot;png&quot;" hash="{0}"/>'
+                                       .format(MD5)))
+
+    def test_build_validates(self):
+        builder = EnmlBuilder().markup("<div>")
+        self.assertRaises(EnmlError, builder.build)
+        self.assertEqual(builder.build(validate=False), note("<div>"))
+
+    def test_text_to_enml(self):
+        content = text_to_enml(u"caf\xe9 & co\n\n<tag>\x00", media=[(MD5, "application/pdf")])
+        self.assertEqual(content, note(u'<div>caf\xe9 &amp; co</div><div><br/></div><div>&lt;tag&gt;</div>'
+                                       u'<en-media type="application/pdf" hash="{0}"/>'.format(MD5)))
+        self.assertIs(validate_enml(content), content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Exporting notes through the API: EverPyPro.export_notes_api and api engine backups."""
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import evernote.edam.type.ttypes as Types
+
+from everpy_enex import iter_enex
+from everpy_extras import read_backup_manifest
+from tests.fakes import FakeAccount, make_pro
+
+ATTACHMENT = b"\x89PNG fake image data" * 100
+
+
+class ExportNotesApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.account = FakeAccount()
+        self.work = self.account.add_notebook("Work")
+        self.home = self.account.add_notebook("Home")
+        urgent = self.account.add_tag("urgent")
+        resource = Types.Resource(mime="image/png", attributes=Types.ResourceAttributes(fileName="image.png"),
+                                  data=Types.Data(body=ATTACHMENT, size=len(ATTACHMENT),
+                                                  bodyHash=hashlib.md5(ATTACHMENT).digest()))
+        for i in range(12):
+            self.account.add_note("Work {0}".format(i), "<div>work {0}</div>".format(i), self.work,
+                                  tag_guids=[urgent] if i % 2 else None, resources=[resource] if i == 3 else None)
+        self.account.add_note("Home 0", "<div>home</div>", self.home)
+        self.my_evernote = make_pro(self.account, latency=0.002)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_notebook_round_trips(self):
+        export_file = os.path.join(self.folder, "Work.enex")
+        returncode, err = self.my_evernote.export_notes_api(export_file, notebook_guid=self.work, workers=4)
+        self.assertEqual((returncode, err), (0, ""))
+        notes = list(iter_enex(export_file))
+        self.assertEqual([note.title for note in notes], ["Work {0}".format(i) for i in range(12)])
+        self.assertEqual([note.tags for note in notes], [["urgent"] if i % 2 else [] for i in range(12)])
+        self.assertIn("work 5", notes[5].content)
+        self.assertEqual(len(notes[3].resources), 1)
+        self.assertEqual(notes[3].resources[0].data, ATTACHMENT)
+        self.assertEqual(notes[3].resources[0].mime, "image/png")
+        self.assertEqual(self.account.overlaps, 0)
+
+    def test_compressed_export(self):
+        export_file = os.path.join(self.folder, "Work.enex.gz")
+        self.assertEqual(self.my_evernote.export_notes_api(export_file, notebook_guid=self.work)[0], 0)
+        with gzip.open(export_file, "rb") as f:
+            self.assertEqual(len(list(iter_enex(f))), 12)
+
+    def test_boolean_attributes_are_lowercase(self):
+        self.account.notes[3].resources[0].attributes.attachment = True
+        export_file = os.path.join(self.folder, "Work.enex")
+        self.assertEqual(self.my_evernote.export_notes_api(export_file, notebook_guid=self.work)[0], 0)
+        with open(export_file, "rb") as f:
+            self.assertIn(b"<attachment>true</attachment>", f.read())
+        self.assertEqual(list(iter_enex(export_file))[3].resources[0].attributes["attachment"], "true")
+        resource = Types.Resource(mime="image/png", attributes=Types.ResourceAttributes(attachment=False))
+        note = Types.Note(title="Inline", content="<en-note/>", resources=[resource])
+        self.assertEqual(self.my_evernote.note_to_enex(note).resources[0].attributes["attachment"], "false")
+
+    def test_failed_note_is_left_out_and_reported(self):
+        self.account.failing.add(self.account.notes[2].guid)
+        export_file = os.path.join(self.folder, "Work.enex")
+        returncode, err = self.my_evernote.export_notes_api(export_file, notebook_guid=self.work, workers=4)
+        self.assertEqual(returncode, 1)
+        self.assertIn("Work 2", err)
+        titles = [note.title for note in iter_enex(export_file)]
+        self.assertEqual(len(titles), 11)
+        self.assertNotIn("Work 2", titles)
+
+    def test_concurrent_backup_gives_every_thread_its_own_note_store(self):
+        for i in range(6):
+            notebook = self.account.add_notebook("Extra {0}".format(i))
+            for j in range(3):
+                self.account.add_note("Extra {0}.{1}".format(i, j), "<div>extra</div>", notebook)
+        backup_folder = self.my_evernote.proper_backup(self.folder, workers=4)
+        manifest = read_backup_manifest(backup_folder)
+        self.assertEqual(manifest["failed"], [])
+        self.assertEqual(sorted(manifest["notebooks"]), sorted(nb.name for nb in self.account.notebooks))
+        for entry in manifest["notebooks"].values():
+            self.assertEqual(entry["returncode"], 0)
+            self.assertTrue(os.path.isfile(os.path.join(backup_folder, entry["file"])))
+        self.assertEqual(len(list(iter_enex(os.path.join(backup_folder, "Extra 4.enex")))), 3)
+        self.assertEqual(self.account.overlaps, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Ordered concurrent processing: everpy_pool.imap_ordered and find and replace."""
+import random
+import threading
+import time
+import unittest
+
+from everpy_pool import imap_ordered
+from tests.fakes import FakeAccount, make_pro
+
+
+class ImapOrderedTest(unittest.TestCase):
+
+    def test_results_come_in_input_order(self):
+        def slow_square(n):
+            time.sleep(random.random() * 0.01)
+            return n * n
+
+        results = list(imap_ordered(slow_square, range(50), workers=8))
+        self.assertEqual([item for item, _, _ in results], list(range(50)))
+        self.assertEqual([result for _, result, _ in results], [n * n for n in range(50)])
+
+    def test_errors_come_back_with_their_item(self):
+        def check(n):
+            if n % 4 == 0:
+                raise ValueError(n)
+            return n
+
+        for item, result, error in imap_ordered(check, range(20), workers=4):
+            if item % 4 == 0:
+                self.assertIsInstance(error, ValueError)
+                self.assertIsNone(result)
+            else:
+                self.assertIsNone(error)
+                self.assertEqual(result, item)
+
+    def test_runs_concurrently(self):
+        active = [0, 0]
+        lock = threading.Lock()
+
+        def track(n):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+        list(imap_ordered(track, range(12), workers=4))
+        self.assertGreater(active[1], 1)
+        self.assertLessEqual(active[1], 4)
+
+
+class FindAndReplaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.account = FakeAccount()
+        notebook = self.account.add_notebook("Notes")
+        for i in range(30):
+            text = "<div>old text {0}</div>".format(i) if i % 3 else "<div>nothing to see {0}</div>".format(i)
+            self.account.add_note("Note {0}".format(i), text, notebook)
+        self.my_evernote = make_pro(self.account, latency=0.002)
+
+    def test_results_in_note_order(self):
+        results = list(self.my_evernote.iter_find_and_replace("old", "new", page_size=7, workers=4))
+        self.assertEqual([note.title for note, _, _ in results], ["Note {0}".format(i) for i in range(30)])
+        self.assertEqual([updated for _, updated, _ in results], [bool(i % 3) for i in range(30)])
+        self.assertEqual(self.account.overlaps, 0)
+
+    def test_updates_content(self):
+        summary = self.my_evernote.find_and_replace("old", "new", workers=4)
+        self.assertEqual((summary.scanned, summary.matched, summary.updated, summary.errors), (30, 20, 20, 0))
+        self.assertEqual(sorted(self.account.updates), sorted(note.guid for note in self.account.notes[1::3] +
+                                                              self.account.notes[2::3]))
+        for note in self.account.notes:
+            self.assertNotIn("old text", note.content)
+        self.assertEqual(self.account.overlaps, 0)
+
+    def test_failed_note_is_reported_in_place(self):
+        self.account.failing.add(self.account.notes[4].guid)
+        results = list(self.my_evernote.iter_find_and_replace("old", "new", workers=4))
+        self.assertEqual(len(results), 30)
+        note, updated, error = results[4]
+        self.assertEqual(note.title, "Note 4")
+        self.assertFalse(updated)
+        self.assertIsNotNone(error)
+        self.assertEqual(len([r for r in results if r[2] is not None]), 1)
+        self.assertEqual(len(self.account.updates), 19)
+
+
+if __name__ == "__main__":
+    unittest.main()
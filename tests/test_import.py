@@ -0,0 +1,72 @@
+"""Turning import_records records into ENEX notes with EverPyExtras.record_to_enex_note."""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from everpy_enml import ENML_FOOTER, ENML_HEADER, validate_enml
+from everpy_extras import EverPyExtras
+
+
+class RecordToEnexNoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.my_evernote = EverPyExtras("ENScript.exe")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_content_only_tuple(self):
+        note, notebook = self.my_evernote.record_to_enex_note(("\nCall about the lease & keys\nsecond line",))
+        self.assertIsNone(notebook)
+        self.assertEqual(note.title, "Call about the lease & keys")
+        self.assertEqual(note.content, ENML_HEADER + "<div><br/></div><div>Call about the lease &amp; keys</div>"
+                                                     "<div>second line</div>" + ENML_FOOTER)
+        self.assertEqual((note.tags, note.created, note.resources), ([], None, []))
+        validate_enml(note.content)
+
+    def test_long_first_line_and_empty_content(self):
+        note, _ = self.my_evernote.record_to_enex_note(("x" * 100,))
+        self.assertEqual(note.title, "x" * 80)
+        note, _ = self.my_evernote.record_to_enex_note(("",))
+        self.assertEqual(note.title, "Untitled")
+
+    def test_dict_with_every_field(self):
+        attachment = os.path.join(self.folder, "scan.pdf")
+        with open(attachment, "wb") as f:
+            f.write(b"%PDF fake")
+        created = datetime(2024, 1, 31, 22, 0, 0)
+        note, notebook = self.my_evernote.record_to_enex_note({
+            "content": "See attached",
+            "title": "Lease",
+            "tags": ["home", "paper"],
+            "notebook": "Archive",
+            "created": created,
+            "attachments": [attachment],
+            "ignored": True,
+        })
+        self.assertEqual(notebook, "Archive")
+        self.assertEqual((note.title, note.tags, note.created), ("Lease", ["home", "paper"], created))
+        resource = note.resources[0]
+        self.assertEqual((resource.mime, resource.data_path), ("application/pdf", attachment))
+        self.assertEqual(resource.attributes["file-name"], "scan.pdf")
+        md5 = hashlib.md5(b"%PDF fake").hexdigest()
+        self.assertTrue(note.content.endswith('<en-media type="application/pdf" hash="{0}"/>'.format(md5) + ENML_FOOTER))
+        validate_enml(note.content)
+
+    def test_tuple_fields_in_order(self):
+        note, notebook = self.my_evernote.record_to_enex_note(("text", None, ["a"], "Inbox"))
+        self.assertEqual((note.title, note.tags, notebook), ("text", ["a"], "Inbox"))
+
+    def test_enml_content_is_kept(self):
+        content = ENML_HEADER + "<div>Fish &amp; chips</div><div>more</div>" + ENML_FOOTER
+        note, _ = self.my_evernote.record_to_enex_note((content,), enml=True)
+        self.assertEqual(note.content, content)
+        self.assertEqual(note.title, "Fish & chips more")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Offline full text search: LocalMirror.search, EverPyPro.search_local and `search -local`."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import everpy_cli
+import everpy_utilities
+from tests.fakes import FakeAccount, make_pro
+
+
+class MirrorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.account = FakeAccount()
+        notebook = self.account.add_notebook("Home")
+        lease = self.account.add_tag("lease")
+        self.account.add_note("Apartment lease", "<div>signed the lease for the apartment</div>", notebook)
+        self.account.add_note("Groceries", "<div>milk, eggs and a note about the lease</div>", notebook)
+        self.account.add_note("Car", "<div>oil change</div>", notebook, tag_guids=[lease])
+        self.my_evernote = make_pro(self.account, cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        if self.my_evernote.mirror is not None:
+            self.my_evernote.mirror.close()
+        shutil.rmtree(self.cache_dir)
+
+    def titles(self, results):
+        return [title for _, title, _ in results]
+
+
+class LocalSearchTest(MirrorTestCase):
+
+    def test_update_indexes_titles_text_and_tags(self):
+        self.assertEqual(self.titles(self.my_evernote.search_local("oil", update=True)), ["Car"])
+        self.assertEqual(sorted(self.titles(self.my_evernote.search_local("lease"))),
+                         ["Apartment lease", "Car", "Groceries"])
+        self.assertEqual(self.titles(self.my_evernote.search_local("title:apartment")), ["Apartment lease"])
+
+    def test_title_hits_rank_first(self):
+        self.my_evernote.search_local("lease", update=True)
+        if self.my_evernote.get_mirror().fts != "fts5":
+            self.skipTest("ranking needs FTS5")
+        self.assertEqual(self.titles(self.my_evernote.search_local("lease"))[0], "Apartment lease")
+
+    def test_search_without_update_stays_offline(self):
+        self.my_evernote.search_local("lease", update=True)
+
+        def offline():
+            raise AssertionError("search_local went online")
+
+        my_evernote = make_pro(self.account, cache_dir=self.cache_dir)
+        my_evernote.note_store_factory = offline
+        self.assertEqual(self.titles(my_evernote.search_local("oil")), ["Car"])
+        my_evernote.mirror.close()
+
+    def test_deleted_notes_leave_the_index(self):
+        self.my_evernote.search_local("oil", update=True)
+        self.account.expunge_note(self.account.notes[2].guid)
+        self.assertEqual(self.titles(self.my_evernote.search_local("oil", update=True)), [])
+
+    def test_malformed_query_is_a_value_error(self):
+        self.my_evernote.search_local("oil", update=True)
+        with self.assertRaises(ValueError):
+            list(self.my_evernote.search_local("lease AND AND ("))
+
+
+class LocalSearchCliTest(MirrorTestCase):
+
+    def setUp(self):
+        super(LocalSearchCliTest, self).setUp()
+        self.my_evernote.search_local("lease", update=True)
+        self.my_evernote.mirror.close()
+        self.my_evernote.mirror = None
+        self.everpy_home = os.environ.get("EVERPY_HOME")
+        os.environ["EVERPY_HOME"] = self.cache_dir
+
+    def tearDown(self):
+        if self.everpy_home is None:
+            del os.environ["EVERPY_HOME"]
+        else:
+            os.environ["EVERPY_HOME"] = self.everpy_home
+        super(LocalSearchCliTest, self).tearDown()
+
+    def run_cli(self, *args):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            everpy_cli.run_command(everpy_cli.get_cmd_line_args(list(args)))
+            return sys.stdout.getvalue()
+        finally:
+            self.stderr = sys.stderr.getvalue()
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_local_search_needs_no_token(self):
+        self.assertFalse(everpy_cli.needs_api(everpy_cli.get_cmd_line_args(["search", "-local", "-query", "oil"])))
+        self.assertTrue(everpy_cli.needs_api(everpy_cli.get_cmd_line_args(["search", "-local", "-update",
+                                                                         "-query", "oil"])))
+        out = self.run_cli("search", "-local", "-query", "oil")
+        self.assertEqual(out.count("\n"), 1)
+        self.assertIn('"title": "Car"', out)
+
+    def test_malformed_query_is_a_usage_error(self):
+        with self.assertRaises(SystemExit) as raised:
+            self.run_cli("search", "-local", "-query", "lease AND AND (")
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn("search: error: Invalid full text query", self.stderr)
+
+    def test_missing_index_is_reported(self):
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("mirror-"):
+                os.remove(os.path.join(self.cache_dir, name))
+        saved_token, everpy_utilities.get_saved_token = everpy_utilities.get_saved_token, lambda: None
+        try:
+            with self.assertRaises(SystemExit) as raised:
+                self.run_cli("search", "-local", "-query", "oil")
+        finally:
+            everpy_utilities.get_saved_token = saved_token
+        self.assertIn("No local index", str(raised.exception.code))
+
+
+if __name__ == "__main__":
+    unittest.main()
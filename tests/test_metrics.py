@@ -0,0 +1,151 @@
+"""Call, byte and error counting of InstrumentedStore and nesting of metrics_scope."""
+import threading
+import unittest
+
+from everpy_metrics import InstrumentedStore, Metrics, enabled, metrics_scope
+
+
+class FakeTransport(object):
+    """Transport that returns zeros on read and drops what is written."""
+
+    def __init__(self):
+        self.flushed = False
+
+    def read(self, size):
+        return b"\0" * size
+
+    def readAll(self, size):
+        return b"\0" * size
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        self.flushed = True
+
+
+class FakeProtocol(object):
+
+    def __init__(self):
+        self.trans = FakeTransport()
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self._iprot = self._oprot = FakeProtocol()
+
+
+class FakeStore(object):
+    """Store whose calls write a request and read a reply through one transport, like a thrift client."""
+
+    errorCode = None
+
+    def __init__(self):
+        self._client = FakeClient()
+
+    def getNote(self, request_size, reply_size):
+        self._client._oprot.trans.write(b"x" * request_size)
+        self._client._oprot.trans.flush()
+        return self._client._iprot.trans.readAll(reply_size)
+
+    def fail(self):
+        error = ValueError("no")
+        error.errorCode = 9
+        raise error
+
+
+class InstrumentedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = InstrumentedStore(FakeStore(), "note_store")
+
+    def test_counts_calls_and_bytes(self):
+        with metrics_scope() as metrics:
+            self.store.getNote(10, 100)
+            self.store.getNote(5, 50)
+        stats = metrics["note_store.getNote"]
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual((stats.bytes_out, stats.bytes_in), (15, 150))
+        self.assertEqual(sum(stats.histogram), 2)
+        self.assertEqual(metrics.operations(), ["note_store.getNote"])
+
+    def test_passes_results_and_attributes(self):
+        self.assertEqual(self.store.getNote(1, 3), b"\0\0\0")
+        self.assertIsNone(self.store.errorCode)
+        self.assertTrue(self.store._client._iprot.trans.flushed)
+
+    def test_counts_errors(self):
+        with metrics_scope() as metrics:
+            self.assertRaises(ValueError, self.store.fail)
+            self.assertRaises(ValueError, self.store.fail)
+        stats = metrics["note_store.fail"]
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.errors, {"ValueError(9)": 2})
+        self.assertEqual(metrics.as_dict()["operations"]["note_store.fail"]["errors"], 2)
+
+    def test_not_recorded_without_scope(self):
+        self.store.getNote(10, 100)
+        with metrics_scope() as metrics:
+            self.store.getNote(1, 2)
+        self.assertEqual((metrics["note_store.getNote"].bytes_out, metrics["note_store.getNote"].bytes_in), (1, 2))
+        self.assertEqual(metrics["note_store.getNote"].calls, 1)
+
+    def test_wrapping_twice_counts_once(self):
+        store = FakeStore()
+        InstrumentedStore(store, "note_store")
+        again = InstrumentedStore(store, "note_store")
+        with metrics_scope() as metrics:
+            again.getNote(4, 8)
+        self.assertEqual((metrics["note_store.getNote"].bytes_out, metrics["note_store.getNote"].bytes_in), (4, 8))
+
+
+class MetricsScopeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = InstrumentedStore(FakeStore(), "note_store")
+
+    def test_nested_scopes(self):
+        self.assertFalse(enabled())
+        with metrics_scope() as outer:
+            self.store.getNote(1, 1)
+            with metrics_scope() as inner:
+                self.store.getNote(2, 2)
+                self.assertTrue(enabled())
+            self.store.getNote(3, 3)
+            self.assertTrue(enabled())
+        self.assertFalse(enabled())
+        self.assertEqual(outer["note_store.getNote"].calls, 3)
+        self.assertEqual(outer["note_store.getNote"].bytes_out, 6)
+        self.assertEqual(inner["note_store.getNote"].calls, 1)
+        self.assertEqual(inner["note_store.getNote"].bytes_out, 2)
+
+    def test_scope_closed_on_error(self):
+        try:
+            with metrics_scope():
+                raise KeyError("x")
+        except KeyError:
+            pass
+        self.assertFalse(enabled())
+
+    def test_reopened_scope_adds_up(self):
+        metrics = Metrics()
+        with metrics_scope(metrics):
+            self.store.getNote(1, 1)
+        with metrics_scope(metrics):
+            self.store.getNote(1, 1)
+        self.assertEqual(metrics["note_store.getNote"].calls, 2)
+
+    def test_scope_sees_other_threads(self):
+        with metrics_scope() as metrics:
+            threads = [threading.Thread(target=InstrumentedStore(FakeStore(), "note_store").getNote, args=(1, 1))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(metrics["note_store.getNote"].calls, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
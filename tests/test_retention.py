@@ -0,0 +1,132 @@
+"""RetentionPolicy, GenerationIndex and proper_backup pruning."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from everpy_extras import BACKUP_FOLDER_PREFIX, EverPyExtras
+from everpy_retention import (GenerationIndex, RetentionPolicy, RETENTION_MANIFEST, generation_file_name,
+                              kept_generations)
+from tests.fakes import FakeEnscriptAccount, use_fake_enscript
+
+
+def every_six_hours(days):
+    """Timestamps of a backup every six hours for days days, ending 2024-03-31 18:00 (a Sunday)."""
+    end = datetime(2024, 3, 31, 18)
+    return [end - timedelta(hours=6 * i) for i in range(days * 4)]
+
+
+class RetentionPolicyTest(unittest.TestCase):
+
+    def test_keep_newest(self):
+        timestamps = every_six_hours(3)
+        self.assertEqual(RetentionPolicy(keep=2).select(timestamps), set(timestamps[:2]))
+        self.assertEqual(RetentionPolicy(keep=0).select(timestamps), set())
+        self.assertEqual(RetentionPolicy(keep=50).select(timestamps), set(timestamps))
+
+    def test_daily_keeps_the_newest_of_each_day(self):
+        kept = RetentionPolicy(keep=0, daily=3).select(every_six_hours(10))
+        self.assertEqual(sorted(kept), [datetime(2024, 3, 29, 18), datetime(2024, 3, 30, 18), datetime(2024, 3, 31, 18)])
+
+    def test_weekly_and_monthly(self):
+        timestamps = every_six_hours(70)
+        kept = RetentionPolicy(keep=0, weekly=2).select(timestamps)
+        # 2024-03-31 is a Sunday, the week before ended on 2024-03-24.
+        self.assertEqual(sorted(kept), [datetime(2024, 3, 24, 18), datetime(2024, 3, 31, 18)])
+        kept = RetentionPolicy(keep=0, monthly=3).select(timestamps)
+        self.assertEqual(sorted(kept), [datetime(2024, 1, 31, 18), datetime(2024, 2, 29, 18), datetime(2024, 3, 31, 18)])
+
+    def test_buckets_add_up(self):
+        timestamps = every_six_hours(70)
+        kept = RetentionPolicy(keep=2, daily=2, weekly=2, monthly=2).select(timestamps)
+        self.assertEqual(sorted(kept), [
+            datetime(2024, 2, 29, 18),
+            datetime(2024, 3, 24, 18),
+            datetime(2024, 3, 30, 18),
+            datetime(2024, 3, 31, 12),
+            datetime(2024, 3, 31, 18),
+        ])
+
+    def test_gaps_do_not_count(self):
+        timestamps = [datetime(2024, 3, 31), datetime(2024, 3, 1), datetime(2024, 1, 15)]
+        self.assertEqual(RetentionPolicy(keep=0, daily=3).select(timestamps), set(timestamps))
+
+    def test_same_second_generations_count_separately(self):
+        created = datetime(2024, 3, 31, 18)
+        generations = {"a": created, "a-1": created, "a-2": created, "old": created - timedelta(days=1)}
+        self.assertEqual(kept_generations(2, generations), set(["a-1", "a-2"]))
+        self.assertEqual(kept_generations(RetentionPolicy(keep=0, daily=2), generations), set(["a-2", "old"]))
+
+
+class GenerationIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = GenerationIndex(self.folder)
+        self.names = []
+        for created in sorted(every_six_hours(2)):
+            name = generation_file_name("notes.enex.gz", created)
+            open(os.path.join(self.folder, name), "w").close()
+            self.index.add("notes.enex.gz", name, created)
+            self.names.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_generations_oldest_first(self):
+        self.assertEqual([name for _, name in self.index.generations("notes.enex.gz")], self.names)
+        self.assertEqual(self.names[0], "notes.20240330T000000.enex.gz")
+        self.assertEqual(self.index.generations("other.enex"), [])
+
+    def test_prune_removes_files_and_entries(self):
+        open(os.path.join(self.folder, "untracked.enex"), "w").close()
+        dropped = self.index.prune("notes.enex.gz", 3)
+        self.assertEqual(dropped, sorted(self.names[:-3]))
+        self.assertEqual([name for _, name in self.index.generations("notes.enex.gz")], self.names[-3:])
+        self.assertEqual(sorted(os.listdir(self.folder)), sorted(self.names[-3:] + [RETENTION_MANIFEST, "untracked.enex"]))
+        self.assertEqual(self.index.prune("notes.enex.gz", 3), [])
+
+    def test_prune_with_policy_and_remove(self):
+        removed = []
+        dropped = self.index.prune("notes.enex.gz", RetentionPolicy(keep=1, daily=2), remove=removed.append)
+        self.assertEqual(dropped, sorted(self.names[:3] + self.names[4:7]))
+        self.assertEqual(sorted(removed), [os.path.join(self.folder, name) for name in dropped])
+
+    def test_series_are_separate(self):
+        created = datetime(2024, 4, 1)
+        self.index.add("other.enex", generation_file_name("other.enex", created), created)
+        self.index.prune("notes.enex.gz", 0)
+        self.assertEqual(len(self.index.generations("other.enex")), 1)
+
+
+class ProperBackupRetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, "backups")
+        os.mkdir(self.location)
+        self.old = os.path.join(self.location, BACKUP_FOLDER_PREFIX + "01-31-2020__22-00-00")
+        os.mkdir(self.old)
+        FakeEnscriptAccount(self.folder, {"Work": 1})
+        self.my_evernote = use_fake_enscript(EverPyExtras("ENScript.exe"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_no_pruning_unless_asked(self):
+        folders = [self.my_evernote.proper_backup(self.location) for _ in range(3)]
+        self.assertEqual(len(set(folders)), 3)
+        for folder in folders + [self.old]:
+            self.assertTrue(os.path.isdir(folder))
+
+    def test_prune_leaves_untracked_folders_alone(self):
+        folders = [self.my_evernote.proper_backup(self.location, iterations=2) for _ in range(3)]
+        self.assertFalse(os.path.exists(folders[0]))
+        self.assertTrue(os.path.isdir(folders[1]))
+        self.assertTrue(os.path.isdir(folders[2]))
+        self.assertTrue(os.path.isdir(self.old))
+
+
+if __name__ == "__main__":
+    unittest.main()
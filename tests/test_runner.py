@@ -0,0 +1,103 @@
+"""Running ENScript commands with everpy_runner, against tests/fake_enscript.py."""
+import sys
+import threading
+import time
+import unittest
+
+from everpy_runner import EnscriptRunner
+from tests.fakes import FAKE_ENSCRIPT
+
+
+def enscript(*args):
+    """Command line running the fake ENScript."""
+    return [sys.executable, FAKE_ENSCRIPT] + [str(arg) for arg in args]
+
+
+class EnscriptRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = EnscriptRunner(concurrency=2)
+
+    def test_timeout_kills_the_command(self):
+        start = time.time()
+        out, err, returncode = self.runner.run(enscript("sleep", 30), timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+        self.assertNotEqual(returncode, 0)
+        self.assertIn(b"timed out after 0.5s", err)
+
+    def test_timeout_sets_timed_out(self):
+        process = self.runner.start(enscript("sleep", 30), timeout=0.5)
+        process.read()
+        self.assertTrue(process.timed_out)
+        self.assertTrue(process.finished)
+
+    def test_stderr_and_exit_status(self):
+        out, err, returncode = self.runner.run(enscript("fail", 3, "Notebook not found"))
+        self.assertEqual(returncode, 3)
+        self.assertEqual(out, b"")
+        self.assertIn(b"Notebook not found", err)
+
+    def test_full_stderr_does_not_stall_stdout(self):
+        size = 2 * 1024 * 1024
+        out, err, returncode = self.runner.run(enscript("flood", size), timeout=60)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(len(out), size)
+        self.assertEqual(len(err), size)
+
+    def test_lines_are_streamed(self):
+        process = self.runner.start(enscript("lines", 4, 0.3))
+        start = time.time()
+        seen = []
+        for line in process.lines():
+            seen.append((line, time.time() - start))
+        self.assertEqual([line for line, _ in seen], [b"line 0", b"line 1", b"line 2", b"line 3"])
+        # The first line arrives long before the command is done.
+        self.assertLess(seen[0][1], seen[-1][1] - 0.5)
+        self.assertEqual(process.returncode, 0)
+
+    def test_stopping_early_kills_the_command(self):
+        process = self.runner.start(enscript("lines", 100, 0.1))
+        for line in process.lines():
+            break
+        self.assertTrue(process.finished)
+        self.assertNotEqual(process.returncode, 0)
+
+    def test_run_many_keeps_order_and_concurrency(self):
+        cmds = [enscript("fail", code, "error {0}".format(code)) for code in (5, 0, 7, 0, 9)]
+        results = list(self.runner.run_many(cmds))
+        self.assertEqual([cmd for cmd, _, _ in results], cmds)
+        self.assertEqual([result[2] for _, result, _ in results], [5, 0, 7, 0, 9])
+        self.assertIn(b"error 7", results[2][1][1])
+
+        start = time.time()
+        list(self.runner.run_many([enscript("sleep", 0.5)] * 4))
+        # Two at a time: at least two rounds.
+        self.assertGreaterEqual(time.time() - start, 1.0)
+
+    def test_waited_seconds_count_the_wait_for_a_slot(self):
+        runner = EnscriptRunner(concurrency=1)
+        busy = runner.start(enscript("sleep", 0.5))
+        waited = []
+
+        def queued():
+            runner.run(enscript("sleep", 0))
+            waited.append(runner.waited_seconds())
+
+        thread = threading.Thread(target=queued)
+        thread.start()
+        busy.read()
+        thread.join()
+        self.assertGreater(waited[0], 0.2)
+        # Waits are counted per thread.
+        self.assertLess(runner.waited_seconds(), 0.1)
+
+    def test_slots_are_given_back(self):
+        for _ in range(5):
+            self.runner.run(enscript("fail", 1, "again"))
+        process = self.runner.start(enscript("sleep", 0))
+        process.read()
+        self.assertEqual(process.returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+"""BackupScheduler with a fake clock and a stand-in for the object running the backups."""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from everpy_scheduler import BackupJob, BackupScheduler
+
+
+class FakeEverPy(object):
+    """Runs backup_query by writing a small file, optionally waiting for a go-ahead first."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.update_count = 1
+        self.calls = []
+        self.returncode = 0
+        self.started = threading.Event()
+        self.go = threading.Event()
+        self.go.set()
+
+    def get_update_count(self):
+        return self.update_count
+
+    def backup_query(self, query, backup_location, file_name, iterations, compress=None):
+        self.calls.append((query, backup_location, file_name, iterations, compress))
+        self.started.set()
+        self.go.wait(5)
+        path = os.path.join(self.folder, "{0}.{1}.enex".format(file_name, len(self.calls)))
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        return self.returncode, "" if self.returncode == 0 else "boom", path
+
+
+class EnscriptOnly(object):
+    """An object that can run backups but not ask for the sync state, like EverPyExtras."""
+
+    def __init__(self, everpy):
+        self.backup_query = everpy.backup_query
+
+
+class FakeClock(object):
+    """A clock that only moves when told to."""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class BackupSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.everpy = FakeEverPy(self.folder)
+        self.clock = FakeClock()
+        self.job = BackupJob("notes", self.folder, 10, query="tag:backup", iterations=3)
+        self.state_file = os.path.join(self.folder, "state.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault("jitter", 0)
+        return BackupScheduler(self.everpy, [self.job], clock=self.clock, state_file=self.state_file, **kwargs)
+
+    def test_jitter(self):
+        scheduler = self.scheduler()
+        scheduler.schedule(self.job)
+        self.assertEqual(self.job.next_run, self.clock.now + 600)
+
+        scheduler = self.scheduler(jitter=30)
+        random.seed(1)
+        offsets = set()
+        for _ in range(50):
+            scheduler.schedule(self.job)
+            offsets.add(self.job.next_run - self.clock.now - 600)
+        self.assertTrue(all(0 <= offset <= 30 for offset in offsets))
+        self.assertGreater(len(offsets), 40)
+
+    def test_unchanged_account_is_skipped(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.run_job(self.job), "ok")
+        self.assertEqual(self.everpy.calls, [("tag:backup", self.folder, "notes", 3, None)])
+        self.assertEqual(scheduler.run_job(self.job), "skipped")
+        self.everpy.update_count = 2
+        self.assertEqual(scheduler.run_job(self.job), "ok")
+        stats = self.job.stats()
+        self.assertEqual((stats["runs"], stats["skipped"], stats["failures"], stats["update_count"]), (2, 1, 0, 2))
+        self.assertEqual(stats["last_bytes"], 10)
+
+    def test_failed_run_is_not_skipped_next_time(self):
+        scheduler = self.scheduler()
+        self.everpy.returncode = 1
+        self.assertEqual(scheduler.run_job(self.job), "failed")
+        self.assertEqual(self.job.last_error, "boom")
+        self.everpy.returncode = 0
+        self.assertEqual(scheduler.run_job(self.job), "ok")
+        self.assertEqual((self.job.runs, self.job.failures, self.job.skipped), (2, 1, 0))
+
+    def test_without_sync_state_every_run_happens(self):
+        scheduler = BackupScheduler(EnscriptOnly(self.everpy), [self.job], jitter=0, clock=self.clock)
+        self.assertEqual([scheduler.run_job(self.job) for _ in range(2)], ["ok", "ok"])
+
+    def test_running_job_is_not_started_again(self):
+        scheduler = self.scheduler()
+        self.everpy.go.clear()
+        self.job.next_run = self.clock.now
+        self.assertEqual(scheduler.run_pending(), [self.job])
+        self.assertTrue(self.everpy.started.wait(5))
+        self.assertTrue(self.job.running)
+        self.assertEqual(scheduler.run_job(self.job), "running")
+        self.clock.now += 3600
+        self.assertEqual(scheduler.run_pending(), [])
+        self.everpy.go.set()
+        scheduler.stop()
+        self.assertFalse(self.job.running)
+        self.assertEqual(len(self.everpy.calls), 1)
+        self.assertEqual(self.job.next_run, self.clock.now - 3600 + 600)
+
+    def test_state_file_survives_a_restart(self):
+        scheduler = self.scheduler()
+        scheduler.run_job(self.job)
+        scheduler.run_job(self.job)
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f)["notes"]["runs"], 1)
+
+        self.job = BackupJob("notes", self.folder, 10)
+        self.scheduler()
+        self.assertEqual((self.job.runs, self.job.skipped, self.job.update_count), (1, 1, 1))
+        self.assertEqual(self.job.last_status, "skipped")
+
+    def test_run_forever_follows_the_clock(self):
+        waits = []
+
+        def wait(seconds):
+            # Let the started backups finish, then move the clock on instead of sleeping.
+            for thread in list(scheduler.threads):
+                thread.join()
+            waits.append(seconds)
+            self.clock.now += seconds
+            self.everpy.update_count += 1
+            if self.clock.now >= start + 3600:
+                scheduler.stopped.set()
+
+        start = self.clock.now
+        scheduler = self.scheduler(wait=wait)
+        scheduler.run_forever()
+        # Runs at 0, 10, 20 ... 50 minutes, polling at least every POLL_INTERVAL seconds.
+        self.assertEqual(self.job.runs, 6)
+        self.assertTrue(all(0.1 <= seconds <= 30 for seconds in waits))
+        self.assertEqual(scheduler.threads, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Account statistics from findNoteCounts with EverPyPro.get_account_stats."""
+import unittest
+
+from tests.fakes import FakeAccount, make_pro
+
+
+class AccountStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.account = FakeAccount()
+        work = self.account.add_notebook("Work")
+        home = self.account.add_notebook("Home")
+        self.account.add_notebook("Empty")
+        lease = self.account.add_tag("lease")
+        keys = self.account.add_tag("keys")
+        self.account.add_tag("unused")
+        self.account.add_note("Lease", "<div>a</div>", home, tag_guids=[lease, keys])
+        self.account.add_note("Keys", "<div>b</div>", home, tag_guids=[keys])
+        self.account.add_note("Plan", "<div>c</div>", work)
+        self.account.add_note("Call", "<div>d</div>", work, tag_guids=[keys])
+        self.account.add_note("Loose", "<div>e</div>", work)
+        trashed = self.account.add_note("Old", "<div>f</div>", work, tag_guids=[lease])
+        self.account.note(trashed).active = False
+        self.my_evernote = make_pro(self.account)
+
+    def test_whole_account(self):
+        stats = self.my_evernote.get_account_stats()
+        self.assertEqual(self.account.counted_queries, ["any:", "-tag:*"])
+        self.assertEqual((stats["notes"], stats["trash"], stats["untagged"]), (5, 1, 2))
+        self.assertEqual(dict(stats["notebooks"]), {"Work": 3, "Home": 2, "Empty": 0})
+        self.assertEqual(list(stats["notebooks"]), ["Empty", "Home", "Work"])
+        self.assertEqual(dict(stats["tags"]), {"lease": 1, "keys": 3, "unused": 0})
+        self.assertEqual(stats["empty_notebooks"], ["Empty"])
+        self.assertEqual(list(stats["sparse_tags"].items()), [("unused", 0), ("lease", 1)])
+
+    def test_untagged_in_a_notebook(self):
+        stats = self.my_evernote.get_account_stats("notebook:Work", sparse_threshold=2)
+        self.assertEqual(self.account.counted_queries, ["notebook:Work", "notebook:Work -tag:*"])
+        self.assertEqual((stats["notes"], stats["untagged"]), (3, 2))
+        self.assertEqual(dict(stats["notebooks"]), {"Work": 3, "Home": 0, "Empty": 0})
+        self.assertEqual(list(stats["sparse_tags"].items()), [("lease", 0), ("unused", 0), ("keys", 1)])
+
+    def test_ored_query_has_no_untagged_count(self):
+        stats = self.my_evernote.get_account_stats("any: tag:lease notebook:Work")
+        self.assertEqual(self.account.counted_queries, ["any: tag:lease notebook:Work"])
+        self.assertIsNone(stats["untagged"])
+        self.assertEqual(stats["notes"], 4)
+
+    def test_without_untagged(self):
+        stats = self.my_evernote.get_account_stats(untagged=False)
+        self.assertEqual(self.account.counted_queries, ["any:"])
+        self.assertNotIn("untagged", stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""The deduplicated BackupStore."""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from everpy_enex import EnexNote, EnexResource, EnexWriter, iter_enex
+from everpy_store import BackupStore
+
+NOTE_HEADER = "<?xml version='1.0' encoding='UTF-8'?><!DOCTYPE en-note SYSTEM 'http://xml.evernote.com/pub/enml2.dtd'><en-note>"
+NOTE_FOOTER = "</en-note>"
+SCAN = os.urandom(100000)
+PHOTO = os.urandom(5000)
+
+
+def make_note(title, *attachments):
+    note = EnexNote(title, NOTE_HEADER + u"<div>{0}</div>".format(title) + NOTE_FOOTER, datetime(2024, 1, 2, 3, 4, 5),
+                    tags=["backup"])
+    note.attributes["author"] = "me"
+    for data in attachments:
+        note.resources.append(EnexResource(data, "image/png", {"file-name": "a.png"}))
+    return note
+
+
+class BackupStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = BackupStore(os.path.join(self.folder, "store"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_enex(self, name, notes):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            with EnexWriter(f) as writer:
+                for note in notes:
+                    writer.write(note)
+        return path
+
+    def objects(self):
+        return sorted(name for shard in os.listdir(self.store.objects_dir)
+                      for name in os.listdir(os.path.join(self.store.objects_dir, shard)))
+
+    def test_objects_are_deduplicated_by_md5(self):
+        first = self.store.add_enex(self.write_enex("a.enex", [make_note("One", SCAN), make_note("Two", SCAN, PHOTO)]))
+        second = self.store.add_enex(self.write_enex("b.enex", [make_note("One", SCAN)]))
+        self.assertEqual(second, first[:1])
+        scan_md5 = hashlib.md5(SCAN).hexdigest()
+        photo_md5 = hashlib.md5(PHOTO).hexdigest()
+        self.assertEqual(self.objects(), sorted(first + [scan_md5, photo_md5]))
+        self.assertEqual(self.store.get_object(scan_md5), SCAN)
+        self.assertEqual(self.store.put_object(PHOTO), photo_md5)
+        self.assertEqual(len(self.objects()), 4)
+
+    def test_restore_round_trip(self):
+        notes = [make_note("One", SCAN), make_note(u"Caf\xe9 & <b>", SCAN, PHOTO), make_note("Empty")]
+        ids = self.store.add_enex(self.write_enex("a.enex", notes))
+        name = self.store.write_snapshot({"Work": {"notes": ids}, "Home": {"notes": ids[2:]}})
+        written = self.store.restore(name, os.path.join(self.folder, "out"))
+        self.assertEqual([os.path.basename(path) for path in written], ["Home.enex", "Work.enex"])
+
+        restored = list(iter_enex(written[1]))
+        self.assertEqual(len(restored), 3)
+        for original, note in zip(notes, restored):
+            self.assertEqual(note.title, original.title)
+            self.assertEqual(note.content, original.content)
+            self.assertEqual(note.tags, ["backup"])
+            self.assertEqual(note.attributes.get("author"), "me")
+            self.assertEqual([(res.data, res.mime, res.attributes.get("file-name")) for res in note.resources],
+                             [(res.data, "image/png", "a.png") for res in original.resources])
+        self.assertEqual([note.title for note in iter_enex(written[0])], ["Empty"])
+
+    def test_gc_removes_only_unreferenced_objects(self):
+        old = self.store.add_enex(self.write_enex("a.enex", [make_note("Old", SCAN, PHOTO), make_note("Kept", SCAN)]))
+        first = self.store.write_snapshot({"Work": {"notes": old}}, created=datetime(2024, 1, 1))
+        new = self.store.add_enex(self.write_enex("b.enex", [make_note("Kept", SCAN)]))
+        self.store.write_snapshot({"Work": {"notes": new}}, created=datetime(2024, 1, 2))
+        self.assertEqual(self.store.gc(), 0)
+
+        dropped, removed = self.store.prune(1)
+        self.assertEqual((dropped, removed), ([first], 2))
+        self.assertEqual(self.objects(), sorted(new + [hashlib.md5(SCAN).hexdigest()]))
+        self.assertEqual(self.store.prune(1), ([], 0))
+
+    def test_snapshots_in_the_same_second_are_kept_apart(self):
+        created = datetime(2024, 1, 1, 12)
+        names = [self.store.write_snapshot({"Work": {"notes": []}}, created=created, extra={"run": i}) for i in range(3)]
+        self.assertEqual(names, ["20240101T120000", "20240101T120000-1", "20240101T120000-2"])
+        self.assertEqual(self.store.snapshots(), names)
+        self.assertEqual(self.store.latest_snapshot()["run"], 2)
+        self.assertEqual(self.store.read_snapshot(names[0])["run"], 0)
+        self.assertEqual(self.store.prune(2), (names[:1], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
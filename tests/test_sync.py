@@ -0,0 +1,95 @@
+"""LocalMirror.sync against the fake note store."""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from everpy_sync import LocalMirror
+from tests.fakes import FakeAccount, FakeNoteStore
+
+
+class CountingNoteStore(FakeNoteStore):
+    """FakeNoteStore that counts the sync calls made on it."""
+
+    def __init__(self, account):
+        super(CountingNoteStore, self).__init__(account)
+        self.calls = []
+
+    def getSyncState(self):
+        self.calls.append("getSyncState")
+        return super(CountingNoteStore, self).getSyncState()
+
+    def getFilteredSyncChunk(self, after_usn, max_entries, sync_filter):
+        self.calls.append(("getFilteredSyncChunk", after_usn, sync_filter.includeExpunged))
+        return super(CountingNoteStore, self).getFilteredSyncChunk(after_usn, max_entries, sync_filter)
+
+
+class LocalMirrorSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.account = FakeAccount()
+        self.work = self.account.add_notebook("Work")
+        self.home = self.account.add_notebook("Home")
+        tag = self.account.add_tag("lease")
+        for i in range(5):
+            self.account.add_note("Work {0}".format(i), "<div>work</div>", self.work, tag_guids=[tag])
+        self.account.add_note("Home", "<div>home</div>", self.home)
+        self.mirror = LocalMirror(os.path.join(self.folder, "mirror.db"))
+        self.store = CountingNoteStore(self.account)
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.folder)
+
+    def counts(self):
+        return dict((name, stats[0]) for name, stats in self.mirror.notebook_stats().items())
+
+    def test_first_sync_is_full_and_chunked(self):
+        summary = self.mirror.sync(self.store, chunk_size=3)
+        self.assertTrue(summary.full)
+        self.assertEqual(summary.chunks, 3)
+        self.assertEqual(summary.updated, 9)
+        self.assertEqual(self.mirror.last_usn, self.account.usn)
+        self.assertEqual(self.counts(), {"Work": 5, "Home": 1})
+        self.assertEqual([name for _, name, _ in self.mirror.notebooks()], ["Home", "Work"])
+        # A full sync does not ask for expunged objects.
+        self.assertEqual(self.store.calls[1], ("getFilteredSyncChunk", 0, False))
+
+    def test_unchanged_account_costs_one_call(self):
+        self.mirror.sync(self.store)
+        self.store.calls = []
+        summary = self.mirror.sync(self.store)
+        self.assertEqual(self.store.calls, ["getSyncState"])
+        self.assertEqual(summary.chunks, 0)
+        self.assertIn("Already up to date", str(summary))
+
+    def test_incremental_sync_applies_expunges(self):
+        self.mirror.sync(self.store)
+        last_usn = self.mirror.last_usn
+        self.account.expunge_note(self.account.notes[0].guid)
+        self.account.add_note("Home 2", "<div>home</div>", self.home)
+        self.store.calls = []
+        summary = self.mirror.sync(self.store)
+        self.assertFalse(summary.full)
+        self.assertEqual((summary.updated, summary.expunged), (1, 1))
+        self.assertEqual(self.store.calls[1], ("getFilteredSyncChunk", last_usn, True))
+        self.assertEqual(self.counts(), {"Work": 4, "Home": 2})
+
+    def test_full_sync_before_starts_over(self):
+        self.mirror.sync(self.store)
+        # The service dropped the expunge records the mirror would need to catch up.
+        self.account.expunge_note(self.account.notes[0].guid)
+        self.account.expunged = []
+        self.account.full_sync_before = int(time.time() * 1000) + 1000
+        self.store.calls = []
+        summary = self.mirror.sync(self.store)
+        self.assertTrue(summary.full)
+        self.assertEqual(self.store.calls[1], ("getFilteredSyncChunk", 0, False))
+        self.assertEqual(self.counts(), {"Work": 4, "Home": 1})
+        self.assertEqual(self.mirror.last_usn, self.account.usn)
+
+
+if __name__ == "__main__":
+    unittest.main()
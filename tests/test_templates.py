@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Compiled note templates, template data files and EverPyPro.create_notes_from_template."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from everpy_enml import ENML_FOOTER, ENML_HEADER
+from everpy_templates import Template, TemplateCache, iter_rows, load_template, template_cache, template_tokens
+from tests.fakes import FakeAccount, make_pro
+
+CARD = "<div><b>${1:Card title}</b> ${2:Owner}</div><div>${1}</div>"
+
+
+def native(text):
+    """Templates render to str, utf-8 bytes on python 2."""
+    return text.encode("utf-8") if str is bytes else text
+
+
+class TemplateTest(unittest.TestCase):
+
+    def test_compiled_slots(self):
+        template = Template(CARD)
+        self.assertEqual(template.literals, ["<div><b>", "</b> ", "</div><div>", "</div>"])
+        self.assertEqual(template.slots, ["1", "2", "1"])
+        self.assertEqual(list(template.tokens.items()), [("1", "Card title"), ("2", "Owner")])
+        self.assertEqual(list(template_tokens(CARD).items()),
+                         [("1", {"name": "Card title", "val": None}), ("2", {"name": "Owner", "val": None})])
+
+    def test_render(self):
+        template = Template(CARD)
+        values = {"1": "<i>Fix</i> & ship", "2": None}
+        self.assertEqual(template.render(values), "<div><b><i>Fix</i> & ship</b> </div><div><i>Fix</i> & ship</div>")
+        self.assertEqual(template.render(values, escape_values=True),
+                         "<div><b>&lt;i&gt;Fix&lt;/i&gt; &amp; ship</b> </div><div>&lt;i&gt;Fix&lt;/i&gt; &amp; ship</div>")
+        self.assertEqual(Template("no tokens").render({}), "no tokens")
+
+    def test_rows_by_id_name_or_position(self):
+        template = Template(CARD)
+        self.assertEqual(template.values_for({"1": "a", " Owner ": "b", "unknown": "c"}), {"1": "a", "2": "b"})
+        self.assertEqual(template.values_for(["a", 2, "ignored"]), {"1": "a", "2": "2"})
+        self.assertEqual(template.render_row({"Card title": "x<y"}), "<div><b>x&lt;y</b> </div><div>x&lt;y</div>")
+
+
+class TemplateDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.template_file = self.write("card.txt", CARD)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(text.encode("utf-8"))
+        return path
+
+    def rendered(self, path):
+        template = Template(CARD)
+        return [template.render_row(row) for row in iter_rows(path)]
+
+    def test_csv_and_json_lines_give_the_same_rows(self):
+        expected = ["<div><b>Lease</b> Ann</div><div>Lease</div>",
+                    native(u"<div><b>Caf\xe9 &amp; co</b> Bo</div><div>Caf\xe9 &amp; co</div>")]
+        csv_file = self.write("rows.csv", u"Card title,2\nLease,Ann\nCaf\xe9 & co,Bo\n")
+        jsonl_file = self.write("rows.jsonl", u'{"1": "Lease", "Owner": "Ann"}\n\n["Caf\\u00e9 & co", "Bo"]\n')
+        self.assertEqual(self.rendered(csv_file), expected)
+        self.assertEqual(self.rendered(jsonl_file), expected)
+
+    def test_create_one_note_with_every_row(self):
+        account = FakeAccount()
+        account.add_notebook("Cards")
+        my_evernote = make_pro(account)
+        data_file = self.write("rows.jsonl", u'["Lease", "Ann"]\n["Keys", "Bo"]\n')
+        note = my_evernote.create_notes_from_template(self.template_file, data_file, notebook="Cards", title="Board")
+        self.assertEqual(len(account.notes), 1)
+        self.assertEqual((note.title, note.notebookGuid), ("Board", account.notebooks[0].guid))
+        self.assertEqual(note.content, ENML_HEADER + "<div><b>Lease</b> Ann</div><div>Lease</div>"
+                                                     "<div><b>Keys</b> Bo</div><div>Keys</div>" + ENML_FOOTER)
+
+    def test_create_a_note_per_row(self):
+        account = FakeAccount()
+        my_evernote = make_pro(account)
+        data_file = self.write("rows.csv", u"1,2\nLease,Ann\nA<B,Bo\n")
+        results = list(my_evernote.create_notes_from_template(self.template_file, data_file, per_note=True,
+                                                              title="Card ${1} for ${2:Owner}", workers=2))
+        self.assertEqual([error for _, _, error in results], [None, None])
+        self.assertEqual([note.title for _, note, _ in results], ["Card Lease for Ann", "Card A<B for Bo"])
+        self.assertEqual(results[1][1].content, ENML_HEADER + "<div><b>A&lt;B</b> Bo</div><div>A&lt;B</div>" + ENML_FOOTER)
+        self.assertEqual(len(account.notes), 2)
+
+
+class TemplateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "card.txt")
+        self.write(CARD)
+        self.cache = TemplateCache(max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, text, mtime=1500000000):
+        with open(self.path, "w") as f:
+            f.write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_compiled_once(self):
+        first = self.cache.get(self.path)
+        self.assertIs(self.cache.get(self.path), first)
+        self.assertEqual(first.text, CARD)
+
+    def test_size_change_recompiles(self):
+        first = self.cache.get(self.path)
+        self.write(CARD + "<div>${3:Due}</div>")
+        second = self.cache.get(self.path)
+        self.assertIsNot(second, first)
+        self.assertEqual(list(second.tokens), ["1", "2", "3"])
+        # The old version is dropped rather than kept until it is pushed out.
+        self.assertEqual(list(self.cache._templates), [TemplateCache.key(self.path)])
+
+    def test_mtime_change_recompiles(self):
+        first = self.cache.get(self.path)
+        self.write(CARD.replace("Owner", "Owned"), mtime=1500000100)
+        second = self.cache.get(self.path)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.tokens["2"], "Owned")
+
+    def test_least_recently_used_is_dropped(self):
+        paths = [self.path]
+        for name in ("a.txt", "b.txt"):
+            paths.append(os.path.join(self.folder, name))
+            with open(paths[-1], "w") as f:
+                f.write(name)
+        first = self.cache.get(paths[0])
+        self.cache.get(paths[1])
+        self.assertIs(self.cache.get(paths[0]), first)
+        self.cache.get(paths[2])
+        self.assertEqual(sorted(key[0] for key in self.cache._templates),
+                         sorted(os.path.abspath(path) for path in (paths[0], paths[2])))
+        self.cache.clear()
+        self.assertIsNot(self.cache.get(paths[0]), first)
+
+    def test_load_template_uses_the_process_cache(self):
+        template_cache.clear()
+        self.assertIs(load_template(self.path), load_template(self.path))
+        self.assertIs(template_cache.get(self.path), load_template(self.path))
+        template_cache.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Bulk retagging, moving and attribute changes with EverPyPro.update_metadata."""
+import unittest
+
+from tests.fakes import FakeAccount, make_pro
+
+
+class UpdateMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.account = FakeAccount()
+        self.inbox = self.account.add_notebook("Inbox")
+        self.todo = self.account.add_tag("todo")
+        self.done = self.account.add_tag("done")
+        self.notes = [
+            self.account.add_note("Both", "<div>a</div>", self.inbox, tag_guids=[self.todo, self.done]),
+            self.account.add_note("Todo", "<div>b</div>", self.inbox, tag_guids=[self.todo]),
+            self.account.add_note("Untagged", "<div>c</div>", self.inbox),
+        ]
+        self.my_evernote = make_pro(self.account)
+
+    def tags_of(self, guid):
+        return self.account.note(guid).tagGuids or []
+
+    def test_add_and_remove_tags(self):
+        summary = self.my_evernote.update_metadata(add_tags=["done"], remove_tags=["todo"])
+        self.assertEqual((summary.scanned, summary.updated, summary.errors), (3, 3, 0))
+        for guid in self.notes:
+            self.assertEqual(self.tags_of(guid), [self.done])
+
+        self.account.updates = []
+        summary = self.my_evernote.update_metadata(add_tags=["done"], remove_tags=["todo"])
+        self.assertEqual((summary.scanned, summary.updated), (3, 0))
+        self.assertEqual(self.account.updates, [])
+
+    def test_only_notes_that_change_are_updated(self):
+        summary = self.my_evernote.update_metadata(remove_tags=["done"])
+        self.assertEqual(summary.updated, 1)
+        self.assertEqual(self.account.updates, [self.notes[0]])
+        self.assertEqual(self.tags_of(self.notes[0]), [self.todo])
+
+    def test_missing_tags_are_created(self):
+        self.my_evernote.update_metadata(add_tags=["review"])
+        review = [tag.guid for tag in self.account.tags if tag.name == "review"]
+        self.assertEqual(len(review), 1)
+        self.assertEqual(self.tags_of(self.notes[1]), [self.todo, review[0]])
+        self.assertEqual(self.tags_of(self.notes[2]), review)
+
+    def test_resolve_tags(self):
+        self.assertEqual(self.my_evernote._resolve_tags(["todo", "nope"]), set([self.todo]))
+        self.assertEqual(len(self.account.tags), 2)
+        guids = self.my_evernote._resolve_tags(["todo", "nope"], create=True)
+        self.assertEqual(len(self.account.tags), 3)
+        self.assertEqual(guids, set([self.todo, self.account.tags[-1].guid]))
+
+    def test_removing_an_unknown_tag_changes_nothing(self):
+        summary = self.my_evernote.update_metadata(remove_tags=["nope"])
+        self.assertEqual((summary.scanned, summary.updated, summary.errors), (3, 0, 0))
+        self.assertEqual(len(self.account.tags), 2)
+
+    def test_move_to_a_new_notebook_and_set_attributes(self):
+        before = [(self.account.note(guid).content, self.tags_of(guid)) for guid in self.notes]
+        summary = self.my_evernote.update_metadata(notebook="Archive", attributes={"author": "me"})
+        self.assertEqual(summary.updated, 3)
+        archive = [notebook.guid for notebook in self.account.notebooks if notebook.name == "Archive"]
+        self.assertEqual(len(archive), 1)
+        for guid, (content, tags) in zip(self.notes, before):
+            note = self.account.note(guid)
+            self.assertEqual(note.notebookGuid, archive[0])
+            self.assertEqual(note.attributes.author, "me")
+            self.assertEqual((note.content, self.tags_of(guid)), (content, tags))
+
+    def test_failed_updates_are_counted(self):
+        self.account.failing.add(self.notes[1])
+        results = list(self.my_evernote.iter_update_metadata(add_tags=["done"]))
+        self.assertEqual([(note.guid, updated) for note, updated, _ in results],
+                         [(self.notes[0], False), (self.notes[1], False), (self.notes[2], True)])
+        self.assertEqual(results[1][2].key, self.notes[1])
+        self.assertEqual(self.tags_of(self.notes[2]), [self.done])
+
+
+if __name__ == "__main__":
+    unittest.main()